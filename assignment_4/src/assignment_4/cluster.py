@@ -0,0 +1,186 @@
+from scipy import ndimage
+import numpy as np
+import math
+
+#-------------------------------------------------------------------------------
+# Turns particle scores into weights that sum to 1. Scores are not
+# probabilities and can be negative, so they are first scaled to [0, 1] the
+# way resample_set does. Equal scores give equal weights.
+# Parameters:
+#   weights   float array (N,) of particle scores
+# Return:
+#   float array (N,) of weights
+def normalized_weights(weights):
+  weights = np.asarray(weights, dtype=float)
+  if len(weights) == 0:
+    return weights
+  min_weight = min(1, weights.min())
+  max_weight = max(0, weights.max())
+  if max_weight > min_weight:
+    weights = (weights - min_weight)/(max_weight - min_weight)
+  # All scores equal, or all at the minimum
+  if max_weight <= min_weight or weights.sum() <= 0:
+    weights = np.ones(len(weights))
+  return weights/weights.sum()
+
+#-------------------------------------------------------------------------------
+# Clusters poses on a grid. Poses are binned in (x, y, theta) and bins that
+# touch, including across the wrap of theta from 2*pi to 0, form a cluster.
+# Parameters:
+#   poses       float array (N, 3) of poses (x, y, theta)
+#   cell_size   size of the position bins
+#   angle_bins  number of heading bins over 2*pi
+# Return:
+#   int array (N,) of cluster labels, from 0
+def grid_clusters(poses, cell_size=0.5, angle_bins=8):
+  poses = np.asarray(poses, dtype=float).reshape(-1, 3)
+  if len(poses) == 0:
+    return np.zeros(0, dtype=int)
+  ix = np.floor((poses[:, 0] - poses[:, 0].min())/cell_size).astype(np.intp)
+  iy = np.floor((poses[:, 1] - poses[:, 1].min())/cell_size).astype(np.intp)
+  it = np.floor(np.mod(poses[:, 2], 2*math.pi)/(2*math.pi/angle_bins)).astype(np.intp) % angle_bins
+  occupied = np.zeros((ix.max() + 1, iy.max() + 1, angle_bins), dtype=bool)
+  occupied[ix, iy, it] = True
+  bins, n = ndimage.label(occupied, structure=np.ones((3, 3, 3)))
+
+  # Merge the clusters that touch across the wrap of theta
+  parent = np.arange(n + 1)
+  def find(label):
+    while parent[label] != label:
+      label = parent[label]
+    return label
+  first = bins[:, :, 0]
+  last = np.pad(bins[:, :, -1], 1, mode='constant')
+  width, height = first.shape
+  for dx in (-1, 0, 1):
+    for dy in (-1, 0, 1):
+      neighbour = last[1+dx:1+dx+width, 1+dy:1+dy+height]
+      touching = (first > 0) & (neighbour > 0)
+      for a, b in set(zip(first[touching].tolist(), neighbour[touching].tolist())):
+        a, b = find(a), find(b)
+        if a != b:
+          parent[max(a, b)] = min(a, b)
+  roots = np.array([find(label) for label in range(n + 1)])
+  labels = roots[bins[ix, iy, it]]
+  return np.unique(labels, return_inverse=True)[1].ravel()
+
+#-------------------------------------------------------------------------------
+# Clusters poses with weighted k-means. Headings are compared through their
+# unit vectors scaled by angle_scale, so they wrap around.
+# Parameters:
+#   poses         float array (N, 3) of poses (x, y, theta)
+#   weights       float array (N,) of particle scores, see normalized_weights
+#   k             number of clusters
+#   angle_scale   distance of a heading difference of one radian, in units of
+#                 position
+#   iterations    most k-means iterations
+# Return:
+#   int array (N,) of cluster labels, from 0
+def kmeans_clusters(poses, weights, k, angle_scale=1.0, iterations=20):
+  poses = np.asarray(poses, dtype=float).reshape(-1, 3)
+  weights = normalized_weights(weights) + 1e-12
+  features = np.column_stack((poses[:, 0], poses[:, 1],
+                              angle_scale*np.cos(poses[:, 2]), angle_scale*np.sin(poses[:, 2])))
+  k = min(k, len(poses))
+  if k == 0:
+    return np.zeros(0, dtype=int)
+
+  # Start from the heaviest pose, then add the poses farthest from the centers
+  # so far, weighted by their weight
+  centers = [features[np.argmax(weights)]]
+  distances = np.sum((features - centers[0])**2, axis=1)
+  for i in range(1, k):
+    centers.append(features[np.argmax(distances*weights)])
+    distances = np.minimum(distances, np.sum((features - centers[-1])**2, axis=1))
+  centers = np.array(centers)
+
+  labels = None
+  for i in range(iterations):
+    distances = np.sum((features[:, None, :] - centers[None, :, :])**2, axis=2)
+    new_labels = np.argmin(distances, axis=1)
+    if labels is not None and np.array_equal(labels, new_labels):
+      break
+    labels = new_labels
+    for j in range(k):
+      members = labels == j
+      if members.any():
+        centers[j] = np.average(features[members], axis=0, weights=weights[members])
+  return np.unique(labels, return_inverse=True)[1].ravel()
+
+#-------------------------------------------------------------------------------
+# A cluster of particles.
+#   pose          weighted mean pose (x, y, theta), with the circular mean of
+#                 the headings
+#   mass          fraction of the total weight in the cluster
+#   spread        weighted RMS distance of the particles from the mean position
+#   angle_spread  weighted circular standard deviation of the headings
+#   count         number of particles
+class Hypothesis(object):
+
+  def __init__(self, pose, mass, spread, angle_spread, count):
+    self.pose = pose
+    self.mass = mass
+    self.spread = spread
+    self.angle_spread = angle_spread
+    self.count = count
+
+  def __repr__(self):
+    return 'Hypothesis(pose=(%.3f, %.3f, %.3f), mass=%.3f, spread=%.3f, angle_spread=%.3f, count=%d)' % (
+      self.pose + (self.mass, self.spread, self.angle_spread, self.count))
+
+#-------------------------------------------------------------------------------
+# Summarizes clusters of particles, heaviest first
+# Parameters:
+#   poses     float array (N, 3) of poses (x, y, theta)
+#   weights   float array (N,) of particle scores, see normalized_weights
+#   labels    int array (N,) of cluster labels
+# Return:
+#   list of Hypothesis
+def hypotheses(poses, weights, labels):
+  poses = np.asarray(poses, dtype=float).reshape(-1, 3)
+  weights = normalized_weights(weights)
+  result = []
+  for label in np.unique(labels):
+    members = labels == label
+    w = weights[members]
+    mass = w.sum()
+    w = w/mass if mass > 0 else np.ones(len(w))/len(w)
+    x, y, theta = poses[members].T
+    mean_x, mean_y = np.dot(w, x), np.dot(w, y)
+    c, s = np.dot(w, np.cos(theta)), np.dot(w, np.sin(theta))
+    length = min(1.0, math.hypot(c, s))
+    spread = math.sqrt(np.dot(w, (x - mean_x)**2 + (y - mean_y)**2))
+    angle_spread = math.sqrt(max(0.0, -2*math.log(length))) if length > 0 else math.pi
+    result.append(Hypothesis((float(mean_x), float(mean_y), math.atan2(s, c)), float(mass),
+                             spread, angle_spread, int(members.sum())))
+  result.sort(key=lambda hypothesis: -hypothesis.mass)
+  return result
+
+#-------------------------------------------------------------------------------
+# Decides when a particle filter has converged: the heaviest hypothesis holds
+# at least min_mass of the weight, and its spread and angle spread are at most
+# max_spread and max_angle_spread, for patience iterations in a row.
+class Convergence(object):
+
+  def __init__(self, min_mass=0.8, max_spread=0.3, max_angle_spread=0.3, patience=1):
+    self.min_mass = min_mass
+    self.max_spread = max_spread
+    self.max_angle_spread = max_angle_spread
+    self.patience = patience
+    self.streak = 0
+
+  #-----------------------------------------------------------------------------
+  # Returns True when one hypothesis holds at least min_mass of the weight
+  def dominated(self, hypotheses):
+    return len(hypotheses) > 0 and hypotheses[0].mass >= self.min_mass
+
+  #-----------------------------------------------------------------------------
+  # Updates the check with the hypotheses of one iteration and returns True
+  # once the filter has converged
+  def update(self, hypotheses):
+    if (self.dominated(hypotheses) and hypotheses[0].spread <= self.max_spread and
+        hypotheses[0].angle_spread <= self.max_angle_spread):
+      self.streak += 1
+    else:
+      self.streak = 0
+    return self.streak >= self.patience
@@ -0,0 +1,290 @@
+from collections import OrderedDict
+import hashlib
+import numpy as np
+
+# Occupancy values used by nav_msgs/OccupancyGrid
+FREE = 0
+OCCUPIED = 100
+UNKNOWN = -1
+
+# Data derived from the last MAX_MAPS maps used (arrays, indexes, hashes),
+# keyed by map and then by name, least recently used first. A map is keyed by
+# map_hash, so a copy of a map or an earlier map used again finds its data.
+# The hash of each data sequence is itself kept for the last MAX_MAPS
+# sequences seen, by identity, so that a map is hashed only once. A TiledGrid
+# is never changed (patched returns a new one) and is its own key, which saves
+# decoding every tile to hash it.
+MAX_MAPS = 4
+_derived = OrderedDict()
+_hashes = []
+
+# Hashes the geometry and an int8 array (height, width) of a map
+def _hash_grid(the_map, grid):
+  info = the_map.info
+  digest = hashlib.sha1()
+  digest.update(('%d %d %r %r %r' % (info.width, info.height, info.resolution,
+                 info.origin.position.x, info.origin.position.y)).encode('ascii'))
+  digest.update(np.ascontiguousarray(grid).tobytes())
+  return digest.hexdigest()
+
+# Returns the derived data of a map, a dict by name. grid, when given, is the
+# array of the map, which then does not have to be converted to be hashed.
+def _entry(the_map, grid=None):
+  data = the_map.data
+  if hasattr(data, 'free_index'):
+    key = data
+  else:
+    known = [key for seen, key in _hashes if seen is data]
+    if known:
+      key = known[0]
+    else:
+      if grid is None:
+        grid = np.asarray(data, dtype=np.int8).reshape(the_map.info.height, the_map.info.width)
+      key = _hash_grid(the_map, grid)
+      _hashes.append((data, key))
+      del _hashes[:-MAX_MAPS]
+  entry = _derived.pop(key, None)
+  if entry is None:
+    entry = {'key': key}
+    if grid is not None:
+      grid.flags.writeable = False
+      entry['array'] = grid
+  _derived[key] = entry
+  while len(_derived) > MAX_MAPS:
+    _derived.popitem(last=False)
+  return entry
+
+def _cached(the_map, name, build):
+  entry = _entry(the_map)
+  if name not in entry:
+    _store(the_map, name, build())
+  return _entry(the_map)[name]
+
+# Stores a derived value of a map, e.g. one that was updated incrementally
+# instead of being built again
+def _store(the_map, name, value):
+  if isinstance(value, np.ndarray):
+    value.flags.writeable = False
+  _entry(the_map, value if name == 'array' else None)[name] = value
+
+#-------------------------------------------------------------------------------
+# Returns the occupancy values of a map as a read only array
+# Parameters:
+#   the_map     map
+# Return:
+#   int8 array of shape (height, width), indexed as grid[y, x]
+def map_array(the_map):
+  def build():
+    grid = np.asarray(the_map.data, dtype=np.int8)
+    return grid.reshape(the_map.info.height, the_map.info.width)
+  return _cached(the_map, 'array', build)
+
+#-------------------------------------------------------------------------------
+# Returns the occupancy values of a map for reading one cell at a time, as
+# ray_tracing does. Indexing a numpy array, and a memory mapped one even more,
+# is several times slower than indexing a list, so array data (e.g. the memory
+# mapped grid of the bag cache) is copied to a list once. Other sequences and
+# TiledGrid are returned as they are.
+# Parameters:
+#   the_map     map
+# Return:
+#   sequence of the occupancy values, indexed as cells[y*width + x]
+def map_cells(the_map):
+  if not isinstance(the_map.data, np.ndarray):
+    return the_map.data
+  return _cached(the_map, 'cells', lambda: the_map.data.tolist())
+
+#-------------------------------------------------------------------------------
+# Returns a boolean mask of the occupied cells of a map
+# Parameters:
+#   the_map     map
+# Return:
+#   bool array of shape (height, width)
+def occupied_mask(the_map):
+  return _cached(the_map, 'occupied', lambda: map_array(the_map) == OCCUPIED)
+
+#-------------------------------------------------------------------------------
+# Returns a hash that identifies the geometry and the contents of a map
+# Parameters:
+#   the_map     map
+# Return:
+#   hex digest string
+def map_hash(the_map):
+  entry = _entry(the_map)
+  if isinstance(entry['key'], str):
+    return entry['key']
+  return _cached(the_map, 'hash', lambda: _hash_grid(the_map, map_array(the_map)))
+
+#-------------------------------------------------------------------------------
+# Converts arrays of real world coordinates to map coordinates. Unlike to_grid
+# the result is not checked against the map bounds, see on_map.
+# Return:
+#   (x, y) integer arrays of map coordinates
+def world_to_grid(x, y, the_map):
+  info = the_map.info
+  gx = np.floor((np.asarray(x) - info.origin.position.x)/info.resolution).astype(np.intp)
+  gy = np.floor((np.asarray(y) - info.origin.position.y)/info.resolution).astype(np.intp)
+  return gx, gy
+
+#-------------------------------------------------------------------------------
+# Converts arrays of map coordinates to the real world coordinates of the cell
+# centers
+def grid_to_world(gx, gy, the_map):
+  info = the_map.info
+  x = info.origin.position.x + (np.asarray(gx) + 0.5)*info.resolution
+  y = info.origin.position.y + (np.asarray(gy) + 0.5)*info.resolution
+  return x, y
+
+#-------------------------------------------------------------------------------
+# Returns a bool array telling which map coordinates are inside the map
+def on_map(gx, gy, the_map):
+  return (gx >= 0) & (gx < the_map.info.width) & (gy >= 0) & (gy < the_map.info.height)
+
+#-------------------------------------------------------------------------------
+# Index of the free cells of a map (known and not occupied), built once per map
+# with free_cell_index. Free cells are stored grouped by square buckets of
+# bucket_size cells (a spatial hash in compressed row form), so that sampling
+# the whole map or only a region costs O(1) per sample.
+#   free        bool array (height, width) of free cells, indexed as [y, x]
+#   cells       flat indices (y*width + x) of the free cells, grouped by bucket
+#   starts      cells[starts[b]:starts[b+1]] are the free cells of bucket b
+class FreeCellIndex(object):
+
+  def __init__(self, the_map, bucket_size=16):
+    self.the_map = the_map
+    self.width = the_map.info.width
+    self.height = the_map.info.height
+    self.bucket_size = bucket_size
+    self.buckets_x = -(-self.width//bucket_size)
+    self.buckets_y = -(-self.height//bucket_size)
+    self.free = map_array(the_map) == FREE
+
+    cells = np.flatnonzero(self.free)
+    y, x = np.divmod(cells, self.width)
+    buckets = (y//bucket_size)*self.buckets_x + x//bucket_size
+    order = np.argsort(buckets, kind='mergesort')
+    self.cells = cells[order]
+    self.starts = np.searchsorted(buckets[order], np.arange(self.buckets_x*self.buckets_y + 1))
+
+  def __len__(self):
+    return len(self.cells)
+
+  #-----------------------------------------------------------------------------
+  # Returns the index of a new version of the map in which only the cells of
+  # a rectangle changed. Only the buckets overlapping the rectangle are built
+  # again.
+  # Parameters:
+  #   the_map     new version of the map, with the same size
+  #   x0, y0      first cell of the rectangle
+  #   x1, y1      end of the rectangle (exclusive)
+  # Return:
+  #   (FreeCellIndex, number of buckets rebuilt)
+  def updated(self, the_map, x0, y0, x1, y1):
+    index = FreeCellIndex.__new__(FreeCellIndex)
+    index.__dict__.update(self.__dict__)
+    index.the_map = the_map
+    grid = map_array(the_map)
+    free = self.free.copy()
+    free[y0:y1, x0:x1] = grid[y0:y1, x0:x1] == FREE
+    index.free = free
+
+    size = self.bucket_size
+    bx0, bx1 = x0//size, (x1 - 1)//size
+    by0, by1 = y0//size, (y1 - 1)//size
+    counts = np.diff(self.starts)
+    pieces = []
+    end = 0
+    for by in range(by0, by1 + 1):
+      first = by*self.buckets_x + bx0
+      last = by*self.buckets_x + bx1
+      # The buckets of a row are contiguous in cells, so the row is replaced
+      # by the free cells of the same buckets in the new map
+      cy0, cx0 = by*size, bx0*size
+      block = free[cy0:cy0 + size, cx0:(bx1 + 1)*size]
+      y, x = np.nonzero(block)
+      buckets = first + x//size
+      order = np.argsort(buckets, kind='mergesort')
+      pieces.append(self.cells[end:self.starts[first]])
+      pieces.append(((y + cy0)*self.width + x + cx0)[order])
+      counts[first:last + 1] = np.bincount(buckets - first, minlength=last - first + 1)
+      end = self.starts[last + 1]
+    pieces.append(self.cells[end:])
+    index.cells = np.concatenate(pieces)
+    index.starts = np.concatenate(([0], np.cumsum(counts)))
+    return index, (bx1 - bx0 + 1)*(by1 - by0 + 1)
+
+  #-----------------------------------------------------------------------------
+  # Returns a bool array telling which map coordinates are free cells
+  def is_free(self, gx, gy):
+    gx = np.asarray(gx)
+    gy = np.asarray(gy)
+    inside = on_map(gx, gy, self.the_map)
+    free = np.zeros(gx.shape, dtype=bool)
+    free[inside] = self.free[gy[inside], gx[inside]]
+    return free
+
+  #-----------------------------------------------------------------------------
+  # Returns a bool array telling which real world positions are in free cells
+  def valid_positions(self, x, y):
+    return self.is_free(*world_to_grid(x, y, self.the_map))
+
+  #-----------------------------------------------------------------------------
+  # Returns n real world positions drawn uniformly from a set of flat cell
+  # indices (e.g. from region_cells), uniformly inside each cell
+  def sample_from(self, cells, n):
+    if len(cells) == 0:
+      raise ValueError('no free cells to sample from')
+    return self._positions(cells[np.random.randint(0, len(cells), n)])
+
+  # Returns a real world position drawn uniformly inside each cell
+  def _positions(self, cells):
+    n = len(cells)
+    gy, gx = np.divmod(cells, self.width)
+    x, y = grid_to_world(gx, gy, self.the_map)
+    res = self.the_map.info.resolution
+    x = x + np.random.uniform(-res/2, res/2, n)
+    y = y + np.random.uniform(-res/2, res/2, n)
+    return x, y
+
+  #-----------------------------------------------------------------------------
+  # Returns n real world positions drawn uniformly from the free cells
+  def sample(self, n):
+    return self.sample_from(self.cells, n)
+
+  #-----------------------------------------------------------------------------
+  # Returns the flat indices of the free cells whose centers are within radius
+  # (meters) of a real world position
+  def region_cells(self, x, y, radius):
+    res = self.the_map.info.resolution
+    (gx,), (gy,) = world_to_grid([x], [y], self.the_map)
+    r = int(np.ceil(radius/res))
+    bx0 = max(0, (gx - r)//self.bucket_size)
+    bx1 = min(self.buckets_x - 1, (gx + r)//self.bucket_size)
+    by0 = max(0, (gy - r)//self.bucket_size)
+    by1 = min(self.buckets_y - 1, (gy + r)//self.bucket_size)
+    if bx0 > bx1 or by0 > by1:
+      return self.cells[:0]
+    slices = []
+    for by in range(by0, by1 + 1):
+      first = by*self.buckets_x + bx0
+      last = by*self.buckets_x + bx1
+      # buckets of a row are contiguous in cells
+      slices.append(self.cells[self.starts[first]:self.starts[last + 1]])
+    cells = np.concatenate(slices)
+    cy, cx = np.divmod(cells, self.width)
+    wx, wy = grid_to_world(cx, cy, self.the_map)
+    return cells[np.hypot(wx - x, wy - y) <= radius]
+
+  #-----------------------------------------------------------------------------
+  # Returns n real world positions drawn uniformly from the free cells within
+  # radius (meters) of a real world position
+  def sample_region(self, x, y, radius, n):
+    return self.sample_from(self.region_cells(x, y, radius), n)
+
+#-------------------------------------------------------------------------------
+# Returns the FreeCellIndex of a map, building it the first time
+def free_cell_index(the_map):
+  # Tiled grids (see tiled.py) index their free cells themselves
+  if hasattr(the_map.data, 'free_index'):
+    return _cached(the_map, 'free_index', lambda: the_map.data.free_index(the_map))
+  return _cached(the_map, 'free_index', lambda: FreeCellIndex(the_map))
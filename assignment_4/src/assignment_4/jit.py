@@ -0,0 +1,84 @@
+try:
+  import numba
+except ImportError:
+  numba = None
+import numpy as np
+import math
+
+#-------------------------------------------------------------------------------
+# Compiled kernels for the laser module, used when numba is installed. They
+# loop over the int8 occupancy grid in nopython mode, with the poses split
+# across threads, and give the same results as the numpy code in
+# assignment_4.laser.
+
+available = numba is not None
+
+if available:
+
+  #-----------------------------------------------------------------------------
+  # Expected ranges of n_beams beams from many poses, see batch_expected_scan
+  # Parameters:
+  #   grid        int8 array (height, width) of occupancy values
+  #   poses       float array (N, 3) of poses in map coordinates
+  #   angles      float array (N, B) of beam angles
+  #   max_range   maximum laser range
+  #   resolution  map resolution
+  # Return:
+  #   float array (N, B) of expected ranges
+  @numba.njit(parallel=True, cache=True)
+  def expected_scans(grid, poses, angles, max_range, resolution):
+    height, width = grid.shape
+    n = angles.shape[0]
+    b = angles.shape[1]
+    max_cells = max_range/resolution
+    out = np.empty((n, b))
+    for p in numba.prange(n):
+      x0 = poses[p, 0]
+      y0 = poses[p, 1]
+      for i in range(b):
+        angle = angles[p, i]
+        dx = math.cos(angle)
+        dy = math.sin(angle)
+        x = int(math.floor(x0))
+        y = int(math.floor(y0))
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+        t_delta_x = abs(1.0/dx) if dx != 0 else np.inf
+        t_delta_y = abs(1.0/dy) if dy != 0 else np.inf
+        t_max_x = 0.5*t_delta_x
+        t_max_y = 0.5*t_delta_y
+        t = 0.0
+        reading = max_range
+        while x >= 0 and x < width and y >= 0 and y < height and t <= max_cells+1:
+          if grid[y, x] == 100:
+            reading = min(math.hypot(x-x0, y-y0)*resolution, max_range)
+            break
+          if t_max_x < t_max_y:
+            t = t_max_x
+            t_max_x += t_delta_x
+            x += step_x
+          else:
+            t = t_max_y
+            t_max_y += t_delta_y
+            y += step_y
+        out[p, i] = reading
+    return out
+
+  #-----------------------------------------------------------------------------
+  # Similarity of a measured scan to many expected scans, see
+  # batch_scan_similarity
+  @numba.njit(parallel=True, cache=True)
+  def scan_similarities(ranges, expected, max_range):
+    n = expected.shape[0]
+    b = expected.shape[1]
+    out = np.empty(n)
+    for p in numba.prange(n):
+      total = 0.0
+      for i in range(b):
+        measured = ranges[i]
+        reading = expected[p, i]
+        if (measured == max_range) != (reading == max_range):
+          continue
+        total += 1 - abs(reading - measured)/max_range
+      out[p] = (total/b)**2
+    return out
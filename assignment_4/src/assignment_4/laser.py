@@ -1,5 +1,9 @@
 from math import sin, cos, atan2, hypot, exp, floor
 from assignment_3.geometry import to_index, to_world, to_grid
+from assignment_4.grid import map_array, map_cells, occupied_mask
+from assignment_4 import jit
+from assignment_4 import stats
+import numpy as np
 import math
 import rospy
 import sys
@@ -49,7 +53,17 @@ def update_angle(old_angle, update_amt):
   return new_angle
 
 
+# Returns an angle in [0, 2*pi)
+def normalize_angle(angle):
+  if math.isnan(angle) or math.isinf(angle):
+    raise ValueError('invalid angle %r' % angle)
+  angle = angle % (2*math.pi)
+  if angle >= 2*math.pi:
+    angle = 0.0
+  return angle
+
 def calc_x(x0, y0, y1, angle):
+  angle = normalize_angle(angle)
   delta_y = y1-y0
   if angle >=0 and angle < math.pi/2:
     theta = angle
@@ -61,14 +75,13 @@ def calc_x(x0, y0, y1, angle):
   elif angle < 3*math.pi/2:
     theta = angle - math.pi
     x1 = delta_y/math.tan(theta)
-  elif angle < 2*math.pi:
+  else:
     theta = 2*math.pi - angle
     x1 = -1*delta_y/math.tan(theta)
-  else:
-    sys.exit(1)
   return math.floor(x1+x0)
 
 def calc_y(x0, y0, x1, angle):
+  angle = normalize_angle(angle)
   delta_x = x1-x0
   if angle >= 0 and angle < math.pi/2:
     theta = angle
@@ -79,11 +92,9 @@ def calc_y(x0, y0, x1, angle):
   elif angle < 3*math.pi/2:
     theta = angle - math.pi
     y1 = delta_x*math.tan(theta)
-  elif angle < 2*math.pi:
+  else:
     theta = 2*math.pi - angle
     y1 = -1*delta_x*math.tan(theta)
-  else:
-    sys.exit(1)
   return math.floor(y1+y0)
 
 #-------------------------------------------------------------------------------
@@ -119,26 +130,54 @@ def get_last_point(x0, y0, angle, width, height):
   return p1
 
 #-------------------------------------------------------------------------------
-# Given a ray find the coordinates of the first occupied cell in a ray
+# Given a ray find the coordinates of the first occupied cell in a ray. The ray
+# starts at the center of its cell and visits the cells it crosses one at a
+# time (grid traversal of Amanatides and Woo), so no list of cells is built and
+# tracing stops at the first occupied cell.
 # Parameters:
-#   x0, y0    map coordinates of a cell containing ray origin
-#   angle     angle of a ray
-#   the_map   map
+#   x0, y0      map coordinates of a cell containing ray origin
+#   angle       angle of a ray
+#   the_map     map
+#   max_cells   if given, the ray is not traced further than this many cells
 # Return:
-#    first occupied cell
-def ray_tracing(x0, y0, angle, the_map):
-  # find the integer coordinates of the last point in the map that this ray will trace
-  # grid coordinates means they are indexes into the map
-  # Given x0, y0, angle and map, return the last point
-  (x1, y1) = get_last_point(x0, y0, angle, the_map.info.width, the_map.info.height)
-  # rospy.loginfo("starting point is (%i, %i), angle is %f and end point is (%i, %i)" %(x0,y0,angle,x1,y1))
-  points = line_seg(x0, y0, x1, y1)
-  for point in points:
-    (x,y) = point
-    index = to_index(x, y, the_map.info.width)
-    if the_map.data[index] == 100:
-      return (x,y)
-  return None
+#    first occupied cell, None if the ray leaves the map or exceeds max_cells
+def ray_tracing(x0, y0, angle, the_map, max_cells=None):
+  width = the_map.info.width
+  height = the_map.info.height
+  data = map_cells(the_map)
+  if max_cells is None:
+    max_cells = width + height
+
+  dx = math.cos(angle)
+  dy = math.sin(angle)
+  x = int(math.floor(x0))
+  y = int(math.floor(y0))
+  step_x = 1 if dx > 0 else -1
+  step_y = 1 if dy > 0 else -1
+  t_delta_x = abs(1.0/dx) if dx != 0 else float('inf')
+  t_delta_y = abs(1.0/dy) if dy != 0 else float('inf')
+  t_max_x = 0.5*t_delta_x
+  t_max_y = 0.5*t_delta_y
+  t = 0
+  hit = None
+
+  while 0 <= x < width and 0 <= y < height and t <= max_cells+1:
+    if data[to_index(x, y, width)] == 100:
+      hit = (x,y)
+      break
+    if t_max_x < t_max_y:
+      t = t_max_x
+      t_max_x += t_delta_x
+      x += step_x
+    else:
+      t = t_max_y
+      t_max_y += t_delta_y
+      y += step_y
+  if stats.enabled:
+    # Every step moves one cell, and the last cell is only visited on a hit
+    stats.count('rays')
+    stats.count('ray_cells', abs(x - int(math.floor(x0))) + abs(y - int(math.floor(y0))) + (hit is not None))
+  return hit
 
 #-------------------------------------------------------------------------------
 # Returns a laser scan that the robot would generate from a given pose in a map
@@ -150,14 +189,21 @@ def ray_tracing(x0, y0, angle, the_map):
 #   n_readings  number of readings in a laserscan
 #   max_range   maxiimum laser range
 #   the_map     map
+#   table       optional RangeTable of the map to read the ranges from
+#   beams       optional indices of the readings to compute, see select_beams
 # Return:
-#   array of expected ranges
-def expected_scan(x, y, theta, min_angle, increment, n_readings, max_range, the_map):
+#   array of expected ranges (one per beam when beams is given)
+def expected_scan(x, y, theta, min_angle, increment, n_readings, max_range, the_map, table=None, beams=None):
+  if table is not None:
+    return table.expected_scans([(x, y, theta)], min_angle, increment, n_readings, max_range, the_map, beams)[0].tolist()
   readings = []
-  for i in range(0,n_readings):
+  max_cells = max_range/the_map.info.resolution
+  if beams is None:
+    beams = range(0,n_readings)
+  for i in beams:
     measurement_angle = theta + min_angle + i*increment
     # rospy.loginfo("measurement angle is %f" %(measurement_angle))
-    end_point = ray_tracing(x, y, measurement_angle, the_map)
+    end_point = ray_tracing(x, y, measurement_angle, the_map, max_cells)
     if end_point is None:
       readings.append(max_range)
       continue
@@ -179,9 +225,13 @@ def expected_scan(x, y, theta, min_angle, increment, n_readings, max_range, the_
 #   ranges0     first scan
 #   ranges1     second scan
 #   max_range   maximum laser range
+#   beams       optional indices of the readings to compare; ranges0 is then a
+#               full scan and ranges1 holds only the readings of these beams
 # Return:
 #   similarity score between two scans
-def scan_similarity(ranges0, ranges1, max_range):
+def scan_similarity(ranges0, ranges1, max_range, beams=None):
+  if beams is not None:
+    ranges0 = [ranges0[i] for i in beams]
   total_score = 0
   for i in range(0, len(ranges0)):
     distance0 = ranges0[i]
@@ -198,3 +248,224 @@ def scan_similarity(ranges0, ranges1, max_range):
     total_score += score
   return math.pow(total_score/len(ranges0),2)
 
+
+#-------------------------------------------------------------------------------
+# Casts many rays at once through a boolean occupancy grid. All rays are
+# stepped together one cell at a time (grid traversal of Amanatides and Woo),
+# so the python loop runs once per cell of the longest ray rather than once per
+# cell of every ray.
+# Parameters:
+#   occupied    bool array of shape (height, width), indexed as [y, x]
+#   x0, y0      arrays of ray origins in map coordinates (cell indices)
+#   angles      array of ray angles
+#   max_cells   rays are not traced further than this many cells
+# Return:
+#   array of distances (in cells) from the origin cell to the first occupied
+#   cell, inf for rays that leave the map or exceed max_cells
+def cast_rays(occupied, x0, y0, angles, max_cells):
+  height, width = occupied.shape
+  x0 = np.asarray(x0, dtype=float).ravel()
+  y0 = np.asarray(y0, dtype=float).ravel()
+  angles = np.asarray(angles, dtype=float).ravel()
+  distances = np.empty(angles.size)
+  distances.fill(np.inf)
+
+  # Rays start at the center of the origin cell
+  dx = np.cos(angles)
+  dy = np.sin(angles)
+  ix = np.floor(x0).astype(np.intp)
+  iy = np.floor(y0).astype(np.intp)
+  step_x = np.where(dx > 0, 1, -1)
+  step_y = np.where(dy > 0, 1, -1)
+  with np.errstate(divide='ignore'):
+    t_delta_x = np.abs(1.0/dx)
+    t_delta_y = np.abs(1.0/dy)
+  t_max_x = 0.5*t_delta_x
+  t_max_y = 0.5*t_delta_y
+
+  # Only the rays that are still being traced are kept in the arrays below
+  ray = np.flatnonzero((ix >= 0) & (ix < width) & (iy >= 0) & (iy < height))
+  x0, y0, ix, iy = x0[ray], y0[ray], ix[ray], iy[ray]
+  step_x, step_y = step_x[ray], step_y[ray]
+  t_delta_x, t_delta_y = t_delta_x[ray], t_delta_y[ray]
+  t_max_x, t_max_y = t_max_x[ray], t_max_y[ray]
+  stats.count('rays', angles.size)
+
+  while ray.size > 0:
+    stats.count('ray_cells', ray.size)
+    hit = occupied[iy, ix]
+    if hit.any():
+      distances[ray[hit]] = np.hypot(ix[hit]-x0[hit], iy[hit]-y0[hit])
+
+    # Advance every ray to the next cell along its line
+    move_x = t_max_x < t_max_y
+    t = np.where(move_x, t_max_x, t_max_y)
+    ix = ix + np.where(move_x, step_x, 0)
+    iy = iy + np.where(move_x, 0, step_y)
+    t_max_x = t_max_x + np.where(move_x, t_delta_x, 0)
+    t_max_y = t_max_y + np.where(move_x, 0, t_delta_y)
+
+    keep = ~hit & (t <= max_cells+1) & (ix >= 0) & (ix < width) & (iy >= 0) & (iy < height)
+    if not keep.all():
+      ray, x0, y0, ix, iy = ray[keep], x0[keep], y0[keep], ix[keep], iy[keep]
+      step_x, step_y = step_x[keep], step_y[keep]
+      t_delta_x, t_delta_y = t_delta_x[keep], t_delta_y[keep]
+      t_max_x, t_max_y = t_max_x[keep], t_max_y[keep]
+
+  return distances
+
+#-------------------------------------------------------------------------------
+# Backend of batch_expected_scan and batch_scan_similarity
+#   'numpy'   vectorized numpy code, the default
+#   'numba'   compiled kernels of assignment_4.jit, needs numba
+#   'python'  one pose at a time with expected_scan and scan_similarity, the
+#             reference the other backends are checked against
+BACKENDS = ['numpy', 'numba', 'python']
+_backend = 'numpy'
+
+# Selects the backend by name. 'auto' picks numba when it is installed. Asking
+# for numba without it installed falls back to numpy with a warning.
+def set_backend(name):
+  global _backend
+  if name == 'auto':
+    name = 'numba' if jit.available else 'numpy'
+  if name not in BACKENDS:
+    raise ValueError('unknown backend %r, expected one of %s' % (name, ', '.join(BACKENDS)))
+  if name == 'numba' and not jit.available:
+    rospy.logwarn('numba is not installed, using the numpy backend')
+    name = 'numpy'
+  _backend = name
+
+def get_backend():
+  return _backend
+
+#-------------------------------------------------------------------------------
+# Returns the laser scans that the robot would generate from many poses in a
+# map. Rays visit the same cells as in ray_tracing, so the readings are the
+# ones expected_scan returns.
+# Parameters:
+#   poses       array of shape (N, 3) of poses (x, y, theta), with x and y in
+#               map coordinates
+#   min_angle   minimum angle of laserscan
+#   increment   laserscan increment
+#   n_readings  number of readings in a laserscan
+#   max_range   maxiimum laser range
+#   the_map     map
+#   table       optional RangeTable of the map to read the ranges from
+#   beams       optional indices of the readings to compute, see select_beams
+# Return:
+#   array of shape (N, n_readings) of expected ranges, (N, len(beams)) when
+#   beams is given
+def batch_expected_scan(poses, min_angle, increment, n_readings, max_range, the_map, table=None, beams=None):
+  if table is not None:
+    return table.expected_scans(poses, min_angle, increment, n_readings, max_range, the_map, beams)
+  if beams is None:
+    beams = np.arange(n_readings)
+  poses = np.asarray(poses, dtype=float).reshape(-1, 3)
+  if _backend == 'python':
+    return np.array([expected_scan(x, y, theta, min_angle, increment, n_readings, max_range, the_map, beams=beams)
+                     for x, y, theta in poses]).reshape(len(poses), len(beams))
+  resolution = the_map.info.resolution
+  angles = poses[:, 2:3] + min_angle + increment*np.asarray(beams)
+  if _backend == 'numba':
+    # The kernel does not count the cells it visits, so its rays are kept
+    # out of rays and cells/ray
+    stats.count('jit_rays', angles.size)
+    return jit.expected_scans(map_array(the_map), poses, angles, float(max_range), float(resolution))
+  x0 = np.repeat(poses[:, 0], len(beams))
+  y0 = np.repeat(poses[:, 1], len(beams))
+  distances = cast_rays(occupied_mask(the_map), x0, y0, angles, max_range/resolution)
+  ranges = np.minimum(distances*resolution, max_range)
+  return ranges.reshape(len(poses), len(beams))
+
+#-------------------------------------------------------------------------------
+# Computes the similarity between a laserscan reading and many expected scans,
+# with the same scoring as scan_similarity.
+# Parameters:
+#   ranges      measured scan
+#   expected    array of shape (N, len(ranges)) of expected scans
+#   max_range   maximum laser range
+#   beams       optional indices of the readings to compare; expected then
+#               holds only the readings of these beams
+# Return:
+#   array of N similarity scores
+def batch_scan_similarity(ranges, expected, max_range, beams=None):
+  ranges = np.asarray(ranges, dtype=float)
+  if beams is not None:
+    ranges = ranges[beams]
+  expected = np.asarray(expected, dtype=float).reshape(-1, len(ranges))
+  if _backend == 'numba':
+    return jit.scan_similarities(ranges, expected, float(max_range))
+  if _backend == 'python':
+    return np.array([scan_similarity(ranges, scan, max_range) for scan in expected])
+  scores = 1 - np.abs(expected - ranges)/max_range
+  # A beam that reaches max_range in only one of the scans scores 0
+  mismatch = (expected == max_range) != (ranges == max_range)
+  scores[mismatch] = 0
+  return np.square(scores.mean(axis=1))
+
+#-------------------------------------------------------------------------------
+# Returns the indices of the k highest scores, best first. Ties go to the lower
+# index.
+def top_k(scores, k):
+  scores = np.asarray(scores)
+  k = min(k, len(scores))
+  if k <= 0:
+    return np.zeros(0, dtype=np.intp)
+  if k < len(scores):
+    candidates = np.argpartition(-scores, k-1)[:k]
+    # argpartition may cut a tie at the k-th score arbitrarily
+    candidates = np.flatnonzero(scores >= scores[candidates].min())
+  else:
+    candidates = np.arange(len(scores))
+  order = np.argsort(-scores[candidates], kind='mergesort')
+  return candidates[order][:k]
+
+#-------------------------------------------------------------------------------
+# Beam selection. Scoring with a subset of the beams of a scan is cheaper, and
+# most of the information is kept as long as the beams are spread over the
+# scan. The functions below return sorted arrays of beam indices that can be
+# passed as the beams argument of the functions above.
+
+# Every stride-th beam
+def stride_beams(n_readings, stride):
+  return np.arange(0, n_readings, max(1, stride))
+
+# count beams spread evenly over the scan
+def evenly_spaced_beams(n_readings, count):
+  count = max(1, min(count, n_readings))
+  return np.unique(np.round(np.linspace(0, n_readings-1, count)).astype(int))
+
+# count beams chosen at random
+def random_beams(n_readings, count):
+  count = max(1, min(count, n_readings))
+  return np.sort(np.random.choice(n_readings, count, replace=False))
+
+#-------------------------------------------------------------------------------
+# Adaptive beam count. While the particles are spread out a few beams are
+# enough to tell good poses from bad ones; as they converge more beams are used
+# to rank nearby poses.
+#   min_beams, max_beams    range of the number of beams
+#   wide, narrow            particle spreads (meters) at which min_beams and
+#                           max_beams are used; the count is interpolated in
+#                           between
+class AdaptiveBeams(object):
+
+  def __init__(self, n_readings, min_beams=10, max_beams=None, wide=2.0, narrow=0.2):
+    self.n_readings = n_readings
+    self.min_beams = min(min_beams, n_readings)
+    self.max_beams = n_readings if max_beams is None else min(max_beams, n_readings)
+    self.wide = wide
+    self.narrow = narrow
+
+  #-----------------------------------------------------------------------------
+  # Returns the beams to use for particles at the given positions
+  # Parameters:
+  #   positions   array of shape (N, 2) or more columns, real world x and y
+  def select(self, positions):
+    positions = np.asarray(positions, dtype=float)
+    spread = math.sqrt(positions[:, 0].var() + positions[:, 1].var()) if len(positions) else self.wide
+    fraction = (self.wide - spread)/(self.wide - self.narrow)
+    fraction = min(1.0, max(0.0, fraction))
+    count = int(round(self.min_beams + fraction*(self.max_beams - self.min_beams)))
+    return evenly_spaced_beams(self.n_readings, count)
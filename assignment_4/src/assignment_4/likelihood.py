@@ -0,0 +1,61 @@
+from assignment_4.grid import occupied_mask
+from scipy.ndimage import distance_transform_edt
+import numpy as np
+
+#-------------------------------------------------------------------------------
+# Likelihood field sensor model. The distance from every cell to the nearest
+# occupied cell is computed once per map; a pose is scored by looking up the
+# distance at the end point of each measured beam, so no rays are traced.
+#   distances   float32 array (height, width) of distances in meters
+#   sigma       standard deviation of the beam end point error in meters
+class LikelihoodField(object):
+
+  def __init__(self, the_map, sigma=0.2):
+    self.resolution = the_map.info.resolution
+    self.sigma = sigma
+    occupied = occupied_mask(the_map)
+    if occupied.any():
+      distances = distance_transform_edt(~occupied)*self.resolution
+    else:
+      distances = np.empty(occupied.shape)
+      distances.fill(np.inf)
+    self.distances = distances.astype(np.float32)
+
+  #-----------------------------------------------------------------------------
+  # Scores a measured scan from many poses
+  # Parameters:
+  #   poses       array of shape (N, 3) of poses (x, y, theta), with x and y
+  #               in map coordinates
+  #   ranges      measured ranges
+  #   min_angle   minimum angle of laserscan
+  #   increment   laserscan increment
+  #   max_range   maximum laser range, beams at max_range are not scored
+  #   beams       optional indices of the beams to score
+  # Return:
+  #   array of N scores between 0 and 1
+  def score_poses(self, poses, ranges, min_angle, increment, max_range, beams=None):
+    poses = np.asarray(poses, dtype=float).reshape(-1, 3)
+    ranges = np.asarray(ranges, dtype=float)
+    if beams is None:
+      beams = np.arange(len(ranges))
+    beams = np.asarray(beams)
+    beams = beams[ranges[beams] < max_range]
+    if beams.size == 0:
+      return np.zeros(len(poses))
+
+    # Beam end points in map coordinates, starting from the center of the cell
+    angles = poses[:, 2:3] + min_angle + increment*beams
+    cells = ranges[beams]/self.resolution
+    ex = np.floor(poses[:, 0:1] + 0.5 + cells*np.cos(angles)).astype(np.intp)
+    ey = np.floor(poses[:, 1:2] + 0.5 + cells*np.sin(angles)).astype(np.intp)
+
+    height, width = self.distances.shape
+    inside = (ex >= 0) & (ex < width) & (ey >= 0) & (ey < height)
+    d = self.distances[np.where(inside, ey, 0), np.where(inside, ex, 0)]
+    likelihood = np.where(inside, np.exp(-d*d/(2*self.sigma*self.sigma)), 0.0)
+    return likelihood.mean(axis=1)
+
+  #-----------------------------------------------------------------------------
+  # Scores a measured scan from a single pose, see score_poses
+  def score(self, x, y, theta, ranges, min_angle, increment, max_range, beams=None):
+    return float(self.score_poses([(x, y, theta)], ranges, min_angle, increment, max_range, beams)[0])
@@ -0,0 +1,286 @@
+from assignment_4.grid import map_array, free_cell_index, _store, OCCUPIED, FREE
+from assignment_4.laser import cast_rays
+from assignment_4.range_table import RANGE_STEPS
+from assignment_4.tiled import TiledGrid, build_tiled_grid
+from scipy import ndimage
+import numpy as np
+import copy
+import math
+
+#-------------------------------------------------------------------------------
+# Work done by one MapState update, next to the work of a full rebuild.
+#   rects           changed rectangles (x0, y0, x1, y1), end exclusive
+#   changed_cells   number of cells whose value changed
+#   buckets         free cell index buckets rebuilt, and in total
+#   rays            range table rays cast again, and in total
+#   tiles           distance field tiles recomputed, and in total
+class UpdateReport(object):
+
+  def __init__(self, rects, changed_cells):
+    self.rects = rects
+    self.changed_cells = changed_cells
+    self.buckets = (0, 0)
+    self.rays = (0, 0)
+    self.tiles = (0, 0)
+
+  def __str__(self):
+    def part(name, work):
+      done, total = work
+      if total == 0:
+        return '%s: -' % name
+      return '%s: %d/%d (%.1f%% saved)' % (name, done, total, 100.0*(total - done)/total)
+    return '%d cells in %d rects, %s, %s, %s' % (
+      self.changed_cells, len(self.rects), part('buckets', self.buckets),
+      part('rays', self.rays), part('field tiles', self.tiles))
+
+#-------------------------------------------------------------------------------
+# Returns the bounding rectangles (x0, y0, x1, y1), end exclusive, of the
+# groups of touching cells that differ between two occupancy arrays
+def changed_rects(old, new):
+  changed = old != new
+  labels, n = ndimage.label(changed, structure=np.ones((3, 3)))
+  return [(sx.start, sy.start, sx.stop, sy.stop) for sy, sx in ndimage.find_objects(labels)]
+
+#-------------------------------------------------------------------------------
+# A map that is patched at runtime, with the data derived from it. When the
+# map changes only the parts of the derived data that depend on the changed
+# cells are updated:
+#   - the free cell index rebuilds the buckets overlapping a change
+#   - range table rays that can reach a change are cast again; cells that are
+#     no longer free leave the table and cells that became free are ray traced
+#     by RangeTable.expected_scans like any cell missing from the table
+#   - the likelihood field recomputes the tiles holding cells whose nearest
+#     occupied cell may have changed
+# The map, table and field are replaced by updated copies, so objects handed
+# out before an update keep seeing the old map.
+#
+# A map stored as a TiledGrid stays tiled: only the tiles holding changes are
+# decoded and encoded again, and they are the buckets of its free cell index.
+# Tables and fields hold the whole map, so they cannot be used with a tiled
+# map.
+#   the_map     map
+#   table       optional RangeTable of the map
+#   field       optional LikelihoodField of the map
+#   tile_size   size of the distance field tiles in cells
+class MapState(object):
+
+  def __init__(self, the_map, table=None, field=None, tile_size=32):
+    self.the_map = the_map
+    self.table = table
+    self.field = field
+    self.tile_size = tile_size
+    if isinstance(the_map.data, TiledGrid) and (table is not None or field is not None):
+      raise ValueError('range tables and likelihood fields of tiled maps are not updated')
+    free_cell_index(the_map)
+
+  #-----------------------------------------------------------------------------
+  # Replaces the map with a new version of the same size
+  # Return:
+  #   UpdateReport
+  def update(self, new_map):
+    info, new_info = self.the_map.info, new_map.info
+    if (new_info.width, new_info.height) != (info.width, info.height):
+      raise ValueError('map size changed from %dx%d to %dx%d' % (info.width, info.height, new_info.width, new_info.height))
+    if isinstance(self.the_map.data, TiledGrid):
+      return self._update_tiled(new_map)
+    old = map_array(self.the_map)
+    index = free_cell_index(self.the_map)
+    new = np.asarray(new_map.data, dtype=np.int8).reshape(old.shape)
+    rects = changed_rects(old, new)
+    report = UpdateReport(rects, int((old != new).sum()))
+
+    _store(new_map, 'array', new)
+    _store(new_map, 'occupied', new == OCCUPIED)
+    rebuilt = 0
+    for (x0, y0, x1, y1) in rects:
+      index, buckets = index.updated(new_map, x0, y0, x1, y1)
+      rebuilt += buckets
+    _store(new_map, 'free_index', index)
+    report.buckets = (rebuilt, index.buckets_x*index.buckets_y)
+
+    if self.table is not None:
+      self.table, report.rays = self._update_table(old, new, rects)
+    if self.field is not None:
+      self.field, report.tiles = self._update_field(old, new, rects)
+    self.the_map = new_map
+    return report
+
+  #-----------------------------------------------------------------------------
+  # Writes a block of occupancy values into the map, see update
+  # Parameters:
+  #   x, y      map coordinates of the first cell of the block
+  #   values    array (rows, columns) of occupancy values
+  def patch(self, x, y, values):
+    values = np.asarray(values, dtype=np.int8)
+    new_map = copy.copy(self.the_map)
+    if isinstance(self.the_map.data, TiledGrid):
+      new_map.data = self.the_map.data.patched(x, y, values)
+    else:
+      grid = map_array(self.the_map).copy()
+      grid[y:y + values.shape[0], x:x + values.shape[1]] = values
+      new_map.data = grid.ravel()
+    return self.update(new_map)
+
+  #-----------------------------------------------------------------------------
+  # Update of a tiled map. A new map that is not tiled is tiled first. The
+  # changes are found by comparing the encoded tiles, and only the tiles that
+  # differ are decoded.
+  def _update_tiled(self, new_map):
+    grid = self.the_map.data
+    if not isinstance(new_map.data, TiledGrid) or new_map.data.tile_size != grid.tile_size:
+      tiled = copy.copy(new_map)
+      tiled.data = build_tiled_grid(new_map, grid.tile_size)
+      tiled.data.max_tiles = grid.max_tiles
+      new_map = tiled
+    new_grid = new_map.data
+
+    size = grid.tile_size
+    rects = []
+    changed_cells = 0
+    changed = grid.changed_tiles(new_grid)
+    for t in changed:
+      ty, tx = divmod(int(t), grid.tiles_x)
+      old, new = grid.tile(t), new_grid.tile(t)
+      changed_cells += int((old != new).sum())
+      for (x0, y0, x1, y1) in changed_rects(old, new):
+        rects.append((x0 + tx*size, y0 + ty*size, x1 + tx*size, y1 + ty*size))
+    report = UpdateReport(rects, changed_cells)
+
+    # The tiles hold their free cell counts, so the index of the new map
+    # only has to point at them
+    index = new_grid.free_index(new_map)
+    _store(new_map, 'free_index', index)
+    report.buckets = (len(changed), index.buckets_x*index.buckets_y)
+    self.the_map = new_map
+    return report
+
+  def _update_table(self, old, new, rects):
+    table = self.table
+    cells = np.array(table.cells)
+    ranges = np.array(table.ranges)
+    height, width = new.shape
+    resolution = self.the_map.info.resolution
+    max_cells = table.max_range/resolution
+    n_angles = table.n_angles
+    step = 2*math.pi/n_angles
+
+    # Cells that are no longer free leave the table
+    left = (cells >= 0) & (new != FREE)
+    cells[left] = -1
+
+    rows, bins = [], []
+    for (x0, y0, x1, y1) in rects:
+      # Table cells close enough for their rays to reach the rectangle
+      margin = int(math.ceil(max_cells)) + 1
+      wx0, wx1 = max(0, x0 - margin), min(width, x1 + margin)
+      wy0, wy1 = max(0, y0 - margin), min(height, y1 + margin)
+      window = cells[wy0:wy1, wx0:wx1]
+      cy, cx = np.nonzero(window >= 0)
+      row = window[cy, cx]
+      px, py = cx + wx0 + 0.5, cy + wy0 + 0.5
+
+      # Distance from the ray origins to the rectangle, grown by a cell
+      dx = np.maximum(np.maximum(x0 - 1 - px, px - x1 - 1), 0)
+      dy = np.maximum(np.maximum(y0 - 1 - py, py - y1 - 1), 0)
+      near = np.hypot(dx, dy) <= max_cells + 1
+      row, px, py, dx, dy = row[near], px[near], py[near], dx[near], dy[near]
+      if len(row) == 0:
+        continue
+
+      # Angles under which each origin sees the grown rectangle
+      corners_x = np.array([x0 - 1, x1 + 1, x1 + 1, x0 - 1])
+      corners_y = np.array([y0 - 1, y0 - 1, y1 + 1, y1 + 1])
+      center = np.arctan2((y0 + y1)/2.0 - py, (x0 + x1)/2.0 - px)
+      corners = np.arctan2(corners_y - py[:, None], corners_x - px[:, None]) - center[:, None]
+      corners = (corners + math.pi) % (2*math.pi) - math.pi
+      lo = center + corners.min(axis=1) - step
+      hi = center + corners.max(axis=1) + step
+      first = np.ceil(lo/step).astype(np.intp)
+      count = np.floor(hi/step).astype(np.intp) - first + 1
+      count = np.clip(count, 0, n_angles)
+      # Origins next to or inside the rectangle cast every ray again
+      inside = (dx == 0) & (dy == 0)
+      first[inside], count[inside] = 0, n_angles
+      ray_rows = np.repeat(row, count)
+      ray_bins = (np.repeat(first - np.cumsum(count) + count, count) + np.arange(count.sum())) % n_angles
+
+      # Only rays that are at least as long as the distance to the rectangle
+      reach = ranges[ray_rows, ray_bins]*float(table.max_range)/RANGE_STEPS/resolution + 1
+      distance = np.repeat(np.hypot(dx, dy), count)
+      hit = reach >= distance
+      rows.append(ray_rows[hit])
+      bins.append(ray_bins[hit])
+
+    total = int((cells >= 0).sum())*n_angles
+    if not rows:
+      return type(table)(cells, ranges, table.max_range), (0, total)
+    rays = np.unique(np.concatenate(rows)*n_angles + np.concatenate(bins))
+    ray_rows, ray_bins = np.divmod(rays, n_angles)
+    # Cell of every table row
+    free_y, free_x = np.nonzero(cells >= 0)
+    row_x = np.zeros(len(ranges), dtype=np.intp)
+    row_y = np.zeros(len(ranges), dtype=np.intp)
+    row_x[cells[free_y, free_x]] = free_x
+    row_y[cells[free_y, free_x]] = free_y
+    distances = cast_rays(new == OCCUPIED, row_x[ray_rows], row_y[ray_rows], ray_bins*step, max_cells)
+    steps = np.minimum(distances*resolution/table.max_range, 1.0)*RANGE_STEPS
+    ranges[ray_rows, ray_bins] = np.round(steps)
+    return type(table)(cells, ranges, table.max_range), (len(rays), total)
+
+  def _update_field(self, old, new, rects):
+    field = self.field
+    distances = np.array(field.distances)
+    height, width = new.shape
+    resolution = field.resolution
+    tile = self.tile_size
+    tiles_x, tiles_y = -(-width//tile), -(-height//tile)
+    occupied = new == OCCUPIED
+    # No cell is farther from the changes than the largest distance
+    largest = field.distances.max()/resolution
+    reach = int(math.ceil(largest)) + 1 if np.isfinite(largest) else max(width, height)
+
+    recomputed = np.zeros((tiles_y, tiles_x), dtype=bool)
+    for (x0, y0, x1, y1) in rects:
+      # A cell can only change if the rectangle is not farther than its
+      # nearest occupied cell was (with some slack for the float32 distances)
+      sx0, sx1 = max(0, x0 - reach), min(width, x1 + reach)
+      sy0, sy1 = max(0, y0 - reach), min(height, y1 + reach)
+      gy, gx = np.mgrid[sy0:sy1, sx0:sx1]
+      dx = np.maximum(np.maximum(x0 - gx, gx - (x1 - 1)), 0)
+      dy = np.maximum(np.maximum(y0 - gy, gy - (y1 - 1)), 0)
+      affected = np.hypot(dx, dy) <= field.distances[sy0:sy1, sx0:sx1]/resolution + 1e-3
+      ay, ax = np.nonzero(affected)
+      if len(ax) == 0:
+        continue
+      ax, ay = ax + sx0, ay + sy0
+
+      # Distances are computed in a window of whole tiles around the affected
+      # cells, grown until the window holds the nearest occupied cell of each
+      pad = tile
+      while True:
+        tx0, tx1 = max(0, (ax.min() - pad)//tile), min(tiles_x, (ax.max() + pad)//tile + 1)
+        ty0, ty1 = max(0, (ay.min() - pad)//tile), min(tiles_y, (ay.max() + pad)//tile + 1)
+        wx0, wx1, wy0, wy1 = tx0*tile, min(width, tx1*tile), ty0*tile, min(height, ty1*tile)
+        window = occupied[wy0:wy1, wx0:wx1]
+        if window.any():
+          local = ndimage.distance_transform_edt(~window)*resolution
+        else:
+          local = np.empty(window.shape)
+          local.fill(np.inf)
+        local = local[ay - wy0, ax - wx0]
+        # Distance to the sides of the window that are not map borders
+        border = np.empty(len(ax))
+        border.fill(np.inf)
+        if wx0 > 0: border = np.minimum(border, ax - wx0 + 1)
+        if wx1 < width: border = np.minimum(border, wx1 - ax)
+        if wy0 > 0: border = np.minimum(border, ay - wy0 + 1)
+        if wy1 < height: border = np.minimum(border, wy1 - ay)
+        if (local <= border*resolution).all():
+          break
+        pad *= 2
+      distances[ay, ax] = local
+      recomputed[ty0:ty1, tx0:tx1] = True
+
+    updated = copy.copy(field)
+    updated.distances = distances.astype(np.float32)
+    return updated, (int(recomputed.sum()), tiles_x*tiles_y)
@@ -1,5 +1,8 @@
 from assignment_3.geometry import *
+from assignment_4.grid import free_cell_index, world_to_grid, on_map
+from assignment_4 import stats
 from math import pi
+import numpy as np
 import random
 
 import matplotlib.pyplot as plt
@@ -10,56 +13,242 @@ def to_grid_helper(x,y,the_map):
   return to_grid(x, y, the_map.info.origin.position.x, the_map.info.origin.position.y, the_map.info.width,
                  the_map.info.height, the_map.info.resolution)
 
+# Number of noisy positions new_particle draws before giving up on a parent
+MAX_TRIES = 10
+
 #-------------------------------------------------------------------------------
-# Generates a random pose in the map (in real world coordinates)
+# Generates a random pose in the map (in real world coordinates), uniform over
+# the free cells
 def random_particle(the_map):
-
-  min_x = the_map.info.origin.position.x
-  min_y = the_map.info.origin.position.y
-  max_x = min_x + (the_map.info.width*the_map.info.resolution)
-  max_y = min_y + (the_map.info.height*the_map.info.resolution)
-  max_theta = 2*pi
-
-  x = random.uniform(min_x, max_x)
-  y = random.uniform(min_y, max_y)
-  theta = random.uniform(0, max_theta)
-
-  (x_grid, y_grid) = to_grid_helper(x,y,the_map)
-  index = to_index(x_grid, y_grid, the_map.info.width)
-
-  if the_map.data[index] == 100:
-    return random_particle(the_map)
-  return (x, y, theta)
+  (x,), (y,) = free_cell_index(the_map).sample(1)
+  theta = random.uniform(0, 2*pi)
+  return (float(x), float(y), theta)
 
 #-------------------------------------------------------------------------------
-# Generates a new particle from an old one by adding noise to it
+# Generates a new particle from an old one by adding noise to it. If none of
+# MAX_TRIES noisy positions is in a free cell the particle is placed at random.
 def new_particle(particle, spatial_var, angle_var, the_map):
   (x,y,theta) = particle
-  new_x = random.gauss(x, spatial_var)
-  new_y = random.gauss(y, spatial_var)
-
-  # check to see if new_particle is still on the map
-  grid_coordinates = to_grid_helper(new_x, new_y, the_map)
-  if grid_coordinates is None:
-    return new_particle(particle, spatial_var, angle_var, the_map)
-  # check to see if new_particle would return an occupied grid
-  (x_grid, y_grid) = grid_coordinates
-  index = to_index(x_grid, y_grid, the_map.info.width)
-  if the_map.data[index] == 100:
-    return new_particle(particle, spatial_var, angle_var, the_map)
+  free = free_cell_index(the_map).free
+  for i in range(MAX_TRIES):
+    new_x = random.gauss(x, spatial_var)
+    new_y = random.gauss(y, spatial_var)
+
+    # check to see if new_particle is still on the map
+    grid_coordinates = to_grid_helper(new_x, new_y, the_map)
+    if grid_coordinates is None:
+      continue
+    # check to see if new_particle would land in a free cell
+    (x_grid, y_grid) = grid_coordinates
+    if free[y_grid, x_grid]:
+      stats.count('rejected_draws', i)
+      break
+  else:
+    stats.count('rejected_draws', MAX_TRIES)
+    stats.count('random_fallbacks')
+    (new_x, new_y, _) = random_particle(the_map)
 
   min_angle = theta-angle_var
   max_angle = theta+angle_var
   new_angle = random.uniform(min_angle, max_angle)
   return (new_x, new_y, new_angle)
-    
+
+#-------------------------------------------------------------------------------
+# A set of particles stored as arrays.
+#   poses     float array (N, 3) of poses (x, y, theta) in real world
+#             coordinates
+#   weights   float array (N,) of particle scores
+# Iterating over a set gives (x, y, theta) tuples like a list of particles, and
+# weighted() gives the list of (score, (x, y, theta)) used by debug_call.
+class ParticleSet(object):
+
+  def __init__(self, poses, weights=None):
+    self.poses = np.asarray(poses, dtype=float).reshape(-1, 3)
+    if weights is None:
+      weights = np.zeros(len(self.poses))
+    self.weights = np.asarray(weights, dtype=float)
+
+  def __len__(self):
+    return len(self.poses)
+
+  def __iter__(self):
+    for pose in self.poses.tolist():
+      yield tuple(pose)
+
+  #-----------------------------------------------------------------------------
+  # Returns the particles as a list of (score, (x, y, theta)) tuples
+  def weighted(self):
+    return [(score, tuple(pose)) for score, pose in zip(self.weights.tolist(), self.poses.tolist())]
+
+  #-----------------------------------------------------------------------------
+  # Builds a set from a list of (score, (x, y, theta)) tuples
+  @staticmethod
+  def from_weighted(particles_weighted):
+    if len(particles_weighted) == 0:
+      return ParticleSet(np.zeros((0, 3)))
+    weights, poses = zip(*particles_weighted)
+    return ParticleSet(poses, weights)
+
+  #-----------------------------------------------------------------------------
+  # Returns the particles as map coordinates (x, y, theta) and a bool array
+  # telling which particles are inside the map
+  def grid_poses(self, the_map):
+    gx, gy = world_to_grid(self.poses[:, 0], self.poses[:, 1], the_map)
+    inside = on_map(gx, gy, the_map)
+    return np.column_stack((gx, gy, self.poses[:, 2])), inside
+
+  #-----------------------------------------------------------------------------
+  # Returns the subset of particles selected by a bool or index array
+  def subset(self, selection):
+    return ParticleSet(self.poses[selection], self.weights[selection])
+
+#-------------------------------------------------------------------------------
+# Returns a bool array telling which real world positions are in a free cell
+def valid_positions(x, y, the_map):
+  return free_cell_index(the_map).valid_positions(x, y)
+
+#-------------------------------------------------------------------------------
+# Generates n random positions in the map (in real world coordinates), uniform
+# over the free cells
+def random_positions(n, the_map):
+  return free_cell_index(the_map).sample(n)
+
+#-------------------------------------------------------------------------------
+# Generates a set of n random particles in the map (in real world coordinates)
+def random_particles(n, the_map):
+  x, y = random_positions(n, the_map)
+  theta = np.random.uniform(0, 2*pi, n)
+  return ParticleSet(np.column_stack((x, y, theta)))
+
+#-------------------------------------------------------------------------------
+# Generates new particles from old ones by adding noise to them, see
+# new_particle. Positions that are not in a free cell are drawn again a few
+# times; particles that still do not land in a free cell are placed at a
+# random free position instead.
+# Parameters:
+#   poses         float array (N, 3) of poses
+#   spatial_var   array (N,) of position standard deviations
+#   angle_var     array (N,) of angle noise half widths
+#   the_map       map
+#   max_tries     number of draws before a particle is placed at random
+# Return:
+#   float array (N, 3) of new poses
+def new_particles(poses, spatial_var, angle_var, the_map, max_tries=MAX_TRIES):
+  n = len(poses)
+  x = np.empty(n)
+  y = np.empty(n)
+  todo = np.arange(n)
+  for i in range(max_tries):
+    if todo.size == 0:
+      break
+    x[todo] = np.random.normal(poses[todo, 0], spatial_var[todo])
+    y[todo] = np.random.normal(poses[todo, 1], spatial_var[todo])
+    todo = todo[~valid_positions(x[todo], y[todo], the_map)]
+    stats.count('rejected_draws', todo.size)
+  if todo.size > 0:
+    stats.count('random_fallbacks', todo.size)
+    x[todo], y[todo] = random_positions(todo.size, the_map)
+  theta = np.random.uniform(poses[:, 2]-angle_var, poses[:, 2]+angle_var)
+  return np.column_stack((x, y, theta))
+
+#-------------------------------------------------------------------------------
+# Replaces a random fraction of the particles with particles drawn from the free
+# cells near some centers, e.g. the best scoring particles. New particles take
+# the heading of their center, with uniform noise of +-angle_var.
+# Parameters:
+#   particle_set  ParticleSet
+#   centers       array (K, 3) of poses to sample around
+#   radius        sampling radius in meters
+#   fraction      fraction of the particles to replace
+#   the_map       map
+# Return:
+#   ParticleSet
+def reinject(particle_set, centers, radius, fraction, the_map, angle_var=0.5):
+  if len(centers) == 0:
+    return particle_set
+  index = free_cell_index(the_map)
+  poses = particle_set.poses.copy()
+  n = int(round(fraction*len(poses)))
+  replaced = np.random.choice(len(poses), n, replace=False)
+  for i, target in enumerate(np.array_split(replaced, len(centers))):
+    if target.size == 0:
+      continue
+    (cx, cy, ctheta) = centers[i]
+    cells = index.region_cells(cx, cy, radius)
+    if len(cells) == 0:
+      continue
+    poses[target, 0], poses[target, 1] = index.sample_from(cells, target.size)
+    poses[target, 2] = ctheta + np.random.uniform(-angle_var, angle_var, target.size)
+  return ParticleSet(poses, particle_set.weights)
+
+#-------------------------------------------------------------------------------
+# Replaces a random fraction of the particles with particles drawn uniformly
+# over the free cells, e.g. when no hypothesis explains the scan well.
+# Parameters:
+#   particle_set  ParticleSet
+#   fraction      fraction of the particles to replace
+#   the_map       map
+# Return:
+#   ParticleSet
+def reinject_random(particle_set, fraction, the_map):
+  poses = particle_set.poses.copy()
+  n = int(round(fraction*len(poses)))
+  replaced = np.random.choice(len(poses), n, replace=False)
+  poses[replaced] = random_particles(n, the_map).poses
+  return ParticleSet(poses, particle_set.weights)
+
+#-------------------------------------------------------------------------------
+# Moves particles by an odometry motion given in the robot frame, adding
+# Gaussian noise proportional to the motion. Particles that do not move get no
+# noise. Particles that end up outside the free cells, e.g. by driving through
+# a wall, are dropped; if none is left, the particles are drawn again at random.
+# Parameters:
+#   particle_set    ParticleSet
+#   motion          (dx, dy, dtheta) relative motion in the robot frame
+#   the_map         map
+#   spatial_noise   position noise standard deviation per meter moved
+#   angle_noise     heading noise standard deviation per radian turned
+# Return:
+#   ParticleSet of the moved particles, possibly fewer than particle_set
+def motion_update(particle_set, motion, the_map, spatial_noise=0.1, angle_noise=0.1):
+  (dx, dy, dtheta) = motion
+  poses = particle_set.poses
+  n = len(poses)
+  theta = poses[:, 2]
+  x = poses[:, 0] + np.cos(theta)*dx - np.sin(theta)*dy
+  y = poses[:, 1] + np.sin(theta)*dx + np.cos(theta)*dy
+  distance = math.hypot(dx, dy)
+  if distance > 0:
+    x += np.random.normal(0, spatial_noise*distance, n)
+    y += np.random.normal(0, spatial_noise*distance, n)
+  theta = theta + dtheta
+  if dtheta != 0:
+    theta += np.random.normal(0, angle_noise*abs(dtheta), n)
+
+  valid = valid_positions(x, y, the_map)
+  n_valid = int(valid.sum())
+  stats.count('motion_rejected', n - n_valid)
+  if n_valid == 0:
+    return random_particles(n, the_map)
+  moved = ParticleSet(np.column_stack((x, y, theta)), particle_set.weights)
+  if n_valid == n:
+    return moved
+  return moved.subset(valid)
+
 #-------------------------------------------------------------------------------
 # Resamples the particles.
 # NOTE: particle weights are not normalized i.e. it is not guaranteed that the 
 # sum of all particle weights is 1.
 # n_particles in the number of particles
-# scores is a list of tuples of the form (score, (x,y,theta) )
-def resample(particles_weighted, n_particles, the_map):
+# scores is a list of tuples of the form (score, (x,y,theta) ), or a
+# ParticleSet, in which case a ParticleSet is returned
+# kld is an optional KLDSampling that picks the number of particles instead of
+# n_particles
+def resample(particles_weighted, n_particles, the_map, kld=None):
+  if isinstance(particles_weighted, ParticleSet):
+    return resample_set(particles_weighted, n_particles, the_map, kld)
+  if kld is not None:
+    return list(resample_set(ParticleSet.from_weighted(particles_weighted), n_particles, the_map, kld))
   total_score = 0
   particles = []
   # lets normalize data from (0,1)
@@ -96,6 +285,77 @@ def resample(particles_weighted, n_particles, the_map):
   assert len(particles) == n_particles
   return particles      
 
+#-------------------------------------------------------------------------------
+# Adaptive particle count (KLD sampling, Fox 2003). The number of particles is
+# chosen so that, with probability 1-delta, the KL divergence between the
+# particle histogram and the true posterior is below epsilon. The histogram has
+# bins of bin_size meters and angle_bin radians.
+class KLDSampling(object):
+
+  def __init__(self, min_particles=50, max_particles=5000, epsilon=0.05, z=2.326,
+               bin_size=0.5, angle_bin=pi/18):
+    self.min_particles = min_particles
+    self.max_particles = max_particles
+    self.epsilon = epsilon
+    self.z = z      # upper 1-delta quantile of the standard normal (delta=0.01)
+    self.bin_size = bin_size
+    self.angle_bin = angle_bin
+
+  #-----------------------------------------------------------------------------
+  # Returns the number of particles needed when k histogram bins are occupied,
+  # for an array of k
+  def required(self, k):
+    k = np.asarray(k, dtype=float)
+    a = 2.0/(9*np.maximum(k-1, 1))
+    n = (k-1)/(2*self.epsilon)*(1 - a + np.sqrt(a)*self.z)**3
+    n = np.where(k > 1, np.ceil(n), 0)
+    return np.clip(n, self.min_particles, self.max_particles).astype(int)
+
+  #-----------------------------------------------------------------------------
+  # Returns the number of particles to keep from an array (N, 3) of poses drawn
+  # in random order: the smallest prefix that is at least as large as the
+  # count required by the bins it occupies
+  def count(self, poses):
+    bins = np.column_stack((np.floor(poses[:, 0]/self.bin_size),
+                            np.floor(poses[:, 1]/self.bin_size),
+                            np.floor((poses[:, 2] % (2*pi))/self.angle_bin))).astype(np.int64)
+    _, first = np.unique(bins, axis=0, return_index=True)
+    new_bin = np.zeros(len(poses), dtype=int)
+    new_bin[first] = 1
+    occupied = np.cumsum(new_bin)
+    enough = np.flatnonzero(np.arange(1, len(poses)+1) >= self.required(occupied))
+    if enough.size == 0:
+      return len(poses)
+    return enough[0]+1
+
+#-------------------------------------------------------------------------------
+# Resamples a ParticleSet. Same low variance resampling and noise as resample,
+# done on arrays. With KLD sampling, kld.max_particles particles are drawn in
+# random order and the set is cut to the size KLDSampling.count asks for.
+def resample_set(particle_set, n_particles, the_map, kld=None):
+  scores = particle_set.weights
+  min_score = min(1, scores.min())
+  max_score = max(0, scores.max())
+  if max_score > min_score:
+    norm_scores = (scores-min_score)/(max_score-min_score)
+  else:
+    norm_scores = np.ones(len(scores))
+  if kld is not None:
+    n_particles = kld.max_particles
+
+  # Draw n_particles evenly spaced pointers into the cumulative scores
+  cumulative = np.cumsum(norm_scores)
+  gap = cumulative[-1]/(n_particles+1)
+  pointers = random.uniform(0, gap) + gap*np.arange(n_particles)
+  parents = np.minimum(np.searchsorted(cumulative, pointers), len(scores)-1)
+
+  noise = np.sqrt(1-norm_scores[parents])
+  poses = new_particles(particle_set.poses[parents], noise, noise, the_map)
+  if kld is not None:
+    poses = poses[np.random.permutation(len(poses))]
+    poses = poses[:kld.count(poses)]
+  return ParticleSet(poses)
+
 # ----------------------------------------------------------------------------
 # Draw an occupancy grid
 def draw_occupancy_grid(the_map, ax):
@@ -152,8 +412,13 @@ def draw_particles_scored(particles_weighted):
 
 #-------------------------------------------------------------------------------
 # This function is called each interation after calculating the scores of the
-# particles. Use it for debugging
-def debug_call(particles_weighted, the_map):
+# particles. Use it for debugging. When a render.MapRenderer is given the
+# particles are drawn with it instead, without waiting for a key press.
+def debug_call(particles_weighted, the_map, renderer=None):
+
+  if renderer is not None:
+    renderer.update(particles_weighted)
+    return
 
   debug = False
 
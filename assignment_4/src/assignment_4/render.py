@@ -0,0 +1,149 @@
+from assignment_4.grid import map_array, FREE, OCCUPIED
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+import numpy as np
+import threading
+import os
+try:
+  import queue
+except ImportError:
+  import Queue as queue
+
+# Colors (RGBA) of free, occupied and unknown cells
+FREE_COLOR = (0.6, 0.7, 1.0, 1.0)
+OCCUPIED_COLOR = (0.2, 0.2, 0.2, 1.0)
+UNKNOWN_COLOR = (1.0, 1.0, 1.0, 1.0)
+
+#-------------------------------------------------------------------------------
+# Returns an RGBA image of the occupancy values of a map
+def map_image(the_map):
+  grid = map_array(the_map)
+  image = np.empty(grid.shape + (4,))
+  image[:] = UNKNOWN_COLOR
+  image[grid == FREE] = FREE_COLOR
+  image[grid == OCCUPIED] = OCCUPIED_COLOR
+  return image
+
+#-------------------------------------------------------------------------------
+# Draws particles over a map without blocking the localization loop. The map is
+# drawn once as an image and the particles as one scatter plot and one line
+# collection of headings, which are updated in place on every frame.
+#   the_map       map
+#   output_dir    if given, frames are written to this directory as PNG files
+#                 by a background thread, using the Agg canvas so no display
+#                 is needed
+#   every         draw every this many calls of update
+#   show          also show the frames in a window; the window is redrawn in
+#                 the calling thread without waiting for input
+#   max_pending   most frames waiting to be written, frames past it are dropped
+class MapRenderer(object):
+
+  def __init__(self, the_map, output_dir=None, every=1, show=False, max_pending=4):
+    self.output_dir = output_dir
+    self.every = max(1, every)
+    self.show = show
+    self.calls = 0
+    self.written = 0
+    self.dropped = 0
+    self.arrow = 10*the_map.info.resolution
+
+    info = the_map.info
+    x0 = info.origin.position.x
+    y0 = info.origin.position.y
+    extent = (x0, x0 + info.width*info.resolution, y0, y0 + info.height*info.resolution)
+    image = map_image(the_map)
+
+    if output_dir is not None:
+      if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+      self.figure = Figure(figsize=(8, 8), dpi=96)
+      FigureCanvasAgg(self.figure)
+      self.artists = self._setup(self.figure, image, extent)
+      self.frames = queue.Queue(max_pending)
+      self.writer = threading.Thread(target=self._write_frames)
+      self.writer.daemon = True
+      self.writer.start()
+
+    if show:
+      import matplotlib.pyplot as plt
+      self.window = plt.figure(figsize=(8, 8), dpi=96)
+      self.window_artists = self._setup(self.window, image, extent)
+      plt.show(block=False)
+
+  def _setup(self, figure, image, extent):
+    ax = figure.add_subplot(1, 1, 1)
+    ax.imshow(image, origin='lower', extent=extent, interpolation='nearest')
+    ax.set_xlim(extent[0], extent[1])
+    ax.set_ylim(extent[2], extent[3])
+    ax.set_aspect('equal', adjustable='box')
+    ax.set_xlabel('X world')
+    ax.set_ylabel('Y world')
+    headings = LineCollection([], colors='g', linewidths=0.5)
+    ax.add_collection(headings)
+    points = ax.scatter([], [], c='r', edgecolors='none')
+    title = ax.set_title('')
+    return points, headings, title
+
+  #-----------------------------------------------------------------------------
+  # Draws the particles of one iteration, every self.every calls
+  # Parameters:
+  #   particles   ParticleSet or list of (score, (x, y, theta)) tuples
+  #   label       optional title of the frame
+  def update(self, particles, label=None):
+    self.calls += 1
+    if (self.calls - 1) % self.every:
+      return
+    if hasattr(particles, 'poses'):
+      poses, weights = particles.poses.copy(), particles.weights.copy()
+    elif len(particles) > 0:
+      weights, poses = zip(*particles)
+      poses, weights = np.array(poses, dtype=float), np.array(weights, dtype=float)
+    else:
+      poses, weights = np.zeros((0, 3)), np.zeros(0)
+    if label is None:
+      label = 'iteration %d' % (self.calls - 1)
+    frame = (self.calls - 1, label, poses, weights)
+
+    if self.output_dir is not None:
+      try:
+        self.frames.put_nowait(frame)
+      except queue.Full:
+        self.dropped += 1
+    if self.show:
+      self._draw(self.window_artists, frame)
+      self.window.canvas.draw_idle()
+      self.window.canvas.flush_events()
+
+  def _draw(self, artists, frame):
+    points, headings, title = artists
+    _, label, poses, weights = frame
+    # Unscored particles are drawn small, as in draw_particles_scored
+    if len(weights) and weights.max() > 0:
+      sizes = 2 + 40*weights/weights.max()
+    else:
+      sizes = np.ones(len(poses))
+    points.set_offsets(poses[:, :2])
+    points.set_sizes(sizes)
+    ends = poses[:, :2] + self.arrow*np.column_stack((np.cos(poses[:, 2]), np.sin(poses[:, 2])))
+    headings.set_segments(np.stack((poses[:, :2], ends), axis=1))
+    title.set_text(label)
+
+  def _write_frames(self):
+    while True:
+      frame = self.frames.get()
+      try:
+        if frame is None:
+          return
+        self._draw(self.artists, frame)
+        self.figure.savefig(os.path.join(self.output_dir, 'frame_%05d.png' % frame[0]))
+        self.written += 1
+      finally:
+        self.frames.task_done()
+
+  #-----------------------------------------------------------------------------
+  # Waits for the pending frames to be written and stops the writer thread
+  def close(self):
+    if self.output_dir is not None and self.writer.is_alive():
+      self.frames.put(None)
+      self.writer.join()
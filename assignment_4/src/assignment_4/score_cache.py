@@ -0,0 +1,82 @@
+from assignment_4 import stats
+from collections import OrderedDict
+import numpy as np
+import math
+
+#-------------------------------------------------------------------------------
+# Bounded LRU cache of pose scores. Poses are keyed by their map cell and their
+# heading quantized to angle_bins bins, and poses that miss the cache are
+# scored at the center of their heading bin, so every pose with the same key
+# gets the same score. Scores only hold for one map and scan: the cache is
+# cleared whenever it is used with a different context.
+#   max_size      most scores kept, the least recently used are evicted first
+#   angle_bins    number of heading bins over 2*pi
+class ScoreCache(object):
+
+  def __init__(self, max_size=100000, angle_bins=360):
+    self.max_size = max_size
+    self.angle_bins = angle_bins
+    self.entries = OrderedDict()
+    self.context = None
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def clear(self):
+    self.entries.clear()
+
+  #-----------------------------------------------------------------------------
+  # Returns the fraction of lookups that hit the cache
+  def hit_rate(self):
+    lookups = self.hits + self.misses
+    return float(self.hits)/lookups if lookups else 0.0
+
+  #-----------------------------------------------------------------------------
+  # Returns the scores of many poses, scoring only the ones missing from the
+  # cache.
+  # Parameters:
+  #   grid_poses    array of shape (N, 3) of poses (x, y, theta), with x and y
+  #                 in map coordinates
+  #   score_poses   function scoring an array of shape (M, 3) of poses
+  #   context       hashable value identifying the map, scan and scoring
+  #                 settings the scores are valid for
+  # Return:
+  #   array of N scores
+  def scores(self, grid_poses, score_poses, context):
+    if context != self.context:
+      self.clear()
+      self.context = context
+    grid_poses = np.asarray(grid_poses, dtype=float).reshape(-1, 3)
+    step = 2*math.pi/self.angle_bins
+    bins = np.round(grid_poses[:, 2]/step).astype(int) % self.angle_bins
+    keys = zip(np.floor(grid_poses[:, 0]).astype(int).tolist(),
+               np.floor(grid_poses[:, 1]).astype(int).tolist(), bins.tolist())
+
+    scores = np.empty(len(grid_poses))
+    missing = OrderedDict()
+    for i, key in enumerate(keys):
+      score = self.entries.pop(key, None)
+      if score is None:
+        missing.setdefault(key, []).append(i)
+        continue
+      self.entries[key] = score
+      scores[i] = score
+    # Each missing key is scored once, repeats of it count as hits
+    self.misses += len(missing)
+    self.hits += len(grid_poses) - len(missing)
+    stats.count('cache_hits', len(grid_poses) - len(missing))
+    stats.count('cache_misses', len(missing))
+
+    if missing:
+      poses = np.array([(x, y, b*step) for (x, y, b) in missing], dtype=float)
+      new_scores = np.asarray(score_poses(poses), dtype=float)
+      for (key, rows), score in zip(missing.items(), new_scores.tolist()):
+        scores[rows] = score
+        self.entries[key] = score
+      while len(self.entries) > self.max_size:
+        self.entries.popitem(last=False)
+        self.evictions += 1
+    return scores
@@ -0,0 +1,157 @@
+from assignment_4.grid import map_array, OCCUPIED
+from assignment_4 import stats
+import numpy as np
+import math
+
+#-------------------------------------------------------------------------------
+# Builds a max pooled pyramid of the cells a robot can be in. Level 0 marks the
+# cells that are not occupied; a cell of level l covers 2x2 cells of level l-1
+# and is marked when any of them is, so an unmarked cell at any level holds no
+# pose worth scoring.
+# Parameters:
+#   the_map     map
+#   levels      number of levels above level 0
+# Return:
+#   list of levels+1 bool arrays, indexed as [y, x]
+def free_pyramid(the_map, levels):
+  pyramid = [map_array(the_map) != OCCUPIED]
+  for level in range(levels):
+    below = pyramid[-1]
+    height, width = below.shape
+    padded = np.zeros((height + height % 2, width + width % 2), dtype=bool)
+    padded[:height, :width] = below
+    pooled = padded[0::2, 0::2] | padded[1::2, 0::2] | padded[0::2, 1::2] | padded[1::2, 1::2]
+    pyramid.append(pooled)
+  return pyramid
+
+#-------------------------------------------------------------------------------
+# Builds sliding window maxima of a grid. Level l holds at [y, x] the maximum of
+# the cells [y, y+2**l) x [x, x+2**l) of level 0, windows running past the far
+# edges are cut at the edge.
+# Parameters:
+#   grid        array (height, width), indexed as [y, x]
+#   levels      number of levels above level 0
+# Return:
+#   list of levels+1 arrays of the shape of grid
+def max_pyramid(grid, levels):
+  pyramid = [grid]
+  for level in range(levels):
+    step = 2**level
+    pooled = pyramid[-1].copy()
+    pooled[:, :-step] = np.maximum(pooled[:, :-step], pooled[:, step:])
+    pooled[:-step, :] = np.maximum(pooled[:-step, :], pooled[step:, :])
+    pyramid.append(pooled)
+  return pyramid
+
+#-------------------------------------------------------------------------------
+# Returns the n best rows of an array of poses, without duplicates. Ties go to
+# the pose that comes first in (x, y, theta) order, like in a brute force scan.
+def _top(poses, scores, n):
+  poses, first = np.unique(poses, axis=0, return_index=True)
+  scores = scores[first]
+  order = np.argsort(-scores, kind='mergesort')[:n]
+  return poses[order], scores[order]
+
+#-------------------------------------------------------------------------------
+# Branch and bound pose search with the likelihood field model. Positions are
+# split into square blocks of 2**levels cells, each block into four blocks of
+# half the size and so on down to single cells, every angle searched apart.
+#
+# A beam of a pose at cell (x, y) ends at (x + dx, y + dy), where the offset
+# (dx, dy) only depends on the beam and the angle. The end points of a block of
+# cells [x0, x0+s) x [y0, y0+s) therefore lie in the window of s x s cells at
+# (x0 + dx, y0 + dy), and the mean over the beams of the largest likelihood in
+# each window (max_pyramid of the likelihoods) is at least the score of every
+# pose of the block. Blocks are visited depth first, the highest bound first;
+# a block whose bound is below the best score found so far holds no better pose
+# and is not split. The result is the pose a brute force search over the cells
+# that are not occupied would return, ties included.
+# Parameters:
+#   field       LikelihoodField of the map
+#   the_map     map
+#   ranges      measured ranges
+#   min_angle   minimum angle of laserscan
+#   increment   laserscan increment
+#   max_range   maximum laser range, beams at max_range are not scored
+#   n_angles    number of angles, theta = i*2*pi/n_angles
+#   levels      number of levels of blocks above single cells
+#   batch       number of blocks bounded together
+# Return:
+#   (best pose in map coordinates, best score, number of poses scored)
+def branch_and_bound_search(field, the_map, ranges, min_angle, increment, max_range, n_angles, levels=4, batch=64):
+  free = free_pyramid(the_map, levels)
+  height, width = free[0].shape
+  angle_step = 2*math.pi/n_angles
+  ranges = np.asarray(ranges, dtype=float)
+  beams = np.flatnonzero(ranges < max_range)
+  if beams.size == 0:
+    beams = np.arange(len(ranges))
+
+  def score(poses):
+    return field.score_poses(poses*[1, 1, angle_step], ranges, min_angle, increment, max_range)
+
+  # End point offsets of every beam at every angle, as field.score_poses
+  # computes them for a pose at the center of a cell
+  angles = np.arange(n_angles)[:, None]*angle_step + min_angle + increment*beams
+  cells = ranges[beams]/field.resolution
+  dx = np.floor(0.5 + cells*np.cos(angles)).astype(np.intp)
+  dy = np.floor(0.5 + cells*np.sin(angles)).astype(np.intp)
+
+  # Windows starting up to size-1 cells before the map still reach into it:
+  # the likelihoods are padded by that many cells of zero likelihood
+  pad = 2**levels - 1
+  likelihood = np.zeros((height + pad, width + pad), dtype=np.float32)
+  d = field.distances
+  likelihood[pad:, pad:] = np.exp(-d*d/(2*field.sigma*field.sigma))
+  pooled = max_pyramid(likelihood, levels)
+
+  def bound(level, blocks):
+    ex = blocks[:, 0:1] + dx[blocks[:, 2]] + pad
+    ey = blocks[:, 1:2] + dy[blocks[:, 2]] + pad
+    inside = (ex >= 0) & (ex < width + pad) & (ey >= 0) & (ey < height + pad)
+    values = pooled[level][np.where(inside, ey, 0), np.where(inside, ex, 0)]
+    return np.where(inside, values, 0.0).mean(axis=1)
+
+  # Blocks are integer (x, y, angle bin) rows of their first cell. The stack
+  # holds (level, blocks, bounds) batches, the most promising batch on top.
+  def push(stack, level, blocks):
+    keep = free[level][blocks[:, 1] >> level, blocks[:, 0] >> level]
+    blocks = blocks[keep]
+    bounds = bound(level, blocks)
+    order = np.argsort(-bounds, kind='mergesort')
+    for start in range(0, len(order), batch)[::-1]:
+      chosen = order[start:start+batch]
+      stack.append((level, blocks[chosen], bounds[chosen]))
+
+  size = 2**levels
+  y0, x0, a0 = np.meshgrid(np.arange(0, height, size), np.arange(0, width, size), np.arange(n_angles), indexing='ij')
+  stack = []
+  push(stack, levels, np.column_stack((x0.ravel(), y0.ravel(), a0.ravel())))
+
+  best = None
+  best_score = -1.0
+  n_scored = 0
+  # The float32 likelihoods are summed in the same order for bounds and
+  # scores; the margin keeps rounding from pruning a block holding a tie
+  margin = 1e-6
+  while stack:
+    level, blocks, bounds = stack.pop()
+    stats.count('bnb_blocks', len(blocks))
+    blocks = blocks[bounds >= best_score - margin]
+    stats.count('bnb_pruned', len(bounds) - len(blocks))
+    if len(blocks) == 0:
+      continue
+    if level == 0:
+      scores = score(blocks)
+      n_scored += len(blocks)
+      for pose, value in zip(blocks, scores):
+        if value > best_score or value == best_score and tuple(pose) < tuple(best):
+          best = pose
+          best_score = float(value)
+      continue
+    half = 2**(level - 1)
+    children = np.vstack([blocks + [ox, oy, 0] for ox in (0, half) for oy in (0, half)])
+    children = children[(children[:, 0] < width) & (children[:, 1] < height)]
+    push(stack, level - 1, children)
+
+  return (int(best[0]), int(best[1]), float(best[2]*angle_step)), best_score, n_scored
@@ -0,0 +1,259 @@
+from assignment_4.grid import map_array, occupied_mask, map_hash, FREE
+from assignment_4.laser import cast_rays, batch_scan_similarity
+from assignment_4.range_table import RANGE_STEPS, CHUNK_RAYS
+from assignment_4.search import _top
+from scipy.spatial import cKDTree
+import numpy as np
+import json
+import math
+import os
+
+# Number of bins of the range histograms used as descriptors
+HISTOGRAM_BINS = 16
+
+#-------------------------------------------------------------------------------
+# Returns the histograms of many scans, as fractions of the readings. Readings
+# at max_range get a bin of their own. A histogram does not change when the
+# scan is rotated, so it can be compared without knowing the heading.
+# Parameters:
+#   ranges      array (N, B) of scans
+#   max_range   maximum laser range
+#   bins        number of bins, including the max_range bin
+# Return:
+#   float array (N, bins)
+def range_histograms(ranges, max_range, bins=HISTOGRAM_BINS):
+  ranges = np.atleast_2d(np.asarray(ranges, dtype=float))
+  index = np.minimum(ranges*((bins - 1)/float(max_range)), bins - 2).astype(np.intp)
+  index[ranges >= max_range] = bins - 1
+  rows = np.repeat(np.arange(len(ranges)), ranges.shape[1])
+  counts = np.bincount(rows*bins + index.ravel(), minlength=len(ranges)*bins)
+  return counts.reshape(len(ranges), bins)/float(ranges.shape[1])
+
+#-------------------------------------------------------------------------------
+# Index of the scans seen from the cells of a map, for finding a pose without
+# an initial guess. For every free cell on a stride it keeps the ranges all
+# around the cell. A laser only sees part of them, so the descriptors of the
+# KD-tree are the range histograms of the ranges a scan would cover, for every
+# cell at a few headings. A scan is matched by its histogram, the heading of
+# each close (cell, heading) pair is found by sliding the scan around the
+# stored ranges near that heading, and the best cells are refined by scoring
+# poses around them.
+#   cells       int32 array (M, 2) of cells (x, y) in map coordinates
+#   profiles    uint16 array (M, n_angles) of ranges in units of
+#               max_range/RANGE_STEPS, at evenly spaced angles from 0
+#   max_range   maximum laser range the index was built for
+#   stride      spacing of the cells
+#   min_angle   angle of the first beam of the scans, from the heading
+#   span        angle between the first and the last beam of the scans
+#   headings    headings per cell in the KD-tree, row i is the cell
+#               i//headings at the heading (i % headings)*2*pi/headings
+class SignatureIndex(object):
+
+  def __init__(self, cells, profiles, max_range, stride, min_angle, span, headings=16):
+    self.cells = cells
+    self.profiles = profiles
+    self.max_range = max_range
+    self.stride = stride
+    self.min_angle = min_angle
+    self.span = span
+    self.headings = headings
+    self.n_angles = profiles.shape[1]
+    self.step = 2*math.pi/self.n_angles
+
+    # Profile bins a scan covers, from the bin of its heading
+    first = int(round(min_angle/self.step))
+    arc = np.arange(first, int(round((min_angle + span)/self.step)) + 1)
+    descriptors = np.empty((len(cells), headings, HISTOGRAM_BINS))
+    for heading in range(headings):
+      bins = (self.heading_bin(heading) + arc) % self.n_angles
+      descriptors[:, heading] = range_histograms(self.ranges()[:, bins], max_range)
+    self.tree = cKDTree(descriptors.reshape(-1, HISTOGRAM_BINS))
+
+  #-----------------------------------------------------------------------------
+  # Returns the ranges around the indexed cells selected by rows
+  def ranges(self, rows=slice(None)):
+    return self.profiles[rows]*float(self.max_range)/RANGE_STEPS
+
+  #-----------------------------------------------------------------------------
+  # Returns the profile bin of KD-tree headings
+  def heading_bin(self, heading):
+    return np.round(np.asarray(heading)*float(self.n_angles)/self.headings).astype(np.intp)
+
+  def save(self, path):
+    if not os.path.isdir(path):
+      os.makedirs(path)
+    np.save(os.path.join(path, 'cells.npy'), self.cells)
+    np.save(os.path.join(path, 'profiles.npy'), self.profiles)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+      json.dump({'max_range': self.max_range, 'stride': self.stride, 'min_angle': self.min_angle,
+                 'span': self.span, 'headings': self.headings}, f)
+
+  #-----------------------------------------------------------------------------
+  # Returns the indexed poses that match a scan best, best first.
+  # Parameters:
+  #   ranges      measured scan
+  #   min_angle   minimum angle of laserscan
+  #   increment   laserscan increment
+  #   candidates  number of cells taken from the KD-tree
+  # Return:
+  #   float array (K, 3) of poses (x, y, theta) in map coordinates and array
+  #   of K scan similarities, with K <= candidates and one pose per cell
+  def match(self, ranges, min_angle, increment, candidates=100):
+    ranges = np.asarray(ranges, dtype=float)
+    k = min(candidates*self.headings, len(self.cells)*self.headings)
+    found = np.atleast_1d(self.tree.query(range_histograms(ranges, self.max_range)[0], k)[1])
+    rows, headings = np.divmod(found, self.headings)
+    # The first candidates cells found, with every heading they were found at
+    cells, first = np.unique(rows, return_index=True)
+    keep = np.isin(rows, cells[np.argsort(first)[:candidates]])
+    rows = rows[keep]
+    headings = headings[keep]
+
+    # The profile bins around each KD-tree heading, up to halfway to the next
+    # one, are tried as the heading of the scan
+    width = self.n_angles//(2*self.headings) + 1
+    tried = (self.heading_bin(headings)[:, None] + np.arange(-width, width + 1)) % self.n_angles
+    offsets = np.round((min_angle + increment*np.arange(len(ranges)))/self.step).astype(np.intp)
+    bins = (tried[:, :, None] + offsets) % self.n_angles
+    shifted = self.ranges(rows)[np.arange(len(rows))[:, None, None], bins]
+    scores = batch_scan_similarity(ranges, shifted.reshape(-1, len(ranges)), self.max_range)
+    scores = scores.reshape(tried.shape)
+    best = np.argmax(scores, axis=1)
+    scores = scores[np.arange(len(rows)), best]
+    tried = tried[np.arange(len(rows)), best]
+
+    # The best heading of every cell
+    order = np.argsort(-scores, kind='mergesort')
+    first = np.unique(rows[order], return_index=True)[1]
+    order = order[np.sort(first)]
+    poses = np.column_stack((self.cells[rows[order]], tried[order]*self.step))
+    return poses.astype(float), scores[order]
+
+  #-----------------------------------------------------------------------------
+  # Finds the pose of a scan. The best matches are refined coarse to fine:
+  # neighbours of the current candidates are scored at half the position
+  # spacing, from the stride down to one cell, and at half the heading spacing,
+  # from the angle between stored ranges down to one heading bin. Either
+  # spacing stops halving at one while the other goes on.
+  # Parameters:
+  #   score_poses   function scoring an array of shape (N, 3) of poses (x, y,
+  #                 theta) in map coordinates and returning N scores
+  #   the_map       map
+  #   ranges, min_angle, increment   the measured scan
+  #   n_angles      number of heading bins, theta = i*2*pi/n_angles
+  #   candidates    number of cells taken from the KD-tree
+  #   top_k         number of poses refined
+  # Return:
+  #   (best pose in map coordinates, best score, number of poses scored)
+  def localize(self, score_poses, the_map, ranges, min_angle, increment, n_angles, candidates=100, top_k=10):
+    free = map_array(the_map) == FREE
+    height, width = free.shape
+    angle_step = 2*math.pi/n_angles
+
+    # Poses are kept as integer (x, y, heading bin) rows
+    def score(poses):
+      return np.asarray(score_poses(poses*[1, 1, angle_step]), dtype=float)
+
+    poses = self.match(ranges, min_angle, increment, candidates)[0][:top_k]
+    poses[:, 2] = np.round(poses[:, 2]/angle_step) % n_angles
+    poses = poses.astype(np.intp)
+    scores = score(poses)
+    n_scored = len(poses)
+
+    # Halved before they are used: the first refinement looks half a stride
+    # and one stored angle (in heading bins) away
+    spacing = 2*self.stride
+    angle_spacing = 2*int(math.ceil(float(n_angles)/self.n_angles))
+    offsets = np.array([-1, 0, 1])
+    while spacing > 1 or angle_spacing > 1:
+      spacing = max(1, spacing//2)
+      angle_spacing = max(1, angle_spacing//2)
+      dx, dy, db = np.meshgrid(offsets*spacing, offsets*spacing, offsets*angle_spacing, indexing='ij')
+      children = poses[:, None, :] + np.column_stack((dx.ravel(), dy.ravel(), db.ravel()))
+      children = children.reshape(-1, 3)
+      children[:, 2] %= n_angles
+      x = children[:, 0]
+      y = children[:, 1]
+      inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+      inside[inside] = free[y[inside], x[inside]]
+      children = np.unique(children[inside], axis=0)
+      child_scores = score(children)
+      n_scored += len(children)
+      poses, scores = _top(np.vstack((poses, children)), np.concatenate((scores, child_scores)), top_k)
+
+    best = poses[0]
+    return (int(best[0]), int(best[1]), float(best[2]*angle_step)), float(scores[0]), n_scored
+
+#-------------------------------------------------------------------------------
+# Builds a signature index of a map
+# Parameters:
+#   the_map     map
+#   n_angles    number of ranges stored around each cell
+#   max_range   maximum laser range
+#   min_angle   angle of the first beam of the scans, from the heading
+#   span        angle between the first and the last beam of the scans
+#   stride      spacing of the indexed cells
+#   headings    headings per cell in the KD-tree
+# Return:
+#   SignatureIndex
+def build_signature_index(the_map, n_angles, max_range, min_angle, span, stride=4, headings=16):
+  grid = map_array(the_map)
+  occupied = occupied_mask(the_map)
+  free_y, free_x = np.nonzero(grid[::stride, ::stride] == FREE)
+  free_x = (free_x*stride).astype(np.int32)
+  free_y = (free_y*stride).astype(np.int32)
+
+  resolution = the_map.info.resolution
+  max_cells = max_range/resolution
+  angles = np.arange(n_angles)*(2*math.pi/n_angles)
+  profiles = np.empty((len(free_x), n_angles), dtype=np.uint16)
+  chunk = max(1, CHUNK_RAYS//n_angles)
+  for start in range(0, len(free_x), chunk):
+    x = np.repeat(free_x[start:start+chunk], n_angles)
+    y = np.repeat(free_y[start:start+chunk], n_angles)
+    theta = np.tile(angles, len(x)//n_angles)
+    distances = cast_rays(occupied, x, y, theta, max_cells)
+    steps = np.minimum(distances*resolution/max_range, 1.0)*RANGE_STEPS
+    profiles[start:start+chunk] = np.round(steps).reshape(-1, n_angles)
+  return SignatureIndex(np.column_stack((free_x, free_y)), profiles, max_range, stride, min_angle, span, headings)
+
+#-------------------------------------------------------------------------------
+# Loads an index saved with SignatureIndex.save
+def load_signature_index(path):
+  with open(os.path.join(path, 'meta.json')) as f:
+    meta = json.load(f)
+  cells = np.load(os.path.join(path, 'cells.npy'))
+  profiles = np.load(os.path.join(path, 'profiles.npy'), mmap_mode='r')
+  return SignatureIndex(cells, profiles, meta['max_range'], meta['stride'], meta['min_angle'], meta['span'], meta['headings'])
+
+#-------------------------------------------------------------------------------
+# Returns the directory indexes are cached in, $ROS_HOME/signature_indexes
+def default_cache_dir():
+  ros_home = os.environ.get('ROS_HOME', os.path.join(os.path.expanduser('~'), '.ros'))
+  return os.path.join(ros_home, 'signature_indexes')
+
+#-------------------------------------------------------------------------------
+# Returns the signature index of a map, loading it from the cache when the same
+# map was indexed before for the same scans and building and caching it
+# otherwise
+# Parameters:
+#   the_map     map
+#   n_angles    number of ranges stored around each cell
+#   max_range   maximum laser range
+#   min_angle   angle of the first beam of the scans, from the heading
+#   span        angle between the first and the last beam of the scans
+#   stride      spacing of the indexed cells
+#   headings    headings per cell in the KD-tree
+#   cache_dir   directory of cached indexes, default_cache_dir() if None
+# Return:
+#   SignatureIndex
+def get_signature_index(the_map, n_angles, max_range, min_angle, span, stride=4, headings=16, cache_dir=None):
+  if cache_dir is None:
+    cache_dir = default_cache_dir()
+  key = '%s-%d-%r-%r-%r-%d-%d' % (map_hash(the_map), n_angles, float(max_range), float(min_angle), float(span), stride, headings)
+  path = os.path.join(cache_dir, key)
+  if os.path.exists(os.path.join(path, 'meta.json')):
+    return load_signature_index(path)
+  index = build_signature_index(the_map, n_angles, max_range, min_angle, span, stride, headings)
+  index.save(path)
+  return index
@@ -0,0 +1,120 @@
+from timeit import default_timer
+import json
+
+#-------------------------------------------------------------------------------
+# Named counters and timers of the localization code, e.g. the rays cast and
+# cells they visit, rejected particle draws and cache hits. They are off by
+# default: count() and timer() then return right away, and code that would
+# have to do extra work to compute a count checks stats.enabled first.
+#
+# Counters:
+#   rays                rays cast by ray_tracing and cast_rays
+#   ray_cells           cells visited by those rays
+#   jit_rays            rays cast by the numba kernel, which does not count the
+#                       cells it visits
+#   rejected_draws      particle positions drawn again because they were not in
+#                       a free cell
+#   random_fallbacks    particles placed at random after MAX_TRIES rejections
+#   motion_rejected     particles dropped by motion_update because they moved
+#                       out of the free cells
+#   cache_hits, cache_misses    pose lookups in a ScoreCache
+#   table_hits, table_misses    poses read from or missing from a RangeTable
+#   tile_loads          tiles decoded by a TiledGrid
+#   bnb_blocks, bnb_pruned      blocks of poses bounded and blocks dropped by
+#                       their bound in branch_and_bound_search
+# Timers (seconds and number of calls):
+#   expected_scan, scan_similarity, likelihood_field   scoring, see
+#                       localization.filter
+#   resample            resampling of localization.filter.hill_climb_step
+#   and the stages timed by the scripts, e.g. reinject or publish
+enabled = False
+counters = {}
+timers = {}
+
+def enable(on=True):
+  global enabled
+  enabled = on
+
+def reset():
+  counters.clear()
+  timers.clear()
+
+#-------------------------------------------------------------------------------
+# Adds n to a counter
+def count(name, n=1):
+  if enabled:
+    counters[name] = counters.get(name, 0) + n
+
+class _Timer(object):
+
+  def __init__(self, name):
+    self.name = name
+
+  def __enter__(self):
+    self.start = default_timer()
+    return self
+
+  def __exit__(self, *exc):
+    seconds, calls = timers.get(self.name, (0.0, 0))
+    timers[self.name] = (seconds + default_timer() - self.start, calls + 1)
+    return False
+
+class _NullTimer(object):
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+_null_timer = _NullTimer()
+
+#-------------------------------------------------------------------------------
+# Returns a context manager adding the time spent in its block to a timer:
+#   with stats.timer('resample'):
+#     ...
+def timer(name):
+  if enabled:
+    return _Timer(name)
+  return _null_timer
+
+#-------------------------------------------------------------------------------
+# Returns the counters and timers as a dict that can be written as JSON,
+# {'counters': {name: n}, 'timers': {name: {'seconds': s, 'calls': n}}}, and
+# starts counting from zero again when reset is True
+def snapshot(reset=True):
+  result = {'counters': dict(counters),
+            'timers': dict((name, {'seconds': seconds, 'calls': calls})
+                           for name, (seconds, calls) in timers.items())}
+  if reset:
+    counters.clear()
+    timers.clear()
+  return result
+
+#-------------------------------------------------------------------------------
+# Returns a snapshot as one line of text, timers in milliseconds
+def summary(result):
+  parts = ['%s %.1f ms' % (name, 1000*timer['seconds'])
+           for name, timer in sorted(result['timers'].items())]
+  counts = result['counters']
+  parts += ['%s %d' % (name, n) for name, n in sorted(counts.items())]
+  if counts.get('ray_cells') and counts.get('rays'):
+    parts.append('cells/ray %.1f' % (float(counts['ray_cells'])/counts['rays']))
+  return ', '.join(parts)
+
+#-------------------------------------------------------------------------------
+# Writes snapshots to a file as JSON lines, one object per call with the
+# snapshot and any extra fields, e.g. the iteration
+class StatsLog(object):
+
+  def __init__(self, path):
+    self.file = open(path, 'w')
+
+  def write(self, result, **fields):
+    record = dict(fields)
+    record.update(result)
+    self.file.write(json.dumps(record, sort_keys=True) + '\n')
+    self.file.flush()
+
+  def close(self):
+    self.file.close()
@@ -0,0 +1,344 @@
+from assignment_4.grid import FreeCellIndex, map_array, map_hash, world_to_grid, grid_to_world, FREE, OCCUPIED, UNKNOWN
+from assignment_4 import stats
+from collections import OrderedDict
+import numpy as np
+import copy
+import json
+import os
+
+#-------------------------------------------------------------------------------
+# Occupancy grid stored in square tiles, for maps too large to keep as one
+# flat array. In each tile, occupied cells are a packed bit per cell and
+# unknown cells are runs (start, length) of the tile's cells in row order, so
+# a tile that is mostly known or mostly unknown takes little space. Every
+# other cell is free; values other than FREE and OCCUPIED are stored as
+# UNKNOWN, which the filter treats the same way. The arrays are memory mapped
+# and a tile is only decoded when one of its cells is read, keeping the
+# max_tiles most recently used tiles.
+#
+# A TiledGrid can replace the_map.data: indexing it with flat indices
+# (y*width + x) reads cells like the flat sequence, which is what ray_tracing
+# and the particle validity checks do. Converting it to an array, which the
+# vectorized functions do through map_array, decodes the whole map. Blocks of
+# cells are changed with patched, which returns a new grid.
+#   width, height   size of the map in cells
+#   tile_size       size of the tiles in cells, a multiple of 8
+#   occupied        uint8 array (n_tiles, tile_size**2/8) of packed bits
+#   runs            int32 array (n_runs, 2) of unknown runs
+#   run_starts      runs[run_starts[t]:run_starts[t+1]] are the runs of tile t
+#   free_counts     int32 array (n_tiles,) of free cells per tile
+class TiledGrid(object):
+
+  def __init__(self, width, height, tile_size, occupied, runs, run_starts, free_counts, max_tiles=64):
+    self.width = width
+    self.height = height
+    self.tile_size = tile_size
+    self.tiles_x = -(-width//tile_size)
+    self.tiles_y = -(-height//tile_size)
+    self.occupied = occupied
+    self.runs = runs
+    self.run_starts = run_starts
+    self.free_counts = free_counts
+    self.max_tiles = max_tiles
+    self.decoded = OrderedDict()
+    self.loads = 0
+    self.last = (None, None)
+
+  def __len__(self):
+    return self.width*self.height
+
+  #-----------------------------------------------------------------------------
+  # Returns the occupancy values of one tile as an int8 array (tile_size,
+  # tile_size), indexed as [y, x], decoding it if it is not loaded
+  def tile(self, t):
+    values = self.decoded.pop(t, None)
+    if values is None:
+      size = self.tile_size
+      bits = np.unpackbits(self.occupied[t])
+      values = np.where(bits, OCCUPIED, FREE).astype(np.int8)
+      for start, length in self.runs[self.run_starts[t]:self.run_starts[t + 1]]:
+        values[start:start + length] = UNKNOWN
+      values = values.reshape(size, size)
+      values.flags.writeable = False
+      self.loads += 1
+      stats.count('tile_loads')
+      while len(self.decoded) >= self.max_tiles:
+        self.decoded.popitem(last=False)
+    self.decoded[t] = values
+    return values
+
+  #-----------------------------------------------------------------------------
+  # Reads cells by flat index, like the_map.data. An integer gives a single
+  # value, an array of indices gives an array of values.
+  def __getitem__(self, index):
+    if isinstance(index, (int, np.integer)):
+      if index < 0 or index >= self.width*self.height:
+        raise IndexError('cell index out of range')
+      y, x = divmod(int(index), self.width)
+      size = self.tile_size
+      # Consecutive reads, e.g. along a ray, mostly hit the same tile
+      t = (y//size)*self.tiles_x + x//size
+      last, values = self.last
+      if t != last:
+        values = self.tile(t)
+        self.last = (t, values)
+      return int(values[y % size, x % size])
+    y, x = np.divmod(np.asarray(index), self.width)
+    return self.values(x, y)
+
+  #-----------------------------------------------------------------------------
+  # Returns the occupancy values of arrays of map coordinates, which must be
+  # on the map. Only the tiles holding the cells are decoded.
+  def values(self, gx, gy):
+    gx = np.asarray(gx)
+    gy = np.asarray(gy)
+    size = self.tile_size
+    tiles = (gy//size)*self.tiles_x + gx//size
+    result = np.empty(gx.shape, dtype=np.int8)
+    for t in np.unique(tiles):
+      cells = tiles == t
+      result[cells] = self.tile(t)[gy[cells] % size, gx[cells] % size]
+    return result
+
+  #-----------------------------------------------------------------------------
+  # Decodes the whole map as a flat int8 array
+  def __array__(self, dtype=None, copy=None):
+    size = self.tile_size
+    grid = np.empty((self.tiles_y*size, self.tiles_x*size), dtype=np.int8)
+    for t in range(self.tiles_x*self.tiles_y):
+      ty, tx = divmod(t, self.tiles_x)
+      grid[ty*size:(ty + 1)*size, tx*size:(tx + 1)*size] = self.tile(t)
+    flat = grid[:self.height, :self.width].ravel()
+    return flat if dtype is None else flat.astype(dtype)
+
+  #-----------------------------------------------------------------------------
+  # Returns the free cell index of a map whose data is this grid, see
+  # grid.free_cell_index
+  def free_index(self, the_map):
+    return TiledFreeIndex(the_map, self)
+
+  #-----------------------------------------------------------------------------
+  # Returns a new grid with a block of occupancy values written into it. Only
+  # the tiles the block overlaps are decoded and encoded again; the new grid
+  # starts with no decoded tiles, and this one is left unchanged.
+  # Parameters:
+  #   x, y      map coordinates of the first cell of the block
+  #   values    array (rows, columns) of occupancy values, cut off at the
+  #             edges of the map
+  # Return:
+  #   TiledGrid
+  def patched(self, x, y, values):
+    values = np.asarray(values, dtype=np.int8)
+    x1 = min(self.width, x + values.shape[1])
+    y1 = min(self.height, y + values.shape[0])
+    if x1 <= x or y1 <= y:
+      return self
+    size = self.tile_size
+    occupied = np.array(self.occupied)
+    free_counts = np.array(self.free_counts)
+    run_counts = np.diff(self.run_starts)
+    tile_runs = {}
+    for ty in range(y//size, (y1 - 1)//size + 1):
+      for tx in range(x//size, (x1 - 1)//size + 1):
+        t = ty*self.tiles_x + tx
+        tile = self.tile(t).copy()
+        cx0, cy0 = max(x, tx*size), max(y, ty*size)
+        cx1, cy1 = min(x1, (tx + 1)*size), min(y1, (ty + 1)*size)
+        tile[cy0 - ty*size:cy1 - ty*size, cx0 - tx*size:cx1 - tx*size] = values[cy0 - y:cy1 - y, cx0 - x:cx1 - x]
+        occupied[t], free_counts[t], tile_runs[t] = encode_tile(tile)
+        run_counts[t] = len(tile_runs[t])
+
+    # The runs of a tile are contiguous, so those of the patched tiles are
+    # replaced in place
+    pieces = []
+    end = 0
+    for t in sorted(tile_runs):
+      pieces.append(self.runs[end:self.run_starts[t]])
+      pieces.append(tile_runs[t])
+      end = self.run_starts[t + 1]
+    pieces.append(self.runs[end:])
+    runs = np.concatenate(pieces).astype(np.int32)
+    run_starts = np.concatenate(([0], np.cumsum(run_counts))).astype(np.int64)
+    return TiledGrid(self.width, self.height, size, occupied, runs, run_starts, free_counts, self.max_tiles)
+
+  #-----------------------------------------------------------------------------
+  # Returns the indices of the tiles whose cells differ from those of another
+  # grid of the same size and tile size, comparing the encoded tiles
+  def changed_tiles(self, other):
+    changed = (np.asarray(self.occupied) != np.asarray(other.occupied)).any(axis=1)
+    changed |= np.asarray(self.free_counts) != np.asarray(other.free_counts)
+    for t in np.flatnonzero(~changed):
+      changed[t] = not np.array_equal(self.runs[self.run_starts[t]:self.run_starts[t + 1]],
+                                      other.runs[other.run_starts[t]:other.run_starts[t + 1]])
+    return np.flatnonzero(changed)
+
+  #-----------------------------------------------------------------------------
+  # Writes the grid to a directory, with its arrays as .npy files
+  def save(self, path):
+    if not os.path.isdir(path):
+      os.makedirs(path)
+    for name in ['occupied', 'runs', 'run_starts', 'free_counts']:
+      np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+      json.dump({'width': self.width, 'height': self.height, 'tile_size': self.tile_size}, f)
+
+#-------------------------------------------------------------------------------
+# Boolean view of the free cells of a TiledGrid, indexed as [y, x] like
+# FreeCellIndex.free
+class _TiledMask(object):
+
+  def __init__(self, grid):
+    self.grid = grid
+    self.shape = (grid.height, grid.width)
+
+  def __getitem__(self, index):
+    gy, gx = index
+    return self.grid.values(gx, gy) == FREE
+
+#-------------------------------------------------------------------------------
+# FreeCellIndex of a map stored as a TiledGrid. Sampling picks tiles by their
+# number of free cells and then cells inside the picked tiles, so only those
+# tiles are decoded. The tiles take the place of the buckets of FreeCellIndex.
+class TiledFreeIndex(FreeCellIndex):
+
+  def __init__(self, the_map, grid):
+    self.the_map = the_map
+    self.width = grid.width
+    self.height = grid.height
+    self.grid = grid
+    self.free = _TiledMask(grid)
+    self.n_free = int(grid.free_counts.sum())
+    self.buckets_x = grid.tiles_x
+    self.buckets_y = grid.tiles_y
+
+  def __len__(self):
+    return self.n_free
+
+  #-----------------------------------------------------------------------------
+  # Returns the flat indices of the free cells of a tile
+  def _tile_cells(self, t):
+    grid = self.grid
+    size = grid.tile_size
+    ty, tx = divmod(int(t), grid.tiles_x)
+    y, x = np.nonzero(grid.tile(t) == FREE)
+    return (y + ty*size)*self.width + x + tx*size
+
+  def sample(self, n):
+    grid = self.grid
+    if self.n_free == 0:
+      raise ValueError('no free cells to sample from')
+    p = grid.free_counts/float(self.n_free)
+    tiles, counts = np.unique(np.random.choice(len(p), n, p=p), return_counts=True)
+    cells = np.concatenate([np.random.choice(self._tile_cells(t), count)
+                            for t, count in zip(tiles, counts)])
+    return self._positions(np.random.permutation(cells))
+
+  def region_cells(self, x, y, radius):
+    grid = self.grid
+    size = grid.tile_size
+    res = self.the_map.info.resolution
+    (gx,), (gy,) = world_to_grid([x], [y], self.the_map)
+    r = int(np.ceil(radius/res))
+    tx0, tx1 = max(0, (gx - r)//size), min(grid.tiles_x - 1, (gx + r)//size)
+    ty0, ty1 = max(0, (gy - r)//size), min(grid.tiles_y - 1, (gy + r)//size)
+    if tx0 > tx1 or ty0 > ty1:
+      return np.zeros(0, dtype=np.intp)
+    cells = np.concatenate([self._tile_cells(ty*grid.tiles_x + tx)
+                            for ty in range(ty0, ty1 + 1) for tx in range(tx0, tx1 + 1)])
+    cy, cx = np.divmod(cells, self.width)
+    wx, wy = grid_to_world(cx, cy, self.the_map)
+    return cells[np.hypot(wx - x, wy - y) <= radius]
+
+  #-----------------------------------------------------------------------------
+  # Returns the index of a new version of the map, see FreeCellIndex.updated.
+  # The new map must be tiled too, e.g. with TiledGrid.patched: its tiles
+  # already hold the free cell counts, so only the tiles overlapping the
+  # rectangle are counted as rebuilt.
+  def updated(self, the_map, x0, y0, x1, y1):
+    grid = the_map.data
+    if not isinstance(grid, TiledGrid) or grid.tile_size != self.grid.tile_size:
+      raise ValueError('the new version of a tiled map must be tiled with the same tile size')
+    size = grid.tile_size
+    tiles = ((x1 - 1)//size - x0//size + 1)*((y1 - 1)//size - y0//size + 1)
+    return TiledFreeIndex(the_map, grid), tiles
+
+#-------------------------------------------------------------------------------
+# Builds the tiles of a map
+# Parameters:
+#   the_map     map
+#   tile_size   size of the tiles in cells, a multiple of 8
+# Return:
+#   TiledGrid
+def build_tiled_grid(the_map, tile_size=256):
+  if tile_size % 8:
+    raise ValueError('tile_size must be a multiple of 8')
+  grid = map_array(the_map)
+  height, width = grid.shape
+  tiles_x, tiles_y = -(-width//tile_size), -(-height//tile_size)
+  n_tiles = tiles_x*tiles_y
+  occupied = np.empty((n_tiles, tile_size*tile_size//8), dtype=np.uint8)
+  free_counts = np.empty(n_tiles, dtype=np.int32)
+  runs = []
+  run_starts = np.zeros(n_tiles + 1, dtype=np.int64)
+  for t in range(n_tiles):
+    ty, tx = divmod(t, tiles_x)
+    # Cells past the edge of the map are unknown
+    tile = np.empty((tile_size, tile_size), dtype=np.int8)
+    tile.fill(UNKNOWN)
+    block = grid[ty*tile_size:(ty + 1)*tile_size, tx*tile_size:(tx + 1)*tile_size]
+    tile[:block.shape[0], :block.shape[1]] = block
+    occupied[t], free_counts[t], tile_runs = encode_tile(tile)
+    runs.append(tile_runs)
+    run_starts[t + 1] = run_starts[t] + len(tile_runs)
+  runs = np.concatenate(runs).astype(np.int32) if runs else np.zeros((0, 2), dtype=np.int32)
+  return TiledGrid(width, height, tile_size, occupied, runs, run_starts, free_counts)
+
+#-------------------------------------------------------------------------------
+# Encodes the occupancy values of one tile, see TiledGrid
+# Parameters:
+#   tile        int8 array (tile_size, tile_size)
+# Return:
+#   (packed occupied bits, number of free cells, int array (n, 2) of the
+#   unknown runs (start, length))
+def encode_tile(tile):
+  tile = np.asarray(tile).ravel()
+  unknown = np.concatenate(([False], (tile != FREE) & (tile != OCCUPIED), [False]))
+  edges = np.flatnonzero(np.diff(unknown.astype(np.int8)))
+  starts, ends = edges[0::2], edges[1::2]
+  return np.packbits(tile == OCCUPIED), np.count_nonzero(tile == FREE), np.column_stack((starts, ends - starts))
+
+#-------------------------------------------------------------------------------
+# Loads a grid saved with TiledGrid.save. The arrays are memory mapped read
+# only, so tiles are read from disk when they are first decoded.
+def load_tiled_grid(path, max_tiles=64):
+  with open(os.path.join(path, 'meta.json')) as f:
+    meta = json.load(f)
+  arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+            for name in ['occupied', 'runs', 'run_starts', 'free_counts']]
+  return TiledGrid(meta['width'], meta['height'], meta['tile_size'], *arrays, max_tiles=max_tiles)
+
+#-------------------------------------------------------------------------------
+# Returns the directory tiled maps are cached in, $ROS_HOME/tiled_maps
+def default_cache_dir():
+  ros_home = os.environ.get('ROS_HOME', os.path.join(os.path.expanduser('~'), '.ros'))
+  return os.path.join(ros_home, 'tiled_maps')
+
+#-------------------------------------------------------------------------------
+# Returns a copy of a map whose data is a TiledGrid loaded from the cache,
+# building and caching the tiles the first time the map is seen
+# Parameters:
+#   the_map     map
+#   tile_size   size of the tiles in cells, a multiple of 8
+#   max_tiles   most tiles kept decoded
+#   cache_dir   directory of cached tiles, default_cache_dir() if None
+# Return:
+#   map with the same info and TiledGrid data
+def get_tiled_map(the_map, tile_size=256, max_tiles=64, cache_dir=None):
+  if cache_dir is None:
+    cache_dir = default_cache_dir()
+  path = os.path.join(cache_dir, '%s-%d' % (map_hash(the_map), tile_size))
+  if not os.path.exists(os.path.join(path, 'meta.json')):
+    build_tiled_grid(the_map, tile_size).save(path)
+  tiled = copy.copy(the_map)
+  tiled.data = load_tiled_grid(path, max_tiles)
+  return tiled
@@ -0,0 +1,46 @@
+from nav_msgs.msg import OccupancyGrid
+import numpy as np
+
+#-------------------------------------------------------------------------------
+# Small maps and poses shared by the tests
+
+#-------------------------------------------------------------------------------
+# Returns a map with walls around it, random boxes inside and a patch of
+# unknown cells
+def box_map(width=60, height=50, resolution=0.05, n_boxes=8, seed=0):
+  rng = np.random.RandomState(seed)
+  grid = np.zeros((height, width), dtype=np.int8)
+  grid[0, :] = grid[-1, :] = grid[:, 0] = grid[:, -1] = 100
+  for i in range(n_boxes):
+    w = rng.randint(2, max(3, width//6))
+    h = rng.randint(2, max(3, height//6))
+    x = rng.randint(1, width - w)
+    y = rng.randint(1, height - h)
+    grid[y:y+h, x:x+w] = 100
+  grid[height//3:height//3 + 4, width//2:width//2 + 5] = -1
+  return make_map(grid, resolution)
+
+#-------------------------------------------------------------------------------
+# Returns a map holding an int8 array (height, width) of occupancy values
+def make_map(grid, resolution=0.05):
+  height, width = grid.shape
+  the_map = OccupancyGrid()
+  the_map.header.frame_id = '/map'
+  the_map.info.width = width
+  the_map.info.height = height
+  the_map.info.resolution = resolution
+  the_map.info.origin.position.x = -width*resolution/2
+  the_map.info.origin.position.y = -height*resolution/2
+  the_map.info.origin.orientation.w = 1.0
+  the_map.data = [int(value) for value in grid.ravel()]
+  return the_map
+
+#-------------------------------------------------------------------------------
+# Returns n poses (x, y, theta) in map coordinates at free cells, with integer
+# x and y
+def free_poses(the_map, n, seed=0):
+  rng = np.random.RandomState(seed)
+  grid = np.asarray(the_map.data).reshape(the_map.info.height, the_map.info.width)
+  free_y, free_x = np.nonzero(grid == 0)
+  cells = rng.randint(0, len(free_x), n)
+  return np.column_stack((free_x[cells], free_y[cells], rng.uniform(0, 2*np.pi, n))).astype(float)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('assignment_4')
+from assignment_4.cluster import *
+import numpy as np
+import math
+import unittest
+
+#-------------------------------------------------------------------------------
+# Clustering particles and summarizing the clusters as hypotheses
+class TestCluster(unittest.TestCase):
+
+  def setUp(self):
+    rng = np.random.RandomState(0)
+    # Two groups of particles two meters apart, facing opposite ways
+    near = np.column_stack((rng.normal(0, 0.05, 20), rng.normal(0, 0.05, 20), rng.normal(0.5, 0.02, 20)))
+    far = np.column_stack((rng.normal(2, 0.05, 10), rng.normal(0, 0.05, 10), rng.normal(0.5 + math.pi, 0.02, 10)))
+    self.poses = np.vstack((near, far))
+    self.labels = np.repeat([0, 1], [20, 10])
+
+  def test_normalized_weights(self):
+    weights = normalized_weights([-3.0, -1.0, 1.0])
+    np.testing.assert_allclose(weights, [0, 1.0/3, 2.0/3])
+    np.testing.assert_allclose(normalized_weights([0.2, 0.2]), [0.5, 0.5])
+    np.testing.assert_allclose(normalized_weights([0.0, 0.0, 0.0]), np.ones(3)/3)
+    self.assertEqual(len(normalized_weights([])), 0)
+
+  def test_hypotheses_with_negative_scores(self):
+    # Scores below zero must not cancel out the mass of the other cluster
+    scores = np.concatenate((np.full(20, -0.5), np.full(10, 0.5)))
+    found = hypotheses(self.poses, scores, self.labels)
+    self.assertEqual(len(found), 2)
+    self.assertAlmostEqual(found[0].mass, 1.0)
+    self.assertAlmostEqual(found[1].mass, 0.0)
+    self.assertEqual(found[0].count, 10)
+    self.assertAlmostEqual(found[0].pose[0], 2, delta=0.1)
+    self.assertAlmostEqual(sum(hypothesis.mass for hypothesis in found), 1.0)
+
+  def test_hypotheses_with_equal_scores(self):
+    found = hypotheses(self.poses, np.full(30, -1.0), self.labels)
+    self.assertAlmostEqual(found[0].mass, 20.0/30)
+    self.assertTrue(found[0].spread < 0.2)
+    self.assertTrue(found[0].angle_spread < 0.1)
+
+  def test_clusters(self):
+    for labels in [grid_clusters(self.poses, 0.5, 8),
+                   kmeans_clusters(self.poses, np.linspace(-1, 1, 30), 2)]:
+      self.assertEqual(len(np.unique(labels)), 2)
+      self.assertTrue((labels[:20] == labels[0]).all())
+      self.assertTrue((labels[20:] == labels[20]).all())
+
+if __name__ == '__main__':
+  import rosunit
+  rosunit.unitrun('assignment_4', 'test_cluster', TestCluster)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('assignment_4')
+from assignment_4.grid import *
+from assignment_4 import grid
+from fixtures import box_map
+import numpy as np
+import copy
+import unittest
+
+#-------------------------------------------------------------------------------
+# The cache of the data derived from maps
+class TestGrid(unittest.TestCase):
+
+  def setUp(self):
+    self.maps = [box_map(seed=seed) for seed in range(grid.MAX_MAPS + 1)]
+
+  def test_maps_keep_their_data(self):
+    first, second = self.maps[:2]
+    mask = occupied_mask(first)
+    index = free_cell_index(first)
+    self.assertFalse(occupied_mask(second) is mask)
+    self.assertTrue(occupied_mask(first) is mask)
+    self.assertTrue(free_cell_index(first) is index)
+
+  def test_copies_share_data(self):
+    the_map = self.maps[0]
+    mask = occupied_mask(the_map)
+    copied = copy.deepcopy(the_map)
+    self.assertEqual(map_hash(copied), map_hash(the_map))
+    self.assertTrue(occupied_mask(copied) is mask)
+    # A change of the contents is a new map
+    copied.data = list(copied.data)
+    copied.data[the_map.info.width + 1] = 100 - copied.data[the_map.info.width + 1]
+    self.assertNotEqual(map_hash(copied), map_hash(the_map))
+    self.assertFalse(occupied_mask(copied) is mask)
+
+  def test_least_recently_used_map_is_evicted(self):
+    masks = [occupied_mask(the_map) for the_map in self.maps[:-1]]
+    # Using the first map again makes the second the least recently used
+    occupied_mask(self.maps[0])
+    occupied_mask(self.maps[-1])
+    self.assertTrue(occupied_mask(self.maps[0]) is masks[0])
+    self.assertFalse(occupied_mask(self.maps[1]) is masks[1])
+
+  def test_maps_are_hashed_once(self):
+    hashed = []
+    hash_grid = grid._hash_grid
+    def counting(the_map, array):
+      hashed.append(the_map)
+      return hash_grid(the_map, array)
+    grid._hash_grid = counting
+    try:
+      the_map = box_map(seed=10)
+      for i in range(3):
+        map_hash(the_map)
+        occupied_mask(the_map)
+        map_array(the_map)
+    finally:
+      grid._hash_grid = hash_grid
+    self.assertEqual(len(hashed), 1)
+
+  def test_derived_arrays_are_read_only(self):
+    the_map = self.maps[0]
+    self.assertFalse(map_array(the_map).flags.writeable)
+    self.assertFalse(occupied_mask(the_map).flags.writeable)
+
+if __name__ == '__main__':
+  import rosunit
+  rosunit.unitrun('assignment_4', 'test_grid', TestGrid)
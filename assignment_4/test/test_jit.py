@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('assignment_4')
+from assignment_4.laser import *
+from assignment_4.grid import map_array
+from assignment_4 import jit
+from fixtures import box_map, free_poses
+import numpy as np
+import math
+import unittest
+
+MAX_RANGE = 2.0
+MIN_ANGLE = -3*math.pi/4
+N_READINGS = 37
+INCREMENT = 3*math.pi/2/(N_READINGS - 1)
+
+#-------------------------------------------------------------------------------
+# The numba kernels against the numpy backend
+@unittest.skipUnless(jit.available, 'numba is not installed')
+class TestJit(unittest.TestCase):
+
+  def setUp(self):
+    self.the_map = box_map()
+    self.poses = free_poses(self.the_map, 40)
+    # Poses off the cell centers and axis aligned beams too
+    self.poses[:20, :2] += np.random.RandomState(2).uniform(0, 1, (20, 2))
+    self.poses[20:25, 2] = np.arange(5)*math.pi/2
+
+  def tearDown(self):
+    set_backend('numpy')
+
+  def scans(self, backend, beams=None):
+    set_backend(backend)
+    return batch_expected_scan(self.poses, MIN_ANGLE, INCREMENT, N_READINGS, MAX_RANGE, self.the_map, beams=beams)
+
+  def test_expected_scans(self):
+    # numpy's hypot may differ from math.hypot in the last bit
+    np.testing.assert_allclose(self.scans('numba'), self.scans('numpy'), rtol=0, atol=1e-9)
+
+  def test_expected_scans_beams(self):
+    beams = stride_beams(N_READINGS, 4)
+    np.testing.assert_allclose(self.scans('numba', beams), self.scans('numpy', beams), rtol=0, atol=1e-9)
+
+  def test_kernel(self):
+    angles = self.poses[:, 2:3] + MIN_ANGLE + INCREMENT*np.arange(N_READINGS)
+    ranges = jit.expected_scans(map_array(self.the_map), self.poses, angles, MAX_RANGE, self.the_map.info.resolution)
+    self.assertEqual(ranges.shape, (len(self.poses), N_READINGS))
+    np.testing.assert_allclose(ranges, self.scans('numpy'), rtol=0, atol=1e-9)
+
+  def test_scan_similarities(self):
+    scans = self.scans('numpy')
+    ranges = scans[3]
+    expected = batch_scan_similarity(ranges, scans, MAX_RANGE)
+    set_backend('numba')
+    np.testing.assert_allclose(batch_scan_similarity(ranges, scans, MAX_RANGE), expected, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(jit.scan_similarities(ranges, scans, MAX_RANGE), expected, rtol=0, atol=1e-12)
+
+  def test_auto(self):
+    set_backend('auto')
+    self.assertEqual(get_backend(), 'numba')
+
+if __name__ == '__main__':
+  import rosunit
+  rosunit.unitrun('assignment_4', 'test_jit', TestJit)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('assignment_4')
+from assignment_4.laser import *
+from assignment_4.grid import map_cells, occupied_mask
+from fixtures import box_map, free_poses
+import numpy as np
+import math
+import unittest
+
+MAX_RANGE = 2.0
+MIN_ANGLE = -3*math.pi/4
+N_READINGS = 37
+INCREMENT = 3*math.pi/2/(N_READINGS - 1)
+
+#-------------------------------------------------------------------------------
+# The vectorized ray casting and scoring against the scalar reference code
+class TestLaser(unittest.TestCase):
+
+  def setUp(self):
+    self.the_map = box_map()
+    self.poses = free_poses(self.the_map, 40)
+
+  def tearDown(self):
+    set_backend('numpy')
+
+  def test_cast_rays_matches_ray_tracing(self):
+    x = np.repeat(self.poses[:, 0], 12)
+    y = np.repeat(self.poses[:, 1], 12)
+    angles = np.tile(np.arange(12)*(2*math.pi/12) + 0.1, len(self.poses))
+    max_cells = MAX_RANGE/self.the_map.info.resolution
+    distances = cast_rays(occupied_mask(self.the_map), x, y, angles, max_cells)
+    for i in range(len(angles)):
+      hit = ray_tracing(x[i], y[i], angles[i], self.the_map, max_cells)
+      if hit is None:
+        self.assertEqual(distances[i], np.inf)
+      else:
+        self.assertAlmostEqual(distances[i], math.hypot(hit[0] - x[i], hit[1] - y[i]), places=9)
+
+  def test_axis_aligned_rays(self):
+    # dx or dy is exactly 0 for these, which the traversal must not divide by
+    angles = np.array([0, math.pi/2, math.pi, 3*math.pi/2])
+    pose = self.poses[0]
+    distances = cast_rays(occupied_mask(self.the_map), np.repeat(pose[0], 4), np.repeat(pose[1], 4), angles, 1000)
+    for angle, distance in zip(angles, distances):
+      hit = ray_tracing(pose[0], pose[1], angle, self.the_map)
+      self.assertAlmostEqual(distance, math.hypot(hit[0] - pose[0], hit[1] - pose[1]), places=9)
+
+  def test_batch_expected_scan_matches_expected_scan(self):
+    scans = batch_expected_scan(self.poses, MIN_ANGLE, INCREMENT, N_READINGS, MAX_RANGE, self.the_map)
+    for pose, scan in zip(self.poses, scans):
+      expected = expected_scan(pose[0], pose[1], pose[2], MIN_ANGLE, INCREMENT, N_READINGS, MAX_RANGE, self.the_map)
+      np.testing.assert_allclose(scan, expected, rtol=0, atol=1e-9)
+
+  def test_array_data(self):
+    # Maps from the bag cache hold an int8 array, which ray_tracing reads
+    # through a list copy
+    expected = [expected_scan(pose[0], pose[1], pose[2], MIN_ANGLE, INCREMENT, N_READINGS, MAX_RANGE, self.the_map)
+                for pose in self.poses[:5]]
+    self.the_map.data = np.asarray(self.the_map.data, dtype=np.int8)
+    self.assertTrue(isinstance(map_cells(self.the_map), list))
+    for pose, scan in zip(self.poses[:5], expected):
+      np.testing.assert_array_equal(expected_scan(pose[0], pose[1], pose[2], MIN_ANGLE, INCREMENT, N_READINGS, MAX_RANGE, self.the_map), scan)
+
+  def test_beams(self):
+    beams = stride_beams(N_READINGS, 5)
+    full = batch_expected_scan(self.poses, MIN_ANGLE, INCREMENT, N_READINGS, MAX_RANGE, self.the_map)
+    subset = batch_expected_scan(self.poses, MIN_ANGLE, INCREMENT, N_READINGS, MAX_RANGE, self.the_map, beams=beams)
+    np.testing.assert_array_equal(subset, full[:, beams])
+    ranges = full[0]
+    np.testing.assert_allclose(batch_scan_similarity(ranges, subset, MAX_RANGE, beams),
+                               batch_scan_similarity(ranges[beams], full[:, beams], MAX_RANGE))
+
+  def test_stride_beams(self):
+    np.testing.assert_array_equal(stride_beams(10, 3), [0, 3, 6, 9])
+    np.testing.assert_array_equal(stride_beams(10, 4), [0, 4, 8])
+    # A stride below one keeps every beam
+    np.testing.assert_array_equal(stride_beams(5, 0), np.arange(5))
+
+  def test_evenly_spaced_beams(self):
+    beams = evenly_spaced_beams(N_READINGS, 7)
+    self.assertEqual(len(beams), 7)
+    self.assertTrue((np.diff(beams) > 0).all())
+    # The first and the last beam are always in
+    self.assertEqual((beams[0], beams[-1]), (0, N_READINGS - 1))
+    self.assertTrue(np.diff(beams).max() - np.diff(beams).min() <= 1)
+    np.testing.assert_array_equal(evenly_spaced_beams(N_READINGS, 1000), np.arange(N_READINGS))
+    np.testing.assert_array_equal(evenly_spaced_beams(N_READINGS, 0), [0])
+
+  def test_random_beams(self):
+    np.random.seed(0)
+    beams = random_beams(N_READINGS, 10)
+    self.assertEqual(len(np.unique(beams)), 10)
+    self.assertTrue((np.diff(beams) > 0).all())
+    self.assertTrue(0 <= beams[0] and beams[-1] < N_READINGS)
+    np.testing.assert_array_equal(random_beams(N_READINGS, 1000), np.arange(N_READINGS))
+
+  def test_adaptive_beams(self):
+    adaptive = AdaptiveBeams(N_READINGS, min_beams=5, max_beams=25, wide=2.0, narrow=0.2)
+    rng = np.random.RandomState(0)
+    counts = []
+    for spread in [10.0, 2.0, 1.1, 0.5, 0.2, 0.01]:
+      positions = rng.normal(0, spread/math.sqrt(2), (2000, 2))
+      beams = adaptive.select(positions)
+      self.assertEqual((beams[0], beams[-1]), (0, N_READINGS - 1))
+      counts.append(len(beams))
+    # Clamped at min_beams when spread out and at max_beams when converged,
+    # more beams as the particles converge
+    self.assertEqual(counts[0], 5)
+    self.assertEqual(counts[-1], 25)
+    self.assertEqual(counts[-2], 25)
+    self.assertTrue(5 < counts[2] < 25)
+    self.assertEqual(counts, sorted(counts))
+    self.assertEqual(len(adaptive.select(np.zeros((0, 2)))), 5)
+    # Counts past the scan are cut to the number of readings
+    self.assertEqual(len(AdaptiveBeams(N_READINGS, 100, 200).select(np.zeros((1, 2)))), N_READINGS)
+
+  def test_batch_scan_similarity_matches_scan_similarity(self):
+    scans = batch_expected_scan(self.poses, MIN_ANGLE, INCREMENT, N_READINGS, MAX_RANGE, self.the_map)
+    ranges = scans[0]
+    scores = batch_scan_similarity(ranges, scans, MAX_RANGE)
+    for scan, score in zip(scans, scores):
+      self.assertAlmostEqual(score, scan_similarity(ranges.tolist(), scan.tolist(), MAX_RANGE), places=12)
+    self.assertAlmostEqual(scores[0], 1.0)
+
+  def test_python_backend_is_the_reference(self):
+    numpy_scans = batch_expected_scan(self.poses, MIN_ANGLE, INCREMENT, N_READINGS, MAX_RANGE, self.the_map)
+    set_backend('python')
+    python_scans = batch_expected_scan(self.poses, MIN_ANGLE, INCREMENT, N_READINGS, MAX_RANGE, self.the_map)
+    np.testing.assert_allclose(numpy_scans, python_scans, rtol=0, atol=1e-9)
+
+  def test_unknown_backend(self):
+    self.assertRaises(ValueError, set_backend, 'fortran')
+
+  def test_top_k(self):
+    scores = np.array([0.5, 0.9, 0.1, 0.9, 0.7])
+    np.testing.assert_array_equal(top_k(scores, 3), [1, 3, 4])
+    np.testing.assert_array_equal(top_k(scores, 10), [1, 3, 4, 0, 2])
+    np.testing.assert_array_equal(top_k(scores, 2), np.argsort(-scores, kind='mergesort')[:2])
+    self.assertEqual(len(top_k(scores, 0)), 0)
+    self.assertEqual(len(top_k(scores, -1)), 0)
+    self.assertEqual(len(top_k([], 3)), 0)
+
+if __name__ == '__main__':
+  import rosunit
+  rosunit.unitrun('assignment_4', 'test_laser', TestLaser)
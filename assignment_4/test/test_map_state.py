@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('assignment_4')
+from assignment_4.map_state import *
+from assignment_4.grid import FreeCellIndex, free_cell_index
+from assignment_4.range_table import build_range_table
+from assignment_4.likelihood import LikelihoodField
+from assignment_4.tiled import TiledGrid, build_tiled_grid
+from fixtures import box_map
+import numpy as np
+import copy
+import unittest
+
+MAX_RANGE = 1.0
+N_ANGLES = 16
+
+#-------------------------------------------------------------------------------
+# Incremental map updates against rebuilding everything from the new map
+class TestMapState(unittest.TestCase):
+
+  def setUp(self):
+    self.the_map = box_map(80, 70)
+    self.state = MapState(self.the_map, build_range_table(self.the_map, N_ANGLES, MAX_RANGE),
+                          LikelihoodField(self.the_map), tile_size=16)
+
+  def assert_rebuilt(self):
+    the_map = self.state.the_map
+    index = free_cell_index(the_map)
+    full = FreeCellIndex(the_map)
+    np.testing.assert_array_equal(np.sort(index.cells), np.sort(full.cells))
+    np.testing.assert_array_equal(index.starts, full.starts)
+    np.testing.assert_array_equal(index.free, full.free)
+
+    table = self.state.table
+    full = build_range_table(the_map, N_ANGLES, MAX_RANGE)
+    # Cells that became free are not added to the table, they are ray traced
+    valid = table.cells >= 0
+    self.assertTrue((full.cells[valid] >= 0).all())
+    np.testing.assert_array_equal(table.ranges[table.cells[valid]], full.ranges[full.cells[valid]])
+
+    np.testing.assert_allclose(self.state.field.distances, LikelihoodField(the_map).distances, atol=1e-6)
+
+  def test_add_obstacle(self):
+    report = self.state.patch(30, 30, np.full((3, 4), 100))
+    self.assertEqual(report.changed_cells, int((np.asarray(self.the_map.data).reshape(70, 80)[30:33, 30:34] != 100).sum()))
+    self.assertTrue(report.rays[0] < report.rays[1])
+    self.assert_rebuilt()
+
+  def test_remove_obstacle_and_several_changes(self):
+    self.state.patch(0, 20, np.zeros((5, 1)))
+    self.state.patch(50, 10, np.full((2, 2), 100))
+    self.state.patch(10, 60, np.full((1, 6), -1))
+    self.assert_rebuilt()
+
+  def test_changed_rects(self):
+    old = np.zeros((10, 10), dtype=np.int8)
+    new = old.copy()
+    new[1:3, 2:4] = 100
+    new[7, 8] = 100
+    self.assertEqual(sorted(changed_rects(old, new)), [(2, 1, 4, 3), (8, 7, 9, 8)])
+
+  def test_tiled_map(self):
+    tiled = copy.copy(self.the_map)
+    tiled.data = build_tiled_grid(self.the_map, 16)
+    self.assertRaises(ValueError, MapState, tiled, field=LikelihoodField(self.the_map))
+    state = MapState(tiled)
+    self.state.field = self.state.table = None
+    for x, y, values in [(30, 30, np.full((3, 20), 100)), (0, 20, np.zeros((5, 1)))]:
+      report = state.patch(x, y, values)
+      flat_report = self.state.patch(x, y, values)
+      self.assertTrue(isinstance(state.the_map.data, TiledGrid))
+      np.testing.assert_array_equal(np.asarray(state.the_map.data), np.asarray(self.state.the_map.data))
+      self.assertEqual(report.changed_cells, flat_report.changed_cells)
+      self.assertEqual(len(free_cell_index(state.the_map)), len(free_cell_index(self.state.the_map)))
+    self.assertEqual(report.buckets, (1, 25))
+    # A new map that is not tiled is tiled
+    report = state.update(self.the_map)
+    self.assertTrue(isinstance(state.the_map.data, TiledGrid))
+    np.testing.assert_array_equal(np.asarray(state.the_map.data), np.asarray(self.the_map.data))
+
+  def test_size_change(self):
+    self.assertRaises(ValueError, self.state.update, box_map(40, 40))
+
+if __name__ == '__main__':
+  import rosunit
+  rosunit.unitrun('assignment_4', 'test_map_state', TestMapState)
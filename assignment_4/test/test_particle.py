@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('assignment_4')
+from assignment_4.particle import *
+from assignment_4.grid import grid_to_world
+from fixtures import box_map, free_poses
+import numpy as np
+import math
+import random
+import unittest
+
+#-------------------------------------------------------------------------------
+# Resampling of ParticleSet and the list based resample, the motion update and
+# KLD sampling
+class TestParticle(unittest.TestCase):
+
+  def setUp(self):
+    np.random.seed(0)
+    random.seed(0)
+    self.the_map = box_map()
+    poses = free_poses(self.the_map, 30)
+    x, y = grid_to_world(poses[:, 0], poses[:, 1], self.the_map)
+    self.poses = np.column_stack((x, y, poses[:, 2]))
+    # Particles with the best score are copied without noise, the others are
+    # never picked
+    self.weights = np.zeros(len(self.poses))
+    self.weights[[2, 5, 11, 17, 23, 29, 0]] = 1.0
+
+  def assert_low_variance(self, new_poses, n_particles):
+    self.assertEqual(len(new_poses), n_particles)
+    best = np.flatnonzero(self.weights == 1)
+    parents = [int(np.flatnonzero((self.poses == pose).all(axis=1))[0]) for pose in np.asarray(new_poses)]
+    counts = np.bincount(parents, minlength=len(self.poses))
+    self.assertEqual(counts.sum(), n_particles)
+    self.assertEqual(counts[self.weights == 0].sum(), 0)
+    # Every parent gets its share of the evenly spaced pointers, give or
+    # take one
+    share = float(n_particles)/len(best)
+    self.assertTrue((np.abs(counts[best] - share) <= 1.5).all(), counts[best])
+
+  def test_resample_set(self):
+    particles = resample(ParticleSet(self.poses, self.weights), 100, self.the_map)
+    self.assertTrue(isinstance(particles, ParticleSet))
+    self.assert_low_variance(particles.poses, 100)
+
+  def test_resample_list(self):
+    weighted = ParticleSet(self.poses, self.weights).weighted()
+    particles = resample(weighted, 100, self.the_map)
+    self.assert_low_variance(particles, 100)
+
+  def test_new_particles_are_free(self):
+    noise = np.ones(len(self.poses))
+    poses = new_particles(self.poses, noise, noise, self.the_map)
+    self.assertTrue(valid_positions(poses[:, 0], poses[:, 1], self.the_map).all())
+
+  def test_motion_update_without_motion(self):
+    particles = motion_update(ParticleSet(self.poses, self.weights), (0, 0, 0), self.the_map)
+    np.testing.assert_array_equal(particles.poses, self.poses)
+    particles = motion_update(ParticleSet(self.poses, self.weights), (0, 0, 0.5), self.the_map)
+    np.testing.assert_array_equal(particles.poses[:, :2], self.poses[:, :2])
+
+  def test_motion_update_drops_particles_in_walls(self):
+    weights = np.arange(len(self.poses), dtype=float)
+    particles = motion_update(ParticleSet(self.poses, weights), (0.5, 0, 0), self.the_map)
+    self.assertTrue(0 < len(particles) < len(self.poses))
+    self.assertTrue(valid_positions(particles.poses[:, 0], particles.poses[:, 1], self.the_map).all())
+    # The survivors keep their weights
+    self.assertTrue(set(particles.weights.tolist()) <= set(weights.tolist()))
+    # Driving off the map leaves no particle: they are drawn again at random
+    particles = motion_update(ParticleSet(self.poses, weights), (10, 0, 0), self.the_map)
+    self.assertEqual(len(particles), len(self.poses))
+    self.assertTrue(valid_positions(particles.poses[:, 0], particles.poses[:, 1], self.the_map).all())
+
+  def test_kld_required(self):
+    kld = KLDSampling(min_particles=10, max_particles=100000, epsilon=0.05, z=2.326)
+    k = 10
+    a = 2.0/(9*(k - 1))
+    expected = math.ceil((k - 1)/(2*0.05)*(1 - a + math.sqrt(a)*2.326)**3)
+    self.assertEqual(kld.required(k), expected)
+    required = kld.required(np.arange(1, 200))
+    self.assertTrue((np.diff(required) >= 0).all())
+    self.assertEqual(required[0], 10)
+    self.assertEqual(KLDSampling(max_particles=500).required(1000), 500)
+
+  def test_kld_count(self):
+    kld = KLDSampling(min_particles=20, max_particles=1000)
+    same = np.zeros((500, 3))
+    self.assertEqual(kld.count(same), 20)
+    # Five occupied bins need required(5) particles
+    five = np.column_stack(((np.arange(500) % 5)*kld.bin_size, np.zeros(500), np.zeros(500)))
+    self.assertEqual(kld.count(five), kld.required(5))
+    # A new bin for every particle is never enough: all of them are kept
+    spread = np.column_stack((np.arange(500)*kld.bin_size, np.zeros(500), np.zeros(500)))
+    self.assertEqual(kld.count(spread), 500)
+
+if __name__ == '__main__':
+  import rosunit
+  rosunit.unitrun('assignment_4', 'test_particle', TestParticle)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('assignment_4')
+from assignment_4.range_table import *
+from assignment_4.laser import batch_expected_scan
+from fixtures import box_map, free_poses
+import numpy as np
+import math
+import shutil
+import tempfile
+import unittest
+
+MAX_RANGE = 2.0
+N_ANGLES = 36
+STEP = 2*math.pi/N_ANGLES
+
+#-------------------------------------------------------------------------------
+# Range table lookups against ray casting
+class TestRangeTable(unittest.TestCase):
+
+  def setUp(self):
+    self.the_map = box_map()
+    self.table = build_range_table(self.the_map, N_ANGLES, MAX_RANGE)
+    # Headings and beams on the angles of the table
+    self.poses = free_poses(self.the_map, 40)
+    self.poses[:, 2] = np.random.RandomState(1).randint(0, N_ANGLES, len(self.poses))*STEP
+
+  def test_lookup_matches_ray_casting(self):
+    ranges = self.table.expected_scans(self.poses, -9*STEP, STEP, 19, MAX_RANGE, self.the_map)
+    expected = batch_expected_scan(self.poses, -9*STEP, STEP, 19, MAX_RANGE, self.the_map)
+    # Ranges are stored in steps of MAX_RANGE/RANGE_STEPS
+    np.testing.assert_allclose(ranges, expected, rtol=0, atol=MAX_RANGE/RANGE_STEPS)
+
+  def test_cells_that_are_not_free_are_ray_traced(self):
+    grid = np.asarray(self.the_map.data).reshape(self.the_map.info.height, self.the_map.info.width)
+    y, x = np.nonzero(grid != 0)
+    poses = np.column_stack((x[:20], y[:20], np.zeros(20))).astype(float)
+    ranges = self.table.expected_scans(poses, 0, STEP, 8, MAX_RANGE, self.the_map)
+    np.testing.assert_array_equal(ranges, batch_expected_scan(poses, 0, STEP, 8, MAX_RANGE, self.the_map))
+
+  def test_poses_off_the_map_are_ray_traced(self):
+    width, height = self.the_map.info.width, self.the_map.info.height
+    poses = np.array([[-1, 5, 0], [5, -3, 1], [width, 5, 2], [5, height + 2, 3], [-width + 3, -height + 3, 0]], dtype=float)
+    ranges = self.table.expected_scans(poses, 0, STEP, 8, MAX_RANGE, self.the_map)
+    np.testing.assert_array_equal(ranges, batch_expected_scan(poses, 0, STEP, 8, MAX_RANGE, self.the_map))
+
+  def test_max_range(self):
+    self.assertRaises(ValueError, self.table.expected_scans, self.poses, 0, STEP, 8, 2*MAX_RANGE, self.the_map)
+    ranges = self.table.expected_scans(self.poses, 0, STEP, 8, MAX_RANGE/2, self.the_map)
+    expected = batch_expected_scan(self.poses, 0, STEP, 8, MAX_RANGE/2, self.the_map)
+    np.testing.assert_allclose(ranges, expected, rtol=0, atol=MAX_RANGE/RANGE_STEPS)
+
+  def test_errors_between_table_angles_are_rare(self):
+    # Beams between two table angles read the nearer one. Only beams grazing
+    # a wall or passing the corner of an obstacle get a much longer or
+    # shorter range that way.
+    table = build_range_table(self.the_map, 360, MAX_RANGE)
+    poses = free_poses(self.the_map, 300)
+    increment = 1.5*math.pi/89
+    ranges = table.expected_scans(poses, -0.75*math.pi, increment, 90, MAX_RANGE, self.the_map)
+    expected = batch_expected_scan(poses, -0.75*math.pi, increment, 90, MAX_RANGE, self.the_map)
+    errors = np.abs(ranges - expected)/self.the_map.info.resolution
+    self.assertTrue(np.percentile(errors, 99) < 1.5)
+    self.assertTrue((errors > 2).mean() < 0.02)
+
+  def test_save_and_load(self):
+    path = tempfile.mkdtemp()
+    try:
+      self.table.save(path)
+      loaded = load_range_table(path)
+      np.testing.assert_array_equal(loaded.cells, self.table.cells)
+      np.testing.assert_array_equal(loaded.ranges, self.table.ranges)
+      self.assertEqual(loaded.max_range, MAX_RANGE)
+      table = get_range_table(self.the_map, N_ANGLES, MAX_RANGE, cache_dir=path)
+      np.testing.assert_array_equal(table.ranges, self.table.ranges)
+    finally:
+      shutil.rmtree(path)
+
+if __name__ == '__main__':
+  import rosunit
+  rosunit.unitrun('assignment_4', 'test_range_table', TestRangeTable)
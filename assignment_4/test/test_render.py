@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('assignment_4')
+from assignment_4.render import *
+from fixtures import box_map, free_poses
+import numpy as np
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+#-------------------------------------------------------------------------------
+# Frame queue and writer thread of MapRenderer, with a stub in place of savefig
+# that records the frames and can be held to keep the writer busy
+class TestMapRenderer(unittest.TestCase):
+
+  def setUp(self):
+    self.the_map = box_map()
+    self.poses = free_poses(self.the_map, 20)
+    self.output_dir = tempfile.mkdtemp()
+    self.saved = []
+    self.saving = threading.Event()
+    self.release = threading.Event()
+    self.release.set()
+
+  def tearDown(self):
+    self.release.set()
+    shutil.rmtree(self.output_dir)
+
+  def renderer(self, **kwargs):
+    renderer = MapRenderer(self.the_map, self.output_dir, **kwargs)
+    renderer.figure.savefig = self.savefig
+    return renderer
+
+  def savefig(self, path):
+    self.saving.set()
+    self.release.wait(10)
+    self.saved.append(os.path.basename(path))
+
+  def test_frames_are_written(self):
+    renderer = self.renderer(every=2)
+    particles = [(1.0, tuple(pose)) for pose in self.poses]
+    for i in range(5):
+      renderer.update(particles)
+    renderer.close()
+    self.assertEqual(self.saved, ['frame_00000.png', 'frame_00002.png', 'frame_00004.png'])
+    self.assertEqual((renderer.written, renderer.dropped), (3, 0))
+
+  def test_full_queue_drops_frames(self):
+    renderer = self.renderer(max_pending=2)
+    self.release.clear()
+    renderer.update([])
+    # The writer holds the first frame, so two more fill the queue
+    self.assertTrue(self.saving.wait(10))
+    for i in range(4):
+      renderer.update([])
+    self.assertEqual(renderer.dropped, 2)
+    self.release.set()
+    renderer.close()
+    self.assertEqual(self.saved, ['frame_00000.png', 'frame_00001.png', 'frame_00002.png'])
+    self.assertEqual(renderer.written, 3)
+
+  def test_close_joins_the_writer(self):
+    renderer = self.renderer()
+    self.release.clear()
+    renderer.update([])
+    self.assertTrue(self.saving.wait(10))
+    renderer.update([])
+    closing = threading.Thread(target=renderer.close)
+    closing.start()
+    # close() waits for the pending frames
+    closing.join(0.2)
+    self.assertTrue(closing.is_alive())
+    self.release.set()
+    closing.join(10)
+    self.assertFalse(closing.is_alive())
+    self.assertFalse(renderer.writer.is_alive())
+    self.assertEqual(renderer.written, 2)
+    # Closing again does nothing
+    renderer.close()
+
+if __name__ == '__main__':
+  import rosunit
+  rosunit.unitrun('assignment_4', 'test_render', TestMapRenderer)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('assignment_4')
+from assignment_4.score_cache import *
+import numpy as np
+import math
+import unittest
+
+#-------------------------------------------------------------------------------
+# Keys, LRU eviction and counters of ScoreCache
+class TestScoreCache(unittest.TestCase):
+
+  def setUp(self):
+    self.cache = ScoreCache(max_size=4, angle_bins=36)
+    self.scored = []
+
+  # Scores a pose by its cell and heading, and records the poses scored
+  def score_poses(self, poses):
+    self.scored.append(np.array(poses))
+    return poses[:, 0]*1000 + poses[:, 1] + poses[:, 2]
+
+  def scores(self, poses, context='map'):
+    return self.cache.scores(np.array(poses, dtype=float), self.score_poses, context)
+
+  def test_hit_within_cell_and_angle_bin(self):
+    step = 2*math.pi/36
+    first = self.scores([(3.2, 4.7, 2*step + 0.08)])
+    second = self.scores([(3.9, 4.1, 2*step - 0.08), (3.5, 4.5, 2*step)])
+    self.assertEqual(len(self.scored), 1)
+    # The pose is scored at the center of its heading bin
+    np.testing.assert_allclose(self.scored[0], [(3, 4, 2*step)])
+    np.testing.assert_array_equal(second, [first[0], first[0]])
+    self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+  def test_miss_across_bins(self):
+    step = 2*math.pi/36
+    self.scores([(3.5, 4.5, 2*step)])
+    self.scores([(4.0, 4.5, 2*step), (3.5, 5.0, 2*step), (3.5, 4.5, 3*step)])
+    self.assertEqual(len(self.cache), 4)
+    self.assertEqual((self.cache.hits, self.cache.misses), (0, 4))
+    # Headings wrap around: 2*pi falls in the bin of 0
+    self.scores([(0, 0, 0)])
+    self.scores([(0, 0, 2*math.pi - 0.01)])
+    self.assertEqual(self.cache.hits, 1)
+
+  def test_repeats_are_scored_once(self):
+    scores = self.scores([(1, 1, 0), (1, 1, 0), (2, 1, 0)])
+    self.assertEqual(len(self.scored[0]), 2)
+    self.assertEqual(scores[0], scores[1])
+    self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+  def test_lru_eviction(self):
+    self.scores([(i, 0, 0) for i in range(4)])
+    # Using the oldest entry makes the second one the least recently used
+    self.scores([(0, 0, 0)])
+    self.scores([(4, 0, 0), (5, 0, 0)])
+    self.assertEqual(len(self.cache), 4)
+    self.assertEqual(self.cache.evictions, 2)
+    self.assertEqual(sorted(self.cache.entries), [(0, 0, 0), (3, 0, 0), (4, 0, 0), (5, 0, 0)])
+
+  def test_context_change_clears(self):
+    self.scores([(1, 1, 0), (2, 2, 0)])
+    self.scores([(1, 1, 0)], context='other scan')
+    self.assertEqual(len(self.cache), 1)
+    self.assertEqual(len(self.scored), 2)
+    self.scores([(1, 1, 0)], context='other scan')
+    self.assertEqual(len(self.scored), 2)
+
+  def test_hit_rate(self):
+    self.assertEqual(self.cache.hit_rate(), 0.0)
+    self.scores([(1, 1, 0), (2, 2, 0)])
+    self.scores([(1, 1, 0), (2, 2, 0), (3, 3, 0)])
+    self.assertAlmostEqual(self.cache.hit_rate(), 2.0/5)
+    self.assertEqual(self.cache.evictions, 0)
+
+if __name__ == '__main__':
+  import rosunit
+  rosunit.unitrun('assignment_4', 'test_score_cache', TestScoreCache)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('assignment_4')
+from assignment_4.search import *
+from assignment_4.likelihood import LikelihoodField
+from assignment_4.laser import batch_expected_scan
+from assignment_4.grid import map_array, OCCUPIED
+from fixtures import box_map, free_poses
+import numpy as np
+import math
+import unittest
+
+MAX_RANGE = 2.0
+N_ANGLES = 36
+MIN_ANGLE = -2.35
+INCREMENT = 0.05
+
+#-------------------------------------------------------------------------------
+# Branch and bound search against scoring every pose
+class TestSearch(unittest.TestCase):
+
+  # Best pose of a scan over every cell that is not occupied, first in
+  # (x, y, theta) order on ties
+  def brute_force(self, the_map, field, ranges):
+    y, x = np.nonzero(map_array(the_map) != OCCUPIED)
+    order = np.lexsort((y, x))
+    cells = np.column_stack((x[order], y[order]))
+    poses = np.column_stack((np.repeat(cells, N_ANGLES, axis=0), np.tile(np.arange(N_ANGLES), len(cells))))
+    scores = field.score_poses(poses*[1, 1, 2*math.pi/N_ANGLES], ranges, MIN_ANGLE, INCREMENT, MAX_RANGE)
+    best = np.argmax(scores)
+    return tuple(poses[best]), scores[best]
+
+  def assert_brute_force(self, the_map, n_scans, seed):
+    field = LikelihoodField(the_map)
+    poses = free_poses(the_map, n_scans, seed)
+    scans = batch_expected_scan(poses, MIN_ANGLE, INCREMENT, 90, MAX_RANGE, the_map)
+    for ranges in scans:
+      (x, y, theta), score, n_scored = branch_and_bound_search(field, the_map, ranges, MIN_ANGLE, INCREMENT, MAX_RANGE, N_ANGLES)
+      pose, best = self.brute_force(the_map, field, ranges)
+      self.assertEqual((x, y, int(round(theta/(2*math.pi/N_ANGLES)))), pose)
+      self.assertEqual(score, best)
+
+  def test_box_map(self):
+    self.assert_brute_force(box_map(), 4, 0)
+
+  def test_larger_maps(self):
+    for seed in [1, 2]:
+      self.assert_brute_force(box_map(100, 80, n_boxes=15, seed=seed), 1, seed)
+
+  def test_max_pyramid(self):
+    grid = np.random.RandomState(0).rand(13, 10)
+    pyramid = max_pyramid(grid, 3)
+    for level, pooled in enumerate(pyramid):
+      size = 2**level
+      for y, x in [(0, 0), (5, 3), (12, 9), (9, 7)]:
+        self.assertEqual(pooled[y, x], grid[y:y+size, x:x+size].max())
+
+if __name__ == '__main__':
+  import rosunit
+  rosunit.unitrun('assignment_4', 'test_search', TestSearch)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('assignment_4')
+from assignment_4.signature import *
+from assignment_4.likelihood import LikelihoodField
+from assignment_4.laser import batch_expected_scan
+from assignment_4.grid import map_array, FREE
+from fixtures import box_map, free_poses
+import numpy as np
+import math
+import shutil
+import tempfile
+import unittest
+
+MAX_RANGE = 2.0
+N_ANGLES = 36
+N_READINGS = 45
+MIN_ANGLE = -3*math.pi/4
+INCREMENT = 3*math.pi/2/(N_READINGS - 1)
+
+#-------------------------------------------------------------------------------
+# Signature index search against scoring every pose
+class TestSignature(unittest.TestCase):
+
+  def setUp(self):
+    self.the_map = box_map()
+    self.field = LikelihoodField(self.the_map)
+    self.index = build_signature_index(self.the_map, 120, MAX_RANGE, MIN_ANGLE, INCREMENT*(N_READINGS - 1))
+    # Scans taken from cells at heading bins
+    self.poses = free_poses(self.the_map, 10)
+    self.poses[:, 2] = np.random.RandomState(1).randint(0, N_ANGLES, len(self.poses))*2*math.pi/N_ANGLES
+    self.scans = batch_expected_scan(self.poses, MIN_ANGLE, INCREMENT, N_READINGS, MAX_RANGE, self.the_map)
+
+  def score_poses(self, poses, ranges):
+    return self.field.score_poses(poses, ranges, MIN_ANGLE, INCREMENT, MAX_RANGE)
+
+  def test_localize_matches_brute_force(self):
+    y, x = np.nonzero(map_array(self.the_map) == FREE)
+    order = np.lexsort((y, x))
+    cells = np.column_stack((x[order], y[order]))
+    poses = np.column_stack((np.repeat(cells, N_ANGLES, axis=0), np.tile(np.arange(N_ANGLES)*2*math.pi/N_ANGLES, len(cells))))
+    found = 0
+    for ranges in self.scans:
+      score_poses = lambda poses: self.score_poses(poses, ranges)
+      (x, y, theta), score, n_scored = self.index.localize(score_poses, self.the_map, ranges, MIN_ANGLE, INCREMENT, N_ANGLES, top_k=20)
+      scores = score_poses(poses)
+      best = np.argmax(scores)
+      self.assertTrue(score <= scores[best])
+      self.assertTrue(n_scored < len(poses)/10)
+      found += (x, y) == tuple(poses[best, :2]) and abs(theta - poses[best, 2]) < 1e-9
+    # The index is a heuristic, but it should rarely miss on a small map
+    self.assertTrue(found >= 9, found)
+
+  def test_match_heading(self):
+    # A scan from an indexed cell matches that cell at the heading of the scan,
+    # give or take one stored angle for the rounding of the beam angles
+    rows = np.random.RandomState(2).randint(0, len(self.index.cells), 5)
+    step = 2*math.pi/self.index.n_angles
+    for row in rows:
+      x, y = self.index.cells[row]
+      theta = 7*row % self.index.n_angles*step
+      ranges = batch_expected_scan(np.array([[x, y, theta]]), MIN_ANGLE, INCREMENT, N_READINGS, MAX_RANGE, self.the_map)[0]
+      poses, scores = self.index.match(ranges, MIN_ANGLE, INCREMENT)
+      same = (poses[:, 0] == x) & (poses[:, 1] == y)
+      self.assertTrue(same.any())
+      self.assertTrue(abs(poses[same][0, 2] - theta) < step + 1e-9)
+
+  def test_cache(self):
+    path = tempfile.mkdtemp()
+    try:
+      index = get_signature_index(self.the_map, 120, MAX_RANGE, MIN_ANGLE, INCREMENT*(N_READINGS - 1), cache_dir=path)
+      loaded = get_signature_index(self.the_map, 120, MAX_RANGE, MIN_ANGLE, INCREMENT*(N_READINGS - 1), cache_dir=path)
+      np.testing.assert_array_equal(loaded.profiles, index.profiles)
+      self.assertEqual((loaded.min_angle, loaded.span, loaded.headings), (index.min_angle, index.span, index.headings))
+      # A laser with another field of view gets an index of its own
+      other = get_signature_index(self.the_map, 120, MAX_RANGE, -math.pi, 2*math.pi, cache_dir=path)
+      self.assertEqual(other.span, 2*math.pi)
+      self.assertEqual(len(os.listdir(path)), 2)
+    finally:
+      shutil.rmtree(path)
+
+if __name__ == '__main__':
+  import rosunit
+  rosunit.unitrun('assignment_4', 'test_signature', TestSignature)
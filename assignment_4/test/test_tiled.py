@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('assignment_4')
+from assignment_4.tiled import *
+from assignment_4.grid import map_array, free_cell_index, grid_to_world
+from assignment_4.laser import ray_tracing
+from fixtures import box_map, free_poses
+import numpy as np
+import copy
+import shutil
+import tempfile
+import unittest
+
+#-------------------------------------------------------------------------------
+# Tile encoding and patching against the flat map
+class TestTiled(unittest.TestCase):
+
+  def setUp(self):
+    # Neither side is a multiple of the tile size
+    self.the_map = box_map(70, 45)
+    self.grid = build_tiled_grid(self.the_map, 16)
+    self.tiled = copy.copy(self.the_map)
+    self.tiled.data = self.grid
+
+  def test_decode(self):
+    flat = map_array(self.the_map).ravel()
+    np.testing.assert_array_equal(np.asarray(self.grid), flat)
+    self.assertEqual(len(self.grid), len(flat))
+    for index in [0, 1, 69, 70, 1000, len(flat) - 1]:
+      self.assertEqual(self.grid[index], flat[index])
+    cells = np.random.RandomState(0).randint(0, len(flat), 500)
+    np.testing.assert_array_equal(self.grid[cells], flat[cells])
+    self.assertRaises(IndexError, self.grid.__getitem__, len(flat))
+
+  def test_free_counts(self):
+    self.assertEqual(int(self.grid.free_counts.sum()), int((map_array(self.the_map) == 0).sum()))
+    self.assertEqual(len(free_cell_index(self.tiled)), int(self.grid.free_counts.sum()))
+
+  def test_lru(self):
+    grid = build_tiled_grid(self.the_map, 8)
+    grid.max_tiles = 3
+    np.asarray(grid)
+    self.assertEqual(len(grid.decoded), 3)
+
+  def test_ray_tracing(self):
+    for x, y, theta in free_poses(self.the_map, 30):
+      self.assertEqual(ray_tracing(x, y, theta, self.tiled), ray_tracing(x, y, theta, self.the_map))
+
+  def test_sampling_is_free(self):
+    np.random.seed(0)
+    x, y = free_cell_index(self.tiled).sample(200)
+    self.assertTrue(free_cell_index(self.the_map).valid_positions(x, y).all())
+
+  def test_patched(self):
+    flat = map_array(self.the_map).copy()
+    tiles_before = self.grid.loads
+    # Across tile borders and cut off at the right edge of the map
+    patched = self.grid.patched(60, 10, np.full((10, 20), 100))
+    flat[10:20, 60:80] = 100
+    patched = patched.patched(5, 30, np.full((3, 3), -1)).patched(0, 0, np.zeros((2, 2)))
+    flat[30:33, 5:8] = -1
+    flat[0:2, 0:2] = 0
+    np.testing.assert_array_equal(np.asarray(patched), flat.ravel())
+    np.testing.assert_array_equal(np.asarray(self.grid), map_array(self.the_map).ravel())
+    self.assertEqual(int(patched.free_counts.sum()), int((flat == 0).sum()))
+    self.assertEqual(sorted(self.grid.changed_tiles(patched).tolist()), [0, 3, 4, 5, 8, 9, 10])
+    self.assertEqual(len(self.grid.changed_tiles(self.grid)), 0)
+
+  def test_free_index_updated(self):
+    patched = copy.copy(self.tiled)
+    patched.data = self.grid.patched(10, 10, np.full((4, 4), 100))
+    index, tiles = free_cell_index(self.tiled).updated(patched, 10, 10, 14, 14)
+    self.assertEqual(tiles, 1)
+    self.assertEqual(len(index), int((np.asarray(patched.data) == 0).sum()))
+    self.assertFalse(index.valid_positions(*grid_to_world(np.array([11]), np.array([12]), patched)).any())
+    self.assertRaises(ValueError, free_cell_index(self.tiled).updated, self.the_map, 10, 10, 14, 14)
+
+  def test_save_and_load(self):
+    path = tempfile.mkdtemp()
+    try:
+      self.grid.save(path)
+      loaded = load_tiled_grid(path)
+      np.testing.assert_array_equal(np.asarray(loaded), np.asarray(self.grid))
+    finally:
+      shutil.rmtree(path)
+
+  def test_tile_size(self):
+    self.assertRaises(ValueError, build_tiled_grid, self.the_map, 12)
+
+if __name__ == '__main__':
+  import rosunit
+  rosunit.unitrun('assignment_4', 'test_tiled', TestTiled)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+import roslib; roslib.load_manifest('localization')
+from localization.bag import get_cached_dict
+from localization.filter import hill_climb_step, pose_error
+from localization.synthetic import synthetic_map, synthetic_scan
+from assignment_3.geometry import *
+from assignment_4.laser import *
+from assignment_4.particle import *
+from assignment_4 import jit
+from assignment_4.grid import FreeCellIndex
+from assignment_4.likelihood import LikelihoodField
+from assignment_4.map_state import MapState
+from tf.transformations import euler_from_quaternion
+from timeit import default_timer
+import argparse
+import json
+import platform
+import random
+import time
+import numpy as np
+
+# Parse Args
+parser = argparse.ArgumentParser(description='Localization Benchmarks (no ROS master needed)')
+parser.add_argument('mapbag', nargs='?')
+parser.add_argument('databag', nargs='?')
+parser.add_argument('-synthetic',  default=0, type=int, help='benchmark on a random square map of this many cells per side instead of bags')
+parser.add_argument('-poses',      default=50, type=int, help='poses per ray casting benchmark')
+parser.add_argument('-particles',  default=100, type=int)
+parser.add_argument('-iterations', default=10, type=int)
+parser.add_argument('-seed',       default=0, type=int)
+parser.add_argument('-output',     default='benchmark.json', help='file the results are written to as JSON')
+parser.add_argument('-backend',    default='numpy', choices=['auto'] + BACKENDS, help='implementation of the batch benchmarks')
+parser.add_argument('-verify',     action='store_true', help='check that every installed backend gives the same scans and scores')
+
+args = parser.parse_args()
+if not args.synthetic and not (args.mapbag and args.databag):
+    parser.error('give a map bag and a data bag, or -synthetic')
+set_backend(args.backend)
+
+random.seed(args.seed)
+np.random.seed(args.seed)
+
+# Get Data
+if args.synthetic:
+    the_map = synthetic_map(args.synthetic, args.synthetic, seed=args.seed)
+    scan, true_pos = synthetic_scan(the_map, seed=args.seed)
+else:
+    the_map = get_cached_dict( args.mapbag )['/map']
+    test_files = get_cached_dict( args.databag )
+    scan = test_files['/base_scan']
+    pose = test_files['/base_pose_ground_truth'].pose.pose
+    true_pos = pose.position.x, pose.position.y, euler_from_quaternion((pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w))[2]
+n_readings = len(scan.ranges)
+
+# Summary statistics of a list of durations
+def latency(durations):
+    durations = np.asarray(durations)
+    return {'mean': durations.mean(), 'p50': np.percentile(durations, 50),
+            'p90': np.percentile(durations, 90), 'p99': np.percentile(durations, 99),
+            'max': durations.max()}
+
+def timed(function, *arguments):
+    start = default_timer()
+    result = function(*arguments)
+    return default_timer() - start, result
+
+results = {
+    'time': time.time(),
+    'python': platform.python_version(),
+    'map': args.mapbag or 'synthetic',
+    'data': args.databag or 'synthetic',
+    'map_size': [the_map.info.width, the_map.info.height],
+    'resolution': the_map.info.resolution,
+    'n_readings': n_readings,
+    'seed': args.seed,
+    'backend': get_backend(),
+}
+
+# Random poses in open cells, in map coordinates
+poses = random_particles(args.poses, the_map).grid_poses(the_map)[0]
+pose_list = [(int(x), int(y), theta) for x, y, theta in poses]
+max_cells = int(scan.range_max/the_map.info.resolution)
+
+# Every installed backend against the python reference, on the same poses
+if args.verify:
+    backend = get_backend()
+    set_backend('python')
+    reference = batch_expected_scan(poses, scan.angle_min, scan.angle_increment, n_readings, scan.range_max, the_map)
+    reference_scores = batch_scan_similarity(scan.ranges, reference, scan.range_max)
+    for name in BACKENDS:
+        if name == 'python' or name == 'numba' and not jit.available:
+            continue
+        set_backend(name)
+        scans = batch_expected_scan(poses, scan.angle_min, scan.angle_increment, n_readings, scan.range_max, the_map)
+        scores = batch_scan_similarity(scan.ranges, scans, scan.range_max)
+        # numpy's hypot may differ from math.hypot in the last bit
+        mismatched = int((np.abs(scans - reference) > 1e-9).sum())
+        score_error = float(np.abs(scores - reference_scores).max())
+        results['verify_' + name] = {'mismatched_ranges': mismatched, 'max_score_error': score_error}
+        print 'verify', name, 'mismatched ranges:', mismatched, 'max score error:', score_error
+        if mismatched or score_error > 1e-6:
+            raise SystemExit('backend %s does not match the reference' % name)
+    set_backend(backend)
+
+# line_seg
+cells = 0
+durations = []
+for x, y, theta in pose_list:
+    x1 = int(x + max_cells*math.cos(theta))
+    y1 = int(y + max_cells*math.sin(theta))
+    duration, points = timed(line_seg, x, y, x1, y1)
+    durations.append(duration)
+    cells += len(points)
+results['line_seg'] = {'cells_per_sec': cells/sum(durations), 'latency': latency(durations)}
+
+# ray_tracing
+durations = []
+for x, y, theta in pose_list:
+    durations.append(timed(ray_tracing, x, y, theta, the_map)[0])
+results['ray_tracing'] = {'beams_per_sec': len(durations)/sum(durations), 'latency': latency(durations)}
+
+# expected_scan
+durations = []
+for x, y, theta in pose_list:
+    durations.append(timed(expected_scan, x, y, theta, scan.angle_min, scan.angle_increment, n_readings, scan.range_max, the_map)[0])
+results['expected_scan'] = {'poses_per_sec': len(durations)/sum(durations),
+                            'beams_per_sec': len(durations)*n_readings/sum(durations),
+                            'latency': latency(durations)}
+
+# batch_expected_scan
+duration, scans = timed(batch_expected_scan, poses, scan.angle_min, scan.angle_increment, n_readings, scan.range_max, the_map)
+results['batch_expected_scan'] = {'poses_per_sec': len(poses)/duration,
+                                  'beams_per_sec': len(poses)*n_readings/duration}
+
+# scan_similarity
+durations = []
+for ex_scan in scans:
+    durations.append(timed(scan_similarity, scan.ranges, ex_scan, scan.range_max)[0])
+results['scan_similarity'] = {'poses_per_sec': len(durations)/sum(durations), 'latency': latency(durations)}
+
+# batch_scan_similarity
+duration = timed(batch_scan_similarity, scan.ranges, scans, scan.range_max)[0]
+results['batch_scan_similarity'] = {'poses_per_sec': len(scans)/duration}
+
+# resample
+particles = random_particles(args.particles, the_map)
+particles.weights = np.random.uniform(0, 1, len(particles))
+duration = timed(resample, particles, args.particles, the_map)[0]
+results['resample'] = {'particles_per_sec': args.particles/duration}
+
+# Patching a box into the map, updating the free cell index and the
+# likelihood field incrementally, against building them again
+state = MapState(the_map, field=LikelihoodField(the_map))
+box = max(1, min(the_map.info.width, the_map.info.height)//50)
+x, y = pose_list[0][:2]
+duration, report = timed(state.patch, x, y, np.full((box, box), 100))
+full = timed(lambda: (FreeCellIndex(state.the_map), LikelihoodField(state.the_map)))[0]
+results['map_update'] = {'incremental_sec': duration, 'full_sec': full, 'report': str(report)}
+
+# Full hill climbing iterations, and the error of the final estimate
+particles = random_particles(args.particles, the_map)
+durations = []
+for iteration in range(args.iterations):
+    start = default_timer()
+    particles, scored, grid_poses, scans, best_index = hill_climb_step(particles, args.particles, scan, the_map)
+    durations.append(default_timer() - start)
+    best_estimate = tuple(scored.poses[best_index])
+position_error, heading_error = pose_error(best_estimate, true_pos)
+results['hill_climb'] = {'particles': args.particles, 'iterations': args.iterations,
+                         'latency': latency(durations),
+                         'position_error': position_error, 'heading_error': heading_error}
+
+for name in ['line_seg', 'ray_tracing', 'expected_scan', 'batch_expected_scan', 'scan_similarity', 'batch_scan_similarity', 'resample', 'map_update', 'hill_climb']:
+    print name, results[name]
+
+with open(args.output, 'w') as f:
+    json.dump(results, f, indent=2, sort_keys=True)
+print "Results written to", args.output
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import roslib; roslib.load_manifest('localization')
+from localization.bag import get_cached_dict
+from localization.filter import hill_climb_step, score_particles_at, pose_error
+from assignment_3.geometry import *
+from assignment_4.laser import *
+from assignment_4.particle import *
+from assignment_4.grid import occupied_mask, free_cell_index
+from assignment_4.range_table import get_range_table
+from assignment_4.likelihood import LikelihoodField
+from assignment_4.search import branch_and_bound_search
+from assignment_4.signature import get_signature_index
+from tf.transformations import euler_from_quaternion
+from timeit import default_timer
+import argparse
+import csv
+import glob
+import multiprocessing
+import random
+import numpy as np
+
+# Parse Args
+parser = argparse.ArgumentParser(description='Localization Accuracy and Speed over many Bags (no ROS master needed)')
+parser.add_argument('mapbag')
+parser.add_argument('databags', nargs='+', help='data bags or glob patterns, e.g. "cse550-*.bag"')
+parser.add_argument('-method',     default='hill_climb', choices=['hill_climb', 'pyramid', 'index'])
+parser.add_argument('-particles',  default=100, type=int, help='particles of -method hill_climb')
+parser.add_argument('-iterations', default=5, type=int, help='iterations of -method hill_climb')
+parser.add_argument('-angles',     default=72, type=int, help='angles of -method pyramid and index')
+parser.add_argument('-levels',     default=4, type=int, help='levels of blocks above single cells of -method pyramid')
+parser.add_argument('-top',        default=20, type=int, help='candidates refined by -method index')
+parser.add_argument('-index_stride', default=4, type=int, help='cell spacing of the signature index of -method index')
+parser.add_argument('-index_angles', default=120, type=int, help='ranges stored around each cell of the signature index')
+parser.add_argument('-candidates', default=100, type=int, help='cells taken from the signature index')
+parser.add_argument('-table',      default=0, type=int, help='angle bins of a cached range table, approximate and slow to build the first time, see range_table.py (0 ray traces every scan)')
+parser.add_argument('-model',      default='beam', choices=['beam', 'field'], help='score expected scans (beam) or a likelihood field (field)')
+parser.add_argument('-backend',    default='numpy', choices=['auto'] + BACKENDS, help='implementation of batch ray casting and scoring')
+parser.add_argument('-workers',    default=1, type=int, help='bags evaluated in parallel')
+parser.add_argument('-seed',       default=0, type=int, help='seed of the first bag, the next bags use seed+1, seed+2, ...')
+parser.add_argument('-output',     default='evaluation.csv', help='file the results table is written to as CSV')
+
+args = parser.parse_args()
+if args.method == 'pyramid' and args.model != 'field':
+    parser.error('-method pyramid bounds likelihood field scores, use -model field')
+set_backend(args.backend)
+
+databags = []
+for pattern in args.databags:
+    databags.extend(sorted(glob.glob(pattern)) or [pattern])
+
+# The map and everything derived from it are loaded once, before the workers
+# are forked
+the_map = get_cached_dict( args.mapbag )['/map']
+occupied_mask(the_map)
+free_cell_index(the_map)
+field = None
+if args.model == 'field':
+    field = LikelihoodField(the_map)
+# The bags are assumed to share one laser, so the range table and signature
+# index built for the first bag serve them all
+first_scan = get_cached_dict( databags[0] )['/base_scan']
+range_max = first_scan.range_max
+table = None
+if args.table:
+    table = get_range_table(the_map, args.table, range_max)
+index = None
+if args.method == 'index':
+    span = first_scan.angle_increment*(len(first_scan.ranges) - 1)
+    index = get_signature_index(the_map, args.index_angles, range_max, first_scan.angle_min, span, args.index_stride)
+
+# Localizes the robot in one data bag
+def evaluate(job):
+    run, databag = job
+    seed = args.seed + run
+    random.seed(seed)
+    np.random.seed(seed)
+
+    test_files = get_cached_dict( databag )
+    scan = test_files['/base_scan']
+    pose = test_files['/base_pose_ground_truth'].pose.pose
+    true_pos = pose.position.x, pose.position.y, euler_from_quaternion((pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w))[2]
+
+    # Poses scored, counted by every method
+    calls = [0, 0]
+    def score_poses(poses):
+        calls[0] += 1
+        calls[1] += len(poses)
+        return score_particles_at(poses, scan, the_map, table, field)[0]
+
+    start = default_timer()
+    if args.method == 'hill_climb':
+        particles = random_particles(args.particles, the_map)
+        for iteration in range(args.iterations):
+            particles, scored, grid_poses, scans, best_index = hill_climb_step(particles, args.particles, scan, the_map, table, field)
+            calls[0] += 1
+            calls[1] += len(scored)
+            best_score = scored.weights[best_index]
+            estimate = tuple(scored.poses[best_index])
+    else:
+        if args.method == 'pyramid':
+            (x, y, theta), best_score, n_scored = branch_and_bound_search(field, the_map, scan.ranges, scan.angle_min, scan.angle_increment, scan.range_max, args.angles, args.levels)
+            calls[0] += 1
+            calls[1] += n_scored
+        else:
+            (x, y, theta), best_score, n_scored = index.localize(score_poses, the_map, scan.ranges, scan.angle_min, scan.angle_increment, args.angles, args.candidates, args.top)
+        world = to_world(x, y, the_map.info.origin.position.x, the_map.info.origin.position.y, the_map.info.width, the_map.info.height, the_map.info.resolution)
+        estimate = (world[0], world[1], theta)
+    runtime = default_timer() - start
+
+    position_error, heading_error = pose_error(estimate, true_pos)
+    return {'bag': databag, 'seed': seed, 'position_error': position_error,
+            'heading_error': float(heading_error), 'score': float(best_score), 'runtime': runtime,
+            'score_calls': calls[0], 'poses_scored': calls[1],
+            'x': estimate[0], 'y': estimate[1], 'theta': estimate[2]}
+
+jobs = list(enumerate(databags))
+if args.workers > 1:
+    pool = multiprocessing.Pool(args.workers)
+    results = pool.map(evaluate, jobs)
+    pool.close()
+    pool.join()
+else:
+    results = [evaluate(job) for job in jobs]
+
+columns = ['bag', 'seed', 'position_error', 'heading_error', 'score', 'runtime', 'score_calls', 'poses_scored', 'x', 'y', 'theta']
+print "%-20s %6s %10s %10s %8s %9s %7s %9s" % ('bag', 'seed', 'pos err', 'head err', 'score', 'time (s)', 'calls', 'poses')
+for result in results:
+    print "%-20s %6d %10.3f %10.3f %8.4f %9.3f %7d %9d" % tuple(result[column] for column in columns[:8])
+position_errors = np.array([result['position_error'] for result in results])
+heading_errors = np.array([result['heading_error'] for result in results])
+runtimes = np.array([result['runtime'] for result in results])
+print
+print "Position error: mean %.3f median %.3f max %.3f" % (position_errors.mean(), np.median(position_errors), position_errors.max())
+print "Heading error:  mean %.3f median %.3f max %.3f" % (heading_errors.mean(), np.median(heading_errors), heading_errors.max())
+print "Runtime:        mean %.3f total %.3f" % (runtimes.mean(), runtimes.sum())
+
+with open(args.output, 'w') as f:
+    writer = csv.DictWriter(f, columns)
+    writer.writeheader()
+    writer.writerows(results)
+print "Results written to", args.output
@@ -1,25 +1,44 @@
 #!/usr/bin/env python
 
 import roslib; roslib.load_manifest('localization')
-from localization.bag import get_dict
+from localization.bag import get_cached_dict
 from assignment_3.geometry import *
 from assignment_4.laser import *
+from assignment_4.range_table import get_range_table
+from assignment_4.likelihood import LikelihoodField
+from assignment_4.search import branch_and_bound_search
+from assignment_4.signature import get_signature_index
 from math import pi
 from tf.transformations import euler_from_quaternion
 import argparse
+import multiprocessing
 
 # Parse Args
 parser = argparse.ArgumentParser(description='Brute Force Pose Finder')
 parser.add_argument('mapbag')
 parser.add_argument('databag')
 parser.add_argument('-resolution',  default=1, type=int)
-parser.add_argument('-angles',      default=8, type=int)
+parser.add_argument('-angles',      default=8, type=int, help='headings searched, also by the pyramid and index searches')
+parser.add_argument('-table',       default=0, type=int, help='angle bins of a cached range table, approximate and slow to build the first time, see range_table.py (0 ray traces every scan)')
+parser.add_argument('-model',       default='beam', choices=['beam', 'field'], help='score expected scans (beam) or a likelihood field (field)')
+parser.add_argument('-workers',     default=1, type=int, help='number of processes searching the map in parallel')
+parser.add_argument('-chunk',       default=4, type=int, help='map columns per parallel task')
+parser.add_argument('-search',      default='brute', choices=['brute', 'pyramid', 'index'], help='score every pose (brute), branch and bound over a max pooled likelihood field, exact and -model field only (pyramid) or match scan signatures (index)')
+parser.add_argument('-levels',      default=4, type=int, help='levels of blocks above single cells in the pyramid search')
+parser.add_argument('-top',         default=20, type=int, help='candidates refined at each level of the index search')
+parser.add_argument('-index_stride', default=4, type=int, help='spacing (cells) of the cells in the signature index')
+parser.add_argument('-index_angles', default=120, type=int, help='ranges stored around each cell of the signature index')
+parser.add_argument('-candidates',  default=100, type=int, help='cells matched by range histogram in the index search')
+parser.add_argument('-backend',     default='numpy', choices=['auto'] + BACKENDS, help='implementation of batch ray casting and scoring')
 
 args = parser.parse_args()
+if args.search == 'pyramid' and args.model != 'field':
+    parser.error('-search pyramid bounds likelihood field scores, use -model field')
+set_backend(args.backend)
 
 # Get Data From Bag Files
-the_map = get_dict( args.mapbag )['/map']
-test_files = get_dict( args.databag )
+the_map = get_cached_dict( args.mapbag )['/map']
+test_files = get_cached_dict( args.databag )
 scan = test_files['/base_scan']
 truth = test_files['/base_pose_ground_truth']
 
@@ -27,21 +46,76 @@ pose = truth.pose.pose
 true_pos = pose.position.x, pose.position.y, euler_from_quaternion((pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w))[2]
 print "True Position:", true_pos
 
+table = None
+if args.table:
+    table = get_range_table(the_map, args.table, scan.range_max)
+field = None
+if args.model == 'field':
+    field = LikelihoodField(the_map)
+
 angles = [float(i)/args.angles * 2 * pi for i in range(args.angles)]
 
-best = None
-best_score = -1E6
-
-for x in range(0, the_map.info.width, args.resolution):
-    for y in range(0, the_map.info.height, args.resolution):
-        for theta in angles:
-            ex_scan = expected_scan(x, y, theta, scan.angle_min, scan.angle_increment, len(scan.ranges), scan.range_max, the_map)
-            score = scan_similarity(scan.ranges, ex_scan, scan.range_max)
-            if score > best_score:
-                best_score = score
-                world = to_world(x, y, the_map.info.origin.position.x, the_map.info.origin.position.y, the_map.info.width, the_map.info.height, the_map.info.resolution)
-                best = (world[0],world[1],theta)
-                print "Current best:", best_score, best
+def score_pose(x, y, theta):
+    if field is not None:
+        return field.score(x, y, theta, scan.ranges, scan.angle_min, scan.angle_increment, scan.range_max)
+    ex_scan = expected_scan(x, y, theta, scan.angle_min, scan.angle_increment, len(scan.ranges), scan.range_max, the_map, table)
+    return scan_similarity(scan.ranges, ex_scan, scan.range_max)
+
+# Best pose over a range of map columns, visited in the same order as the
+# serial search so that ties resolve the same way
+def search_columns(columns, verbose=False):
+    best = None
+    best_score = -1E6
+    for x in columns:
+        for y in range(0, the_map.info.height, args.resolution):
+            for theta in angles:
+                score = score_pose(x, y, theta)
+                if score > best_score:
+                    best_score = score
+                    world = to_world(x, y, the_map.info.origin.position.x, the_map.info.origin.position.y, the_map.info.width, the_map.info.height, the_map.info.resolution)
+                    best = (world[0],world[1],theta)
+                    if verbose:
+                        print "Current best:", best_score, best
+    return best_score, best
+
+def score_poses(poses):
+    if field is not None:
+        return field.score_poses(poses, scan.ranges, scan.angle_min, scan.angle_increment, scan.range_max)
+    scans = batch_expected_scan(poses, scan.angle_min, scan.angle_increment, len(scan.ranges), scan.range_max, the_map, table)
+    return batch_scan_similarity(scan.ranges, scans, scan.range_max)
+
+columns = range(0, the_map.info.width, args.resolution)
+
+if args.search == 'pyramid':
+    (x, y, theta), best_score, n_scored = branch_and_bound_search(field, the_map, scan.ranges, scan.angle_min, scan.angle_increment, scan.range_max, args.angles, args.levels)
+    world = to_world(x, y, the_map.info.origin.position.x, the_map.info.origin.position.y, the_map.info.width, the_map.info.height, the_map.info.resolution)
+    best = (world[0],world[1],theta)
+    print "Poses scored:", n_scored
+elif args.search == 'index':
+    span = scan.angle_increment*(len(scan.ranges) - 1)
+    index = get_signature_index(the_map, args.index_angles, scan.range_max, scan.angle_min, span, args.index_stride)
+    (x, y, theta), best_score, n_scored = index.localize(score_poses, the_map, scan.ranges, scan.angle_min, scan.angle_increment, args.angles, args.candidates, args.top)
+    world = to_world(x, y, the_map.info.origin.position.x, the_map.info.origin.position.y, the_map.info.width, the_map.info.height, the_map.info.resolution)
+    best = (world[0],world[1],theta)
+    print "Poses scored:", n_scored
+elif args.workers > 1:
+    # Workers are forked after the map is loaded, so they share its pages (the
+    # memory mapped grid of the bag cache) instead of receiving a pickled copy
+    # with every chunk
+    chunks = [columns[i:i+args.chunk] for i in range(0, len(columns), args.chunk)]
+    pool = multiprocessing.Pool(args.workers)
+    best = None
+    best_score = -1E6
+    for score, pose in pool.imap(search_columns, chunks):
+        if score > best_score:
+            best_score = score
+            best = pose
+            print "Current best:", best_score, best
+    pool.close()
+    pool.join()
+else:
+    best_score, best = search_columns(columns, verbose=True)
+
 print                 
 print "Final Estimate:", best, best_score
 print "True Position:", true_pos
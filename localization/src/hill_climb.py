@@ -2,15 +2,28 @@
 
 import roslib; roslib.load_manifest('localization')
 from localization import *
-from localization.bag import get_dict
+from localization.bag import get_cached_dict
+from localization.filter import hill_climb_step
+from localization.publisher import BackgroundPublisher
 from assignment_3.geometry import *
 from assignment_4.laser import *
+from assignment_4.range_table import get_range_table
+from assignment_4.tiled import get_tiled_map
+from assignment_4.likelihood import LikelihoodField
+from assignment_4.score_cache import ScoreCache
 from assignment_4.particle import *
+from assignment_4.render import MapRenderer
+from assignment_4.cluster import *
+from assignment_4 import stats
 from math import pi
 import tf
 from tf.transformations import euler_from_quaternion, quaternion_from_euler
 import argparse
+import cProfile
 import copy
+import pstats
+import numpy as np
+from timeit import default_timer
 
 import rospy
 from sensor_msgs.msg import *
@@ -24,12 +37,59 @@ parser.add_argument('databag')
 parser.add_argument('-particles',  default=100, type=int)
 parser.add_argument('-iterations', default=5, type=int)
 parser.add_argument('-ros', action='store_true')
+parser.add_argument('-table', default=0, type=int, help='angle bins of a cached range table, approximate and slow to build the first time, see range_table.py (0 ray traces every scan)')
+parser.add_argument('-model', default='beam', choices=['beam', 'field'], help='score expected scans (beam) or a likelihood field (field)')
+parser.add_argument('-kld', action='store_true', help='adapt the number of particles with KLD sampling')
+parser.add_argument('-min_particles', default=50, type=int, help='fewest particles with -kld')
+parser.add_argument('-max_particles', default=5000, type=int, help='most particles with -kld')
+parser.add_argument('-kld_epsilon', default=0.05, type=float, help='KL divergence bound of -kld')
+parser.add_argument('-beams', default='all', choices=['all', 'stride', 'random', 'adaptive'], help='readings of the scan used for scoring')
+parser.add_argument('-beam_stride', default=4, type=int, help='stride of -beams stride')
+parser.add_argument('-beam_count', default=30, type=int, help='readings of -beams random, most readings of -beams adaptive')
+parser.add_argument('-min_beams', default=10, type=int, help='fewest readings of -beams adaptive')
+parser.add_argument('-full_score', action='store_true', help='also score the best particle with the whole scan each iteration, to see what -beams costs in accuracy')
+parser.add_argument('-reinject', default=0.0, type=float, help='fraction of particles redrawn near the best particles after resampling')
+parser.add_argument('-reinject_radius', default=0.5, type=float, help='radius (m) of -reinject')
+parser.add_argument('-reinject_centers', default=5, type=int, help='best particles -reinject samples around')
+parser.add_argument('-cache_size', default=0, type=int, help='most pose scores kept in an LRU cache (0 disables it)')
+parser.add_argument('-cache_angles', default=360, type=int, help='heading bins of the score cache')
+parser.add_argument('-cluster', default='none', choices=['none', 'grid', 'kmeans'], help='cluster the particles after scoring and report the top hypotheses')
+parser.add_argument('-cluster_cell', default=0.5, type=float, help='bin size (m) of -cluster grid')
+parser.add_argument('-cluster_angles', default=8, type=int, help='heading bins of -cluster grid')
+parser.add_argument('-clusters', default=5, type=int, help='clusters of -cluster kmeans')
+parser.add_argument('-hypotheses', default=3, type=int, help='hypotheses printed each iteration')
+parser.add_argument('-converge_mass', default=0.8, type=float, help='weight fraction the best hypothesis needs to dominate')
+parser.add_argument('-converge_spread', default=0.3, type=float, help='largest position spread (m) of a converged hypothesis')
+parser.add_argument('-converge_angle', default=0.3, type=float, help='largest heading spread (rad) of a converged hypothesis')
+parser.add_argument('-converge_patience', default=1, type=int, help='iterations in a row the filter must look converged to stop early')
+parser.add_argument('-scatter', default=0.0, type=float, help='fraction of particles redrawn uniformly when no hypothesis dominates')
+parser.add_argument('-publish_rate', default=10.0, type=float, help='rate (Hz) the estimate and scans are republished at with -ros')
+parser.add_argument('-particle_rate', default=2.0, type=float, help='most particle arrays published per second with -ros (0 publishes every cycle)')
+parser.add_argument('-frames', default=None, help='directory the particles of each drawn iteration are written to as PNG files')
+parser.add_argument('-frame_every', default=1, type=int, help='draw every this many iterations')
+parser.add_argument('-show', action='store_true', help='draw the particles in a window without pausing')
+parser.add_argument('-tiles', default=0, type=int, help='store the map in tiles of this many cells, decoded as particles visit them (0 keeps one flat array); needs -backend python and no -table, -model field, -frames or -show, which read the whole map')
+parser.add_argument('-backend', default=None, choices=['auto'] + BACKENDS, help='implementation of batch ray casting and scoring (default numpy, python with -tiles)')
+parser.add_argument('-stats', default=None, help='file the timers and counters of each iteration are written to as JSON lines (also published on /diagnostics with -ros)')
+parser.add_argument('-profile', default=None, help='file the cProfile stats of the run are written to, e.g. for snakeviz or flameprof')
 
 args = parser.parse_args()
+if args.backend is None:
+    args.backend = 'python' if args.tiles else 'numpy'
+# The vectorized backends, range tables, likelihood fields and drawing convert
+# the map to one array, which is what -tiles avoids
+if args.tiles and args.backend != 'python':
+    parser.error('-tiles needs -backend python')
+if args.tiles and (args.table or args.model == 'field' or args.frames or args.show):
+    parser.error('-tiles cannot be used with -table, -model field, -frames or -show')
+set_backend(args.backend)
 
 # Get Data From Bag Files
-the_map = get_dict( args.mapbag )['/map']
-test_files = get_dict( args.databag )
+map_msg = get_cached_dict( args.mapbag )['/map']
+the_map = map_msg
+if args.tiles:
+    the_map = get_tiled_map(map_msg, args.tiles)
+test_files = get_cached_dict( args.databag )
 scan = test_files['/base_scan']
 best_scan = copy.deepcopy(scan)
 truth = test_files['/base_pose_ground_truth']
@@ -38,83 +98,158 @@ pose = truth.pose.pose
 true_pos = pose.position.x, pose.position.y, euler_from_quaternion((pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w))[2]
 print "True Position:", true_pos
 
+table = None
+if args.table:
+    table = get_range_table(the_map, args.table, scan.range_max)
+field = None
+if args.model == 'field':
+    field = LikelihoodField(the_map)
+kld = None
+if args.kld:
+    kld = KLDSampling(args.min_particles, args.max_particles, args.kld_epsilon)
+cache = None
+if args.cache_size > 0:
+    cache = ScoreCache(args.cache_size, args.cache_angles)
+beams = None
+if args.beams == 'stride':
+    beams = stride_beams(len(scan.ranges), args.beam_stride)
+elif args.beams == 'adaptive':
+    adaptive_beams = AdaptiveBeams(len(scan.ranges), args.min_beams, args.beam_count)
+
 if args.ros:
     rospy.init_node('hill_climb')
     mpub = rospy.Publisher('/map', OccupancyGrid, latch=True, queue_size=10)
-    mpub.publish(the_map)
-    papub = rospy.Publisher('/poses', PoseArray, queue_size=10)
+    mpub.publish(map_msg)
     
     tposepub = rospy.Publisher('/truth', PoseStamped, latch=True, queue_size=10)
     truth = PoseStamped()
     truth.header.frame_id = '/map'
     truth.pose = apply(to_pose, true_pos)
     
-    posepub = rospy.Publisher('/estimate', PoseStamped, queue_size=10)
-    estimate = PoseStamped()
-    estimate.header.frame_id = '/map'
-    
-    laserpub_true = rospy.Publisher('/base_scan', LaserScan, latch=True, queue_size=10)
-    laserpub_expected = rospy.Publisher('/base_scan_expected', LaserScan, latch=True, queue_size=10)
-    
-    br = tf.TransformBroadcaster()
+    # Publishes the estimate, particles and scans without blocking the loop
+    publisher = BackgroundPublisher(scan, args.publish_rate, args.particle_rate)
 
     rospy.sleep(1)
     tposepub.publish(truth)
     
 
-pa = PoseArray()
-pa.header.frame_id = '/map'
-
-particles = []
-for i in range(args.particles):
-    particles.append( random_particle(the_map) )
-
-
-
-for iteration in range(args.iterations):
+particles = random_particles(args.particles, the_map)
+total_scored = 0
+renderer = None
+convergence = Convergence(args.converge_mass, args.converge_spread, args.converge_angle, args.converge_patience)
+converged = False
+dominated = True
+if args.frames or args.show:
+    renderer = MapRenderer(the_map, args.frames, args.frame_every, args.show)
+stats_log = None
+if args.stats:
+    stats.enable()
+    stats_log = stats.StatsLog(args.stats)
+profiler = None
+if args.profile:
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+# Prints, logs and publishes the timers and counters of an iteration, and
+# starts them from zero for the next one
+def report_stats(iteration, n_particles, best_score):
+    snapshot = stats.snapshot()
+    print "    stats:", stats.summary(snapshot)
+    stats_log.write(snapshot, iteration=iteration, particles=n_particles, score=best_score)
     if args.ros:
-        pa.poses = []
-        for x,y,theta in particles:
-            pa.poses.append(to_pose(x,y,theta))
-        pa.header.stamp = rospy.Time.now()    
-        papub.publish(pa)     
-    
-    scores = []
-    scans = [] 
-    for x,y,theta in particles:
-        result = to_grid(x,y, the_map.info.origin.position.x, the_map.info.origin.position.y, the_map.info.width, the_map.info.height, the_map.info.resolution)
-        if not result:
-            continue
-        else:
-            mx, my = result    
-        ex_scan = expected_scan(mx, my, theta, scan.angle_min, scan.angle_increment, len(scan.ranges), scan.range_max, the_map)
-        score = scan_similarity(scan.ranges, ex_scan, scan.range_max)
-        scores.append( (score, (x,y,theta) ))
-        scans.append(ex_scan)
-        
+        publisher.update_stats(snapshot)
+
+
+
+# The profile and stats are written even when the run is interrupted, e.g.
+# with Ctrl-C
+try:
+    for iteration in range(args.iterations):
+        if args.beams == 'random':
+            beams = random_beams(len(scan.ranges), args.beam_count)
+        elif args.beams == 'adaptive':
+            beams = adaptive_beams.select(particles.poses)
+
+        start = default_timer()
+        particles, scored, grid_poses, scans, best_index = hill_climb_step(particles, args.particles, scan, the_map,
+                                                                           table, field, beams, cache, kld)
+        step_time = default_timer() - start
+        scores = scored.weighted()
+        total_scored += len(scored)
+
+        best_score, best_estimate = scores[best_index]
+        # The whole scan of the best particle is only needed to publish it and
+        # for -full_score; scoring a subset of the beams or with the likelihood
+        # field does not compute it
+        if args.ros or args.full_score:
+            with stats.timer('best_scan'):
+                if scans is None or beams is not None:
+                    mx, my, theta = grid_poses[best_index]
+                    best_scan.ranges = expected_scan(mx, my, theta, scan.angle_min, scan.angle_increment, len(scan.ranges), scan.range_max, the_map, table)
+                else:
+                    best_scan.ranges = scans[best_index].tolist()
+        print "Best estimate (%d):"%iteration, best_estimate, best_score, "particles:", len(scored)
+        # Cost of scoring and resampling, and with -full_score the best
+        # particle scored with the whole scan to see what beam selection costs
+        # in accuracy
+        n_beams = len(scan.ranges) if beams is None else len(beams)
+        line = "    beams: %d step: %.1f ms" % (n_beams, step_time*1000)
+        if args.full_score:
+            line += " full scan score: %f" % scan_similarity(scan.ranges, best_scan.ranges, scan.range_max)
+        print line
+        if cache is not None:
+            print "    cache: %d entries, hit rate %.1f%%, %d evictions" % (len(cache), 100*cache.hit_rate(), cache.evictions)
+
+        if args.ros:
+            with stats.timer('publish'):
+                publisher.update(best_estimate, scored.poses, best_scan.ranges)
+
+        # Run debug function
+        with stats.timer('debug_call'):
+            debug_call(scores, the_map, renderer)
+
+        if args.cluster != 'none':
+            with stats.timer('cluster'):
+                if args.cluster == 'grid':
+                    labels = grid_clusters(scored.poses, args.cluster_cell, args.cluster_angles)
+                else:
+                    labels = kmeans_clusters(scored.poses, scored.weights, args.clusters)
+                found = hypotheses(scored.poses, scored.weights, labels)
+            print "    %d hypotheses:" % len(found)
+            for hypothesis in found[:args.hypotheses]:
+                print "       ", hypothesis
+            converged = convergence.update(found)
+            dominated = convergence.dominated(found)
+            if converged:
+                if stats.enabled:
+                    report_stats(iteration, len(scores), best_score)
+                print "Converged after %d iterations" % (iteration + 1)
+                break
+
+        with stats.timer('reinject'):
+            if args.reinject > 0:
+                centers = scored.poses[top_k(scored.weights, args.reinject_centers)]
+                particles = reinject(particles, centers, args.reinject_radius, args.reinject, the_map)
+            if args.scatter > 0 and not dominated:
+                particles = reinject_random(particles, args.scatter, the_map)
+        if stats.enabled:
+            report_stats(iteration, len(scores), best_score)
+
         if rospy.is_shutdown():
             break
-
-    best_index = sorted(range(len(scores)), key=lambda k: scores[k])[-1]
-    best_score, best_estimate = scores[best_index]
-    best_scan.ranges = copy.deepcopy(scans[best_index])
-    print "Best estimate (%d):"%iteration, best_estimate, best_score
-
-    if args.ros:    
-        estimate.pose = apply(to_pose, best_estimate)
-        posepub.publish(estimate)
-    
-        publish_update(laserpub_true, scan, br, best_estimate)
-        publish_update(laserpub_expected, best_scan, br, best_estimate)
-
-    # Run debug function
-    debug_call(scores, the_map)
-
-    particles = resample( scores, args.particles, the_map)
-
-    if rospy.is_shutdown():
-        break
+finally:
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+    if stats_log is not None:
+        stats_log.close()
 
 print "True Position:", true_pos
+print "Particles scored:", total_scored
+if renderer is not None:
+    renderer.close()
+    if args.frames:
+        print "Frames written:", renderer.written, "dropped:", renderer.dropped
 if args.ros:
     rospy.spin()
@@ -1,8 +1,87 @@
-import rosbag
+from roslib.message import get_message_class
+from io import BytesIO
+import numpy as np
+import hashlib
+import json
+import os
 
 def get_dict(filename):
+    import rosbag
     bag = rosbag.Bag(filename)
     X = {}
     for topic, msg, t in bag.read_messages():
         X[topic] = msg
-    return X    
+    return X
+
+# Yields (topic, msg, t) for the messages of a bag in time order, one at a
+# time, optionally only for some topics
+def iter_messages(filename, topics=None):
+    import rosbag
+    bag = rosbag.Bag(filename)
+    try:
+        for topic, msg, t in bag.read_messages(topics=topics):
+            yield topic, msg, t
+    finally:
+        bag.close()
+
+# Directory the converted bags are kept in, $ROS_HOME/bag_cache
+def default_cache_dir():
+    ros_home = os.environ.get('ROS_HOME', os.path.join(os.path.expanduser('~'), '.ros'))
+    return os.path.join(ros_home, 'bag_cache')
+
+# Cache entries are keyed by the bag's path, size and modification time
+def cache_key(filename):
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    digest = hashlib.sha1(('%s %d %r' % (path, stat.st_size, stat.st_mtime)).encode('utf-8'))
+    return '%s-%s' % (os.path.basename(path), digest.hexdigest()[:16])
+
+# Writes the last message of every topic of a bag to a cache directory. Messages
+# are stored in their serialized form, except for the cells of occupancy grids
+# which go to an int8 .npy file so that they can be memory mapped.
+def write_cache(X, path):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    entries = []
+    for i, (topic, msg) in enumerate(sorted(X.items())):
+        entry = {'topic': topic, 'type': msg._type, 'msg': '%d.msg' % i, 'data': None}
+        if msg._type == 'nav_msgs/OccupancyGrid':
+            entry['data'] = '%d.npy' % i
+            np.save(os.path.join(path, entry['data']), np.asarray(msg.data, dtype=np.int8))
+            data = msg.data
+            msg.data = []
+        buff = BytesIO()
+        msg.serialize(buff)
+        with open(os.path.join(path, entry['msg']), 'wb') as f:
+            f.write(buff.getvalue())
+        if entry['data'] is not None:
+            msg.data = data
+        entries.append(entry)
+    # Written last, a cache without its index is incomplete and is rebuilt
+    with open(os.path.join(path, 'index.json'), 'w') as f:
+        json.dump(entries, f)
+
+def read_cache(path):
+    with open(os.path.join(path, 'index.json')) as f:
+        entries = json.load(f)
+    X = {}
+    for entry in entries:
+        msg = get_message_class(entry['type'])()
+        with open(os.path.join(path, entry['msg']), 'rb') as f:
+            msg.deserialize(f.read())
+        if entry['data'] is not None:
+            msg.data = np.load(os.path.join(path, entry['data']), mmap_mode='r')
+        X[entry['topic']] = msg
+    return X
+
+# Same as get_dict, but the bag is only parsed the first time. Later calls read
+# the converted messages from the cache, and the cells of occupancy grids are a
+# memory mapped int8 array instead of a tuple of ints. Code reading one cell at
+# a time goes through grid.map_cells, which copies them to a list once.
+def get_cached_dict(filename, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    path = os.path.join(cache_dir, cache_key(filename))
+    if not os.path.exists(os.path.join(path, 'index.json')):
+        write_cache(get_dict(filename), path)
+    return read_cache(path)
@@ -0,0 +1,76 @@
+from assignment_4.laser import batch_expected_scan, batch_scan_similarity, top_k
+from assignment_4.particle import resample
+from assignment_4.grid import map_hash
+from assignment_4 import stats
+from math import hypot, pi, cos, sin
+import numpy as np
+
+# Scores a ParticleSet against a laser scan, using expected scans or, when a
+# LikelihoodField is given, the likelihood field. Particles that are off the
+# map are dropped. Only the readings in beams are scored when it is given.
+# With a ScoreCache, poses already scored for this map and scan are not scored
+# again. Returns the scored particles, their poses in map coordinates and their
+# expected scans (None with a likelihood field or a cache).
+def score_particles(particles, scan, the_map, table=None, field=None, beams=None, cache=None):
+    grid_poses, inside = particles.grid_poses(the_map)
+    particles = particles.subset(inside)
+    grid_poses = grid_poses[inside]
+
+    if cache is not None:
+        def score_poses(poses):
+            return score_particles_at(poses, scan, the_map, table, field, beams)[0]
+        # The scores hold for the contents of the map, the scan (by its
+        # header, scans are not copied around) and the scoring settings
+        context = (map_hash(the_map), scan.header.seq, scan.header.stamp,
+                   None if table is None else (table.n_angles, table.max_range),
+                   None if field is None else field.sigma, None if beams is None else tuple(beams))
+        particles.weights = cache.scores(grid_poses, score_poses, context)
+        scans = None
+    else:
+        particles.weights, scans = score_particles_at(grid_poses, scan, the_map, table, field, beams)
+    return particles, grid_poses, scans
+
+# Scores poses in map coordinates, see score_particles. Returns the scores and
+# the expected scans (None with a likelihood field). The time spent is added to
+# the expected_scan and scan_similarity (or likelihood_field) timers of
+# assignment_4.stats.
+def score_particles_at(grid_poses, scan, the_map, table=None, field=None, beams=None):
+    if field is not None:
+        with stats.timer('likelihood_field'):
+            return field.score_poses(grid_poses, scan.ranges, scan.angle_min, scan.angle_increment, scan.range_max, beams), None
+    with stats.timer('expected_scan'):
+        scans = batch_expected_scan(grid_poses, scan.angle_min, scan.angle_increment, len(scan.ranges), scan.range_max, the_map, table, beams)
+    with stats.timer('scan_similarity'):
+        scores = batch_scan_similarity(scan.ranges, scans, scan.range_max, beams)
+    return scores, scans
+
+# One iteration of the hill climbing filter: scores the particles against a
+# scan, see score_particles, and draws n_particles from them, see resample.
+# Returns the new particles, the scored particles, their poses in map
+# coordinates and expected scans, and the index of the best scored particle.
+# The time spent resampling is added to the resample timer of
+# assignment_4.stats.
+def hill_climb_step(particles, n_particles, scan, the_map, table=None, field=None, beams=None, cache=None, kld=None):
+    scored, grid_poses, scans = score_particles(particles, scan, the_map, table, field, beams, cache)
+    best_index = top_k(scored.weights, 1)[0]
+    with stats.timer('resample'):
+        particles = resample(scored, n_particles, the_map, kld)
+    return particles, scored, grid_poses, scans, best_index
+
+# Position error (meters) and absolute heading error (radians) of an estimate
+def pose_error(estimate, truth):
+    x, y, theta = estimate
+    true_x, true_y, true_theta = truth
+    heading = (theta - true_theta + pi) % (2*pi) - pi
+    return hypot(x - true_x, y - true_y), abs(heading)
+
+# Motion (dx, dy, dtheta) from pose0 to pose1, expressed in the frame of pose0
+def relative_motion(pose0, pose1):
+    x0, y0, theta0 = pose0
+    x1, y1, theta1 = pose1
+    dx = x1 - x0
+    dy = y1 - y0
+    c = cos(theta0)
+    s = sin(theta0)
+    dtheta = (theta1 - theta0 + pi) % (2*pi) - pi
+    return c*dx + s*dy, -s*dx + c*dy, dtheta
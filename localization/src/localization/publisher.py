@@ -0,0 +1,143 @@
+import rospy
+import tf
+import copy
+import threading
+import numpy as np
+from geometry_msgs.msg import Pose, PoseArray, PoseStamped
+from sensor_msgs.msg import LaserScan
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+from localization import to_pose
+
+# Builds a PoseArray from an array of shape (N, 3) of poses (x, y, theta). The
+# quaternions of all the poses are computed at once.
+def to_pose_array(poses, frame_id='/map'):
+    poses = np.asarray(poses, dtype=float).reshape(-1, 3)
+    half = poses[:, 2]/2
+    qz = np.sin(half).tolist()
+    qw = np.cos(half).tolist()
+    pa = PoseArray()
+    pa.header.frame_id = frame_id
+    pa.poses = [Pose() for i in range(len(poses))]
+    for pose, x, y, z, w in zip(pa.poses, poses[:, 0].tolist(), poses[:, 1].tolist(), qz, qw):
+        pose.position.x = x
+        pose.position.y = y
+        pose.orientation.z = z
+        pose.orientation.w = w
+    return pa
+
+# Builds a DiagnosticArray from a snapshot of assignment_4.stats, with one
+# value per counter and the seconds and calls of every timer
+def to_diagnostics(snapshot, name='localization'):
+    status = DiagnosticStatus()
+    status.level = DiagnosticStatus.OK
+    status.name = name
+    status.message = 'iteration stats'
+    for counter, n in sorted(snapshot['counters'].items()):
+        status.values.append(KeyValue(counter, str(n)))
+    for timer, value in sorted(snapshot['timers'].items()):
+        status.values.append(KeyValue(timer + ' seconds', '%.6f' % value['seconds']))
+        status.values.append(KeyValue(timer + ' calls', str(value['calls'])))
+    da = DiagnosticArray()
+    da.status = [status]
+    return da
+
+# Publishes the state of the filter from a background thread, so that the
+# filter never waits on ROS. update() only stores the latest estimate,
+# particles and expected scan, replacing anything that was not published yet;
+# the thread republishes the latest values at a fixed rate, like
+# publish_update does: both scans and the laser transform at rate Hz, the
+# estimate with them and the particles at most particle_rate Hz. Stats given
+# to update_stats() are published once on /diagnostics, a newer snapshot
+# replacing one that was not published yet.
+#   scan            measured LaserScan, also the template of the expected scan
+#   rate            publishing rate (Hz) of the scans, transform and estimate
+#   particle_rate   publishing rate (Hz) of the particles, 0 for every cycle
+class BackgroundPublisher(object):
+
+    def __init__(self, scan, rate=10.0, particle_rate=2.0):
+        self.scan = scan
+        self.expected = copy.deepcopy(scan)
+        self.period = 1.0/rate
+        self.particle_period = 1.0/particle_rate if particle_rate > 0 else 0.0
+        self.cycles = 0
+
+        self.laserpub_true = rospy.Publisher('/base_scan', LaserScan, latch=True, queue_size=10)
+        self.laserpub_expected = rospy.Publisher('/base_scan_expected', LaserScan, latch=True, queue_size=10)
+        self.posepub = rospy.Publisher('/estimate', PoseStamped, queue_size=10)
+        self.papub = rospy.Publisher('/poses', PoseArray, queue_size=10)
+        self.diagpub = rospy.Publisher('/diagnostics', DiagnosticArray, queue_size=10)
+        self.br = tf.TransformBroadcaster()
+
+        self.lock = threading.Lock()
+        self.latest = None
+        self.version = 0
+        self.stats = None
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Stores the latest state of the filter
+    # Parameters:
+    #   estimate    best pose (x, y, theta)
+    #   particles   array of shape (N, 3) of particle poses, or None
+    #   ranges      expected scan of the best pose, or None
+    def update(self, estimate, particles=None, ranges=None):
+        if particles is not None:
+            particles = np.array(particles, dtype=float)
+        if ranges is not None:
+            ranges = list(ranges)
+        with self.lock:
+            self.latest = (tuple(estimate), particles, ranges)
+            self.version += 1
+
+    # Stores a snapshot of assignment_4.stats, published with the next cycle
+    def update_stats(self, snapshot):
+        with self.lock:
+            self.stats = snapshot
+
+    def _run(self):
+        published = 0
+        estimate = None
+        last_particles = -float('inf')
+        pa = None
+        while not self.stopping.is_set() and not rospy.is_shutdown():
+            with self.lock:
+                latest, version = self.latest, self.version
+                snapshot, self.stats = self.stats, None
+            if snapshot is not None:
+                diagnostics = to_diagnostics(snapshot)
+                diagnostics.header.stamp = rospy.Time.now()
+                self.diagpub.publish(diagnostics)
+            if latest is not None and version != published:
+                # Messages are built once per update, not on every cycle
+                estimate, particles, ranges = latest
+                if ranges is not None:
+                    self.expected.ranges = ranges
+                if particles is not None:
+                    pa = to_pose_array(particles)
+                pose = PoseStamped()
+                pose.header.frame_id = '/map'
+                pose.pose = to_pose(*estimate)
+                published = version
+            if estimate is not None:
+                now = rospy.Time.now()
+                x, y, theta = estimate
+                for pub, scan in [(self.laserpub_true, self.scan), (self.laserpub_expected, self.expected)]:
+                    scan.header.stamp = now
+                    pub.publish(scan)
+                self.br.sendTransform((x, y, 0), tf.transformations.quaternion_from_euler(0, 0, theta),
+                                      now, '/base_laser_link', '/map')
+                pose.header.stamp = now
+                self.posepub.publish(pose)
+                if pa is not None and now.to_sec() - last_particles >= self.particle_period:
+                    pa.header.stamp = now
+                    self.papub.publish(pa)
+                    last_particles = now.to_sec()
+                self.cycles += 1
+            self.stopping.wait(self.period)
+
+    # Stops the publishing thread
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
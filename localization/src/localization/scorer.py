@@ -0,0 +1,56 @@
+from assignment_4.grid import map_array, free_cell_index
+from assignment_4.laser import batch_expected_scan
+from assignment_4.particle import ParticleSet
+from localization.filter import score_particles_at
+import numpy as np
+
+# Scores poses against one laser scan. The arrays derived from the map (grid,
+# occupied and free cell masks) are built when the scorer is created, so that
+# requests only pay for ray casting or the likelihood field lookups.
+#   the_map   map
+#   scan      measured LaserScan
+#   table     optional RangeTable of the map
+#   field     optional LikelihoodField of the map, used instead of expected
+#             scans when given
+class PoseScorer(object):
+
+    def __init__(self, the_map, scan, table=None, field=None):
+        self.the_map = the_map
+        self.scan = scan
+        self.table = table
+        self.field = field
+        self.n_readings = len(scan.ranges)
+        map_array(the_map)
+        free_cell_index(the_map)
+        self.requests = 0
+        self.poses_scored = 0
+
+    # Scores poses (x, y, theta) in real world coordinates. Returns a bool
+    # array telling which poses are on the map, their scores (0 off the map)
+    # and their expected scans (NaN off the map). With a likelihood field the
+    # expected scans are only cast when with_scans is set, and are None
+    # otherwise.
+    def score(self, poses, with_scans=True):
+        particles = ParticleSet(poses)
+        grid_poses, inside = particles.grid_poses(self.the_map)
+        scores = np.zeros(len(particles))
+        scans = None
+        if self.field is None or with_scans:
+            scans = np.empty((len(particles), self.n_readings))
+            scans.fill(np.nan)
+        if inside.any():
+            scores[inside], expected = score_particles_at(grid_poses[inside], self.scan, self.the_map,
+                                                          self.table, self.field)
+            if expected is None and scans is not None:
+                expected = self.expected_scans(grid_poses[inside])
+            if scans is not None:
+                scans[inside] = expected
+        self.requests += 1
+        self.poses_scored += len(particles)
+        return inside, scores, scans
+
+    # Expected scans of poses in map coordinates
+    def expected_scans(self, grid_poses):
+        scan = self.scan
+        return batch_expected_scan(grid_poses, scan.angle_min, scan.angle_increment, self.n_readings,
+                                   scan.range_max, self.the_map, self.table)
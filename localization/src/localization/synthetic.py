@@ -0,0 +1,118 @@
+from localization import to_pose
+from assignment_3.geometry import to_grid
+from assignment_4.laser import batch_expected_scan
+from assignment_4.particle import random_particles, valid_positions
+from nav_msgs.msg import OccupancyGrid, Odometry
+from sensor_msgs.msg import LaserScan
+from math import pi, cos, sin
+import numpy as np
+import rospy
+
+# Builds a map of the given size with walls around it and random boxes inside,
+# for benchmarking without the bundled bags. Cells are free or occupied.
+def synthetic_map(width, height, resolution=0.05, n_boxes=40, seed=0):
+    rng = np.random.RandomState(seed)
+    grid = np.zeros((height, width), dtype=np.int8)
+    grid[0, :] = grid[-1, :] = grid[:, 0] = grid[:, -1] = 100
+    for i in range(n_boxes):
+        w = rng.randint(2, max(3, width//8))
+        h = rng.randint(2, max(3, height//8))
+        x = rng.randint(1, max(2, width-w))
+        y = rng.randint(1, max(2, height-h))
+        grid[y:y+h, x:x+w] = 100
+
+    the_map = OccupancyGrid()
+    the_map.header.frame_id = '/map'
+    the_map.info.width = width
+    the_map.info.height = height
+    the_map.info.resolution = resolution
+    the_map.info.origin.position.x = -width*resolution/2
+    the_map.info.origin.position.y = -height*resolution/2
+    the_map.info.origin.orientation.w = 1.0
+    the_map.data = grid.ravel()
+    return the_map
+
+# Returns the laser scan a robot would see from a pose in a map (real world
+# coordinates)
+def laser_scan(the_map, pose, n_readings=90, max_range=5.0):
+    mx, my = to_grid(pose[0], pose[1], the_map.info.origin.position.x, the_map.info.origin.position.y, the_map.info.width, the_map.info.height, the_map.info.resolution)
+
+    scan = LaserScan()
+    scan.header.frame_id = '/base_laser_link'
+    scan.angle_min = -3*pi/4
+    scan.angle_max = 3*pi/4
+    scan.angle_increment = (scan.angle_max - scan.angle_min)/(n_readings - 1)
+    scan.range_max = max_range
+    scan.ranges = batch_expected_scan([(mx, my, pose[2])], scan.angle_min, scan.angle_increment, n_readings, max_range, the_map)[0].tolist()
+    return scan
+
+# Returns a random pose in a map (real world coordinates) and the laser scan a
+# robot would see from it
+def synthetic_scan(the_map, n_readings=90, max_range=5.0, seed=0):
+    np.random.seed(seed)
+    pose = next(iter(random_particles(1, the_map)))
+    return laser_scan(the_map, pose, n_readings, max_range), pose
+
+# Applies a relative motion (dx, dy, dtheta) in the robot frame to a pose
+def move(pose, motion):
+    x, y, theta = pose
+    dx, dy, dtheta = motion
+    return (x + cos(theta)*dx - sin(theta)*dy,
+            y + sin(theta)*dx + cos(theta)*dy,
+            (theta + dtheta + pi) % (2*pi) - pi)
+
+# Returns an odometry message of a pose (x, y, theta)
+def odometry(pose, stamp):
+    msg = Odometry()
+    msg.header.frame_id = '/odom'
+    msg.header.stamp = stamp
+    msg.pose.pose = to_pose(*pose)
+    return msg
+
+# Yields the messages of a robot driving around a map as (topic, msg, t)
+# tuples, like iter_messages does for a bag, to track without a recorded bag.
+# The robot drives straight and turns on the spot while a wall is ahead. Every
+# step has a scan and the true pose from where the robot is, and odometry that
+# drifts with noise proportional to the motion.
+# Parameters:
+#   the_map       map
+#   n_scans       number of scans
+#   rate          scans per second
+#   speed         forward speed in m/s
+#   turn_rate     turning speed in rad/s
+#   clearance     distance in m to a wall ahead at which the robot turns
+#   odom_noise    odometry noise standard deviation per meter or radian moved
+#   seed          seed of the start pose, the turns and the noise
+def synthetic_sequence(the_map, n_scans, rate=10.0, speed=0.5, turn_rate=1.0, clearance=0.3,
+                       odom_noise=0.05, n_readings=90, max_range=5.0, seed=0, scan_topic='/base_scan',
+                       odom_topic='/odom', truth_topic='/base_pose_ground_truth'):
+    np.random.seed(seed)
+    rng = np.random.RandomState(seed)
+    pose = next(iter(random_particles(1, the_map)))
+    odom = (0.0, 0.0, 0.0)
+    turn = 0
+    for i in range(n_scans):
+        t = rospy.Time.from_sec(i/rate)
+        scan = laser_scan(the_map, pose, n_readings, max_range)
+        scan.header.stamp = t
+        yield odom_topic, odometry(odom, t), t
+        yield truth_topic, odometry(pose, t), t
+        yield scan_topic, scan, t
+
+        # Closest wall within 15 degrees of the heading
+        angles = scan.angle_min + scan.angle_increment*np.arange(n_readings)
+        ahead = min(r for r, a in zip(scan.ranges, angles) if abs(a) < pi/12)
+        motion = (speed/rate, 0.0, 0.0)
+        if ahead > clearance:
+            x, y, theta = move(pose, motion)
+            if not valid_positions(np.array([x]), np.array([y]), the_map)[0]:
+                ahead = 0
+        if ahead > clearance:
+            turn = 0
+        else:
+            if turn == 0:
+                turn = rng.choice([-1, 1])
+            motion = (0.0, 0.0, turn*turn_rate/rate)
+        pose = move(pose, motion)
+        noisy = [m + rng.normal(0, odom_noise*abs(m)) if m else 0.0 for m in motion]
+        odom = move(odom, noisy)
@@ -2,29 +2,41 @@
 
 import roslib; roslib.load_manifest('localization')
 from localization import *
-from localization.bag import get_dict
+from localization.bag import get_cached_dict
+from localization.scorer import PoseScorer
+from localization.publisher import BackgroundPublisher
 from assignment_3.geometry import *
 from assignment_4.laser import *
+from assignment_4.grid import world_to_grid, grid_to_world
+from assignment_4.range_table import get_range_table
+from assignment_4.likelihood import LikelihoodField
 from math import pi
-import tf
 from tf.transformations import euler_from_quaternion
 import argparse
+import sys
+import time
+import numpy as np
 
 import rospy
 from sensor_msgs.msg import *
 from nav_msgs.msg import *
 from geometry_msgs.msg import *
+from std_msgs.msg import Float32MultiArray
 
 # Parse Args
 parser = argparse.ArgumentParser(description='Pose Scorer')
 parser.add_argument('mapbag')
 parser.add_argument('databag')
+parser.add_argument('-table', default=0, type=int, help='angle bins of a cached range table, approximate and slow to build the first time, see range_table.py (0 ray traces every scan)')
+parser.add_argument('-model', default='beam', choices=['beam', 'field'], help='score expected scans (beam) or a likelihood field (field)')
+parser.add_argument('-rate',  default=10.0, type=float, help='rate (Hz) the scans and the estimate are republished at')
+parser.add_argument('-local', action='store_true', help='read poses "x y theta [x y theta ...]" from stdin, one request per line, instead of from ROS')
 
 args = parser.parse_args()
 
 # Get Data From Bag Files
-the_map = get_dict( args.mapbag )['/map']
-test_files = get_dict( args.databag )
+the_map = get_cached_dict( args.mapbag )['/map']
+test_files = get_cached_dict( args.databag )
 scan = test_files['/base_scan']
 truth = test_files['/base_pose_ground_truth']
 
@@ -32,60 +44,88 @@ pose = truth.pose.pose
 true_pos = pose.position.x, pose.position.y, euler_from_quaternion((pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w))[2]
 print "True Position:", true_pos
 
-scan2 = LaserScan()
-scan2.header = scan.header
-scan2.angle_min = scan.angle_min
-scan2.angle_max = scan.angle_max
-scan2.angle_increment = scan.angle_increment
-scan2.range_max = scan.range_max
+# Everything derived from the map is built here, before the first request
+start = time.time()
+table = None
+if args.table:
+    table = get_range_table(the_map, args.table, scan.range_max)
+field = None
+if args.model == 'field':
+    field = LikelihoodField(the_map)
+scorer = PoseScorer(the_map, scan, table, field)
+print "Ready in %.1f s" % (time.time() - start)
+
+# Scores a request of poses (x, y, theta), printing how long it took
+def score_request(poses, with_scans=True):
+    start = time.time()
+    inside, scores, scans = scorer.score(poses, with_scans)
+    print "Scored %d poses in %.2f ms" % (len(scores), (time.time() - start)*1000)
+    return inside, scores, scans
+
+if args.local:
+    # Stand-in for the ROS topics, for testing without a master
+    for line in sys.stdin:
+        values = [float(value) for value in line.split()]
+        if not values:
+            continue
+        if len(values) % 3:
+            print "INVALID: expected x y theta triples"
+            continue
+        inside, scores, scans = score_request(np.reshape(values, (-1, 3)), with_scans=False)
+        for pose, valid, score in zip(np.reshape(values, (-1, 3)).tolist(), inside, scores):
+            print tuple(pose), "Score: " + str(score) if valid else "INVALID"
+    sys.exit(0)
 
 rospy.init_node('query')
 mpub = rospy.Publisher('/map', OccupancyGrid, latch=True, queue_size=10)
 mpub.publish(the_map)
-pub_true = rospy.Publisher('/base_scan', LaserScan, queue_size=10)
-pub_expected = rospy.Publisher('/base_scan_expected', LaserScan, queue_size=10)
+scorepub = rospy.Publisher('/pose_scores', Float32MultiArray, queue_size=10)
 
 tposepub = rospy.Publisher('/truth', PoseStamped, latch=True, queue_size=10)
 truth = PoseStamped()
 truth.header.frame_id = '/map'
 truth.pose = apply(to_pose, true_pos)
 
-posepub = rospy.Publisher('/estimate', PoseStamped, queue_size=10)
-estimate = PoseStamped()
-estimate.header.frame_id = '/map'
+# Scans, transform and estimate are republished from a background thread, so
+# the callbacks below return as soon as the poses are scored
+publisher = BackgroundPublisher(scan, args.rate)
+publisher.update(true_pos, ranges=scan.ranges)
 
 rospy.sleep(1)
 tposepub.publish(truth)
 
-br = tf.TransformBroadcaster()
-
-publish_update(pub_true, scan, br, true_pos)
-
+# Scores a single pose clicked in rviz and shows its expected scan. The pose
+# is scored at its cell, so the center of the cell is shown.
 def pose_sub(msg):
-    print "Running pose_sub"
-    x = msg.pose.pose.position.x
-    y = msg.pose.pose.position.y
-    q = msg.pose.pose.orientation
-    theta = euler_from_quaternion((q.x, q.y, q.z, q.w))[2]
-    result = to_grid(x,y, the_map.info.origin.position.x, the_map.info.origin.position.y, the_map.info.width, the_map.info.height, the_map.info.resolution)
-    if not result:
+    x, y, theta = to_tuple(msg.pose.pose.position, msg.pose.pose.orientation)
+    inside, scores, scans = score_request([(x, y, theta)])
+    if not inside[0]:
         print "INVALID"
         return
-    else:
-        mx, my = result
-    print "About to run expected scan"
-    ex_scan = expected_scan(mx, my, theta, scan.angle_min, scan.angle_increment, len(scan.ranges), scan.range_max, the_map)
-    scan2.ranges = ex_scan
-
-    (wx, wy) = to_world(mx, my, the_map.info.origin.position.x, the_map.info.origin.position.y, the_map.info.width, the_map.info.height, the_map.info.resolution)    
-    publish_update(pub_expected, scan2, br, (wx,wy,theta))
-
-    estimate.pose = apply(to_pose, (wx,wy,theta))
-    posepub.publish(estimate)
-    print "About to run scan similarity"
-    score = scan_similarity(scan.ranges, ex_scan, scan.range_max)
-    print "Score: " + str(score)
-    
+    gx, gy = world_to_grid(x, y, the_map)
+    wx, wy = grid_to_world(gx, gy, the_map)
+    publisher.update((float(wx), float(wy), theta), ranges=scans[0].tolist())
+    print "Score: " + str(scores[0])
+
+# Scores a batch of poses and publishes their scores in the same order, 0 for
+# poses off the map. The best pose and its expected scan are shown.
+def poses_sub(msg):
+    poses = [to_tuple(pose.position, pose.orientation) for pose in msg.poses]
+    if not poses:
+        return
+    inside, scores, scans = score_request(poses, with_scans=False)
+    scorepub.publish(Float32MultiArray(data=scores.tolist()))
+    if inside.any():
+        best = top_k(scores, 1)[0]
+        if scans is None:
+            scans = scorer.score([poses[best]])[2]
+            best_scan = scans[0]
+        else:
+            best_scan = scans[best]
+        publisher.update(poses[best], np.array(poses), best_scan.tolist())
+        print "Best pose:", poses[best], "Score: " + str(scores[best])
+
 print "in bottom of query_pose"
 sub = rospy.Subscriber('/initialpose', PoseWithCovarianceStamped, pose_sub)
+batch_sub = rospy.Subscriber('/query_poses', PoseArray, poses_sub)
 rospy.spin()
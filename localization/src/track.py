@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+import roslib; roslib.load_manifest('localization')
+from localization import to_tuple
+from localization.bag import get_cached_dict, iter_messages
+from localization.synthetic import synthetic_sequence
+from localization.filter import hill_climb_step, pose_error, relative_motion
+from assignment_4.laser import *
+from assignment_4.range_table import get_range_table
+from assignment_4.likelihood import LikelihoodField
+from assignment_4.particle import *
+from timeit import default_timer
+import argparse
+import numpy as np
+
+# Parse Args
+parser = argparse.ArgumentParser(description='Particle Filter Tracker (streams a whole bag)')
+parser.add_argument('mapbag')
+parser.add_argument('databag', nargs='?')
+parser.add_argument('-particles',  default=300, type=int)
+parser.add_argument('-iterations', default=1, type=int, help='score and resample steps per scan')
+parser.add_argument('-scan_topic', default='/base_scan')
+parser.add_argument('-odom_topic', default='/odom')
+parser.add_argument('-truth_topic', default='/base_pose_ground_truth')
+parser.add_argument('-spatial_noise', default=0.1, type=float, help='motion noise per meter moved')
+parser.add_argument('-angle_noise', default=0.1, type=float, help='motion noise per radian turned')
+parser.add_argument('-table', default=0, type=int, help='angle bins of a cached range table, approximate and slow to build the first time, see range_table.py (0 ray traces every scan)')
+parser.add_argument('-synthetic', default=0, type=int, help='track this many scans of a robot driving around the map instead of a data bag')
+parser.add_argument('-seed', default=0, type=int, help='seed of the synthetic sequence')
+parser.add_argument('-model', default='beam', choices=['beam', 'field'], help='score expected scans (beam) or a likelihood field (field)')
+
+args = parser.parse_args()
+if args.databag is None and not args.synthetic:
+    parser.error('a databag or -synthetic is required')
+
+the_map = get_cached_dict( args.mapbag )['/map']
+
+table = None
+field = None
+particles = random_particles(args.particles, the_map)
+odom_at_scan = None
+odom = None
+truth = None
+latencies = []
+first_stamp = None
+last_stamp = None
+
+topics = [args.scan_topic, args.odom_topic, args.truth_topic]
+if args.synthetic:
+    messages = synthetic_sequence(the_map, args.synthetic, seed=args.seed, scan_topic=args.scan_topic,
+                                  odom_topic=args.odom_topic, truth_topic=args.truth_topic)
+else:
+    messages = iter_messages(args.databag, topics)
+
+for topic, msg, t in messages:
+    if topic == args.odom_topic:
+        odom = to_tuple(msg.pose.pose.position, msg.pose.pose.orientation)
+        continue
+    if topic == args.truth_topic:
+        truth = to_tuple(msg.pose.pose.position, msg.pose.pose.orientation)
+        continue
+
+    scan = msg
+    if first_stamp is None:
+        first_stamp = t
+        if args.table:
+            table = get_range_table(the_map, args.table, scan.range_max)
+        if args.model == 'field':
+            field = LikelihoodField(the_map)
+    last_stamp = t
+    start = default_timer()
+
+    # Motion update with the odometry since the previous scan
+    if odom is not None and odom_at_scan is not None:
+        motion = relative_motion(odom_at_scan, odom)
+        particles = motion_update(particles, motion, the_map, args.spatial_noise, args.angle_noise)
+    odom_at_scan = odom
+
+    for iteration in range(args.iterations):
+        particles, scored, grid_poses, scans, best_index = hill_climb_step(particles, args.particles, scan, the_map, table, field)
+        best_score = scored.weights[best_index]
+        best_estimate = tuple(scored.poses[best_index].tolist())
+
+    latency = default_timer() - start
+    latencies.append(latency)
+    line = "Scan %d at %.3f: %s %f (%.1f ms)" % (len(latencies), t.to_sec(), best_estimate, best_score, latency*1000)
+    if truth is not None:
+        line += " error: %.3f m %.3f rad" % pose_error(best_estimate, truth)
+    print line
+
+if latencies:
+    latencies = np.array(latencies)
+    print
+    print "Scans:", len(latencies)
+    print "Latency (ms): mean %.1f p50 %.1f p90 %.1f p99 %.1f" % tuple(1000*v for v in [latencies.mean()] + list(np.percentile(latencies, [50, 90, 99])))
+    duration = (last_stamp - first_stamp).to_sec()
+    if duration > 0:
+        print "Real time factor: %.2f" % (duration/latencies.sum())
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('localization')
+import rospy
+import tf
+from sensor_msgs.msg import LaserScan
+from localization import publisher
+from localization.publisher import BackgroundPublisher
+import copy
+import time
+import unittest
+
+# Records the messages published on a topic instead of sending them
+class StubPublisher(object):
+
+    def __init__(self, topic, msg_type, **kwargs):
+        self.topic = topic
+        self.messages = []
+
+    def publish(self, msg):
+        self.messages.append(copy.deepcopy(msg))
+
+# Records the transforms sent instead of broadcasting them
+class StubBroadcaster(object):
+
+    def __init__(self):
+        self.transforms = []
+
+    def sendTransform(self, translation, rotation, stamp, child, parent):
+        self.transforms.append((translation, child, parent))
+
+# Waits until condition() is true, returns False if it is not after timeout
+# seconds
+def wait_for(condition, timeout=5.0):
+    end = time.time() + timeout
+    while not condition():
+        if time.time() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+# Publishing thread of BackgroundPublisher, with stub publishers in place of
+# the ROS ones so no master is needed
+class TestBackgroundPublisher(unittest.TestCase):
+
+    def setUp(self):
+        self.ros_publisher = publisher.rospy.Publisher
+        self.broadcaster = publisher.tf.TransformBroadcaster
+        publisher.rospy.Publisher = StubPublisher
+        publisher.tf.TransformBroadcaster = StubBroadcaster
+        # Wall clock time without init_node
+        rospy.rostime.set_rostime_initialized(True)
+        self.scan = LaserScan()
+        self.scan.ranges = [1.0, 2.0, 3.0]
+        self.publishers = []
+
+    def tearDown(self):
+        for bp in self.publishers:
+            bp.stop()
+        publisher.rospy.Publisher = self.ros_publisher
+        publisher.tf.TransformBroadcaster = self.broadcaster
+
+    def start(self, rate, particle_rate=0):
+        bp = BackgroundPublisher(self.scan, rate, particle_rate)
+        self.publishers.append(bp)
+        return bp
+
+    def test_publishes_the_latest_update(self):
+        # The thread found nothing to publish and sleeps for a second, so the
+        # first cycle after it sees only the last of these updates
+        bp = self.start(rate=1.0)
+        for i in range(3):
+            bp.update((i, 2*i, 0.5), [(i, 0, 0), (i, 1, 0)], [i]*3)
+        self.assertTrue(wait_for(lambda: bp.posepub.messages))
+        estimate = bp.posepub.messages[0].pose.position
+        self.assertEqual((estimate.x, estimate.y), (2, 4))
+        self.assertEqual(list(bp.laserpub_expected.messages[0].ranges), [2, 2, 2])
+        self.assertEqual(list(bp.laserpub_true.messages[0].ranges), [1.0, 2.0, 3.0])
+        self.assertEqual([pose.position.x for pose in bp.papub.messages[0].poses], [2, 2])
+        self.assertEqual(bp.br.transforms[0], ((2, 4, 0), '/base_laser_link', '/map'))
+        # The scan given to the publisher is not changed
+        self.assertEqual(list(self.scan.ranges), [1.0, 2.0, 3.0])
+
+    def test_republishes_until_updated(self):
+        bp = self.start(rate=100.0)
+        bp.update((1, 1, 0))
+        self.assertTrue(wait_for(lambda: bp.cycles >= 3))
+        bp.update((5, 1, 0))
+        self.assertTrue(wait_for(lambda: bp.posepub.messages[-1].pose.position.x == 5))
+        xs = [message.pose.position.x for message in bp.posepub.messages]
+        self.assertTrue(xs.count(1) >= 3)
+        self.assertEqual(sorted(xs), xs)
+
+    def test_stats_are_published_once(self):
+        bp = self.start(rate=100.0)
+        bp.update((1, 1, 0))
+        bp.update_stats({'counters': {'particles': 5}, 'timers': {'score': {'seconds': 0.5, 'calls': 2}}})
+        self.assertTrue(wait_for(lambda: bp.cycles >= 5))
+        self.assertEqual(len(bp.diagpub.messages), 1)
+        values = dict((value.key, value.value) for value in bp.diagpub.messages[0].status[0].values)
+        self.assertEqual(values, {'particles': '5', 'score seconds': '0.500000', 'score calls': '2'})
+
+    def test_stop(self):
+        bp = self.start(rate=1.0)
+        bp.update((1, 1, 0))
+        self.assertTrue(wait_for(lambda: bp.posepub.messages))
+        # stop() does not wait for the end of the period
+        start = time.time()
+        bp.stop()
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertFalse(bp.thread.is_alive())
+        published = len(bp.posepub.messages)
+        bp.update((2, 1, 0))
+        time.sleep(0.1)
+        self.assertEqual(len(bp.posepub.messages), published)
+
+if __name__ == '__main__':
+    import rosunit
+    rosunit.unitrun('localization', 'test_publisher', TestBackgroundPublisher)
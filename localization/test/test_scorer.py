@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('localization')
+from sensor_msgs.msg import LaserScan
+from localization.bag import get_cached_dict
+from localization.filter import score_particles_at
+from localization.scorer import PoseScorer
+from assignment_4.grid import world_to_grid, grid_to_world
+from assignment_4.laser import batch_expected_scan
+from assignment_4.likelihood import LikelihoodField
+import numpy as np
+import math
+import os
+import subprocess
+import sys
+import unittest
+
+sys.path.append(os.path.join(roslib.packages.get_pkg_dir('assignment_4'), 'test'))
+from fixtures import box_map, free_poses
+
+PACKAGE = roslib.packages.get_pkg_dir('localization')
+
+# PoseScorer against score_particles_at, and query_pose -local
+class TestPoseScorer(unittest.TestCase):
+
+    def setUp(self):
+        self.the_map = box_map()
+        grid_poses = free_poses(self.the_map, 30)
+        self.scan = LaserScan()
+        self.scan.angle_min = -3*math.pi/4
+        self.scan.angle_increment = 3*math.pi/2/36
+        self.scan.range_max = 2.0
+        self.scan.ranges = batch_expected_scan(grid_poses[:1], self.scan.angle_min, self.scan.angle_increment, 37,
+                                               self.scan.range_max, self.the_map)[0].tolist()
+        # World poses inside the cells of the free poses, and two off the map
+        x, y = grid_to_world(grid_poses[:, 0], grid_poses[:, 1], self.the_map)
+        offset = np.random.RandomState(0).uniform(-0.4, 0.4, (2, len(grid_poses)))*self.the_map.info.resolution
+        poses = np.column_stack((x + offset[0], y + offset[1], grid_poses[:, 2]))
+        info = self.the_map.info
+        outside = [(info.origin.position.x - 0.1, 0, 0), (0, info.origin.position.y + info.height*info.resolution + 0.1, 1)]
+        self.poses = np.vstack((poses[:10], outside, poses[10:]))
+        self.grid_poses = grid_poses
+
+    def assert_matches(self, field):
+        scorer = PoseScorer(self.the_map, self.scan, field=field)
+        inside, scores, scans = scorer.score(self.poses)
+        np.testing.assert_array_equal(np.flatnonzero(~inside), [10, 11])
+        self.assertTrue((scores[~inside] == 0).all())
+        self.assertTrue(np.isnan(scans[~inside]).all())
+        gx, gy = world_to_grid(self.poses[inside, 0], self.poses[inside, 1], self.the_map)
+        np.testing.assert_array_equal(np.column_stack((gx, gy)), self.grid_poses[:, :2])
+        expected_scores, expected_scans = score_particles_at(self.grid_poses, self.scan, self.the_map, field=field)
+        np.testing.assert_allclose(scores[inside], expected_scores, rtol=0, atol=1e-12)
+        if expected_scans is not None:
+            np.testing.assert_array_equal(scans[inside], expected_scans)
+        self.assertAlmostEqual(scores[0], 1.0)
+        return scorer
+
+    def test_beam_scores(self):
+        scorer = self.assert_matches(None)
+        self.assertEqual((scorer.requests, scorer.poses_scored), (1, len(self.poses)))
+
+    def test_field_scores(self):
+        field = LikelihoodField(self.the_map)
+        scorer = self.assert_matches(field)
+        inside, scores, scans = scorer.score(self.poses, with_scans=False)
+        self.assertTrue(scans is None)
+        # Expected scans are cast when asked for
+        scans = scorer.score(self.poses[:1])[2]
+        np.testing.assert_allclose(scans[0], self.scan.ranges, rtol=0, atol=1e-9)
+
+    def test_local_mode(self):
+        mapbag = os.path.join(PACKAGE, 'CSE550Map.bag')
+        databag = os.path.join(PACKAGE, 'cse550-1.bag')
+        the_map = get_cached_dict(mapbag)['/map']
+        scan = get_cached_dict(databag)['/base_scan']
+        info = the_map.info
+        poses = [(1.0, 2.0, 0.5), (-1.5, 0.5, 3.0), (info.origin.position.x - 1, 0, 0)]
+        requests = '%s\n\n1 2\n%s %s %s\n' % (' '.join('%r %r %r' % pose for pose in poses[:2]), poses[2][0], 0, 0)
+        process = subprocess.Popen([sys.executable, os.path.join(PACKAGE, 'src', 'query_pose.py'), mapbag, databag, '-local'],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+        output = process.communicate(requests)[0].splitlines()
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(len([line for line in output if line.startswith('Scored 2 poses')]), 1)
+        self.assertTrue('INVALID: expected x y theta triples' in output)
+        results = [line for line in output if line.startswith('(')]
+        self.assertEqual(len(results), 3)
+        self.assertTrue(results[2].endswith('INVALID'))
+        # The scores printed are those of a scorer of the same scan
+        scores = PoseScorer(the_map, scan).score(poses[:2])[1]
+        for line, score in zip(results[:2], scores):
+            self.assertAlmostEqual(float(line.split('Score: ')[1]), score, places=6)
+
+if __name__ == '__main__':
+    import rosunit
+    rosunit.unitrun('localization', 'test_scorer', TestPoseScorer)